@@ -0,0 +1,142 @@
+"""Compact array-backed representation of UASTs which is used by the analyzers."""
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple  # noqa: F401
+
+import bblfsh
+import numpy
+
+
+class FlatUAST:
+    """
+    UAST flattened into numpy arrays.
+
+    The tree is converted once, after that the code accesses the arrays instead of walking \
+    the protobuf nodes. The nodes are stored in the preorder, the children follow in their \
+    original order. The strings are interned: `token`, `internal_type` and `roles` are indices \
+    in `tokens`, `internal_types` and `role_sets` respectively. The empty token always has \
+    index 0. The original nodes are kept in `nodes` for the code which still needs them.
+
+    Each analyzer flattens the trees it needs on its own: the format analyzer flattens the head \
+    files with its node fixtures and the typos analyzer flattens the base files as they are, \
+    so there is no tree which both of them could reuse.
+    """
+
+    def __init__(self, root: bblfsh.Node,
+                 node_fixtures: Optional[Mapping[str, Callable[[bblfsh.Node], bblfsh.Node]]]
+                 = None) -> None:
+        """
+        Flatten the UAST.
+
+        :param root: UAST root node.
+        :param node_fixtures: Functions which fix the nodes of the specified internal types. \
+                              They are applied before the nodes are flattened.
+        """
+        self.nodes = []  # type: List[bblfsh.Node]
+        tokens_index = {"": 0}
+        internal_types_index = {}  # type: Dict[str, int]
+        role_sets_index = {}  # type: Dict[Tuple[int, ...], int]
+        parent, depth, positions, token, internal_type, roles = [], [], [], [], [], []
+        stack = [(root, -1, 0)]
+        while stack:
+            node, node_parent, node_depth = stack.pop()
+            if node_fixtures and node.internal_type in node_fixtures:
+                node = node_fixtures[node.internal_type](node)
+            index = len(self.nodes)
+            self.nodes.append(node)
+            parent.append(node_parent)
+            depth.append(node_depth)
+            start, end = node.start_position, node.end_position
+            positions.append((start.offset, start.line, start.col,
+                              end.offset, end.line, end.col))
+            token.append(tokens_index.setdefault(node.token, len(tokens_index)))
+            internal_type.append(internal_types_index.setdefault(
+                node.internal_type, len(internal_types_index)))
+            roles.append(role_sets_index.setdefault(tuple(node.roles), len(role_sets_index)))
+            stack.extend((child, index, node_depth + 1) for child in reversed(node.children))
+        self.tokens = sorted(tokens_index, key=tokens_index.get)
+        self.internal_types = sorted(internal_types_index, key=internal_types_index.get)
+        self.role_sets = sorted(role_sets_index, key=role_sets_index.get)
+        self.parent = numpy.array(parent, dtype=numpy.int32)
+        self.depth = numpy.array(depth, dtype=numpy.int32)
+        self.start_offset, self.start_line, self.start_col, \
+            self.end_offset, self.end_line, self.end_col = \
+            numpy.array(positions, dtype=numpy.int64).reshape(-1, 6).T
+        self.token = numpy.array(token, dtype=numpy.int32)
+        self.internal_type = numpy.array(internal_type, dtype=numpy.int32)
+        self.roles = numpy.array(roles, dtype=numpy.int32)
+        # the children of each node in the CSR format; they are sorted in preorder already
+        self.children_indices = numpy.argsort(self.parent[1:], kind="stable").astype(
+            numpy.int32) + 1
+        self.children_indptr = numpy.zeros(len(self.nodes) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(self.parent[1:], minlength=len(self.nodes)),
+                     out=self.children_indptr[1:])
+        self.first_child = numpy.full(len(self.nodes), -1, dtype=numpy.int32)
+        has_children = self.children_count > 0
+        self.first_child[has_children] = self.children_indices[
+            self.children_indptr[:-1][has_children]]
+        self.next_sibling = numpy.full(len(self.nodes), -1, dtype=numpy.int32)
+        previous, following = self.children_indices[:-1], self.children_indices[1:]
+        siblings = self.parent[previous] == self.parent[following]
+        self.next_sibling[previous[siblings]] = following[siblings]
+
+    def __len__(self) -> int:
+        """Return the number of the nodes."""
+        return len(self.nodes)
+
+    @property
+    def children_count(self) -> numpy.ndarray:
+        """Return the number of the children of each node."""
+        return numpy.diff(self.children_indptr)
+
+    def children(self, index: int) -> numpy.ndarray:
+        """
+        Return the children of the node.
+
+        :param index: Index of the node.
+        :return: Indices of the children.
+        """
+        return self.children_indices[self.children_indptr[index]:self.children_indptr[index + 1]]
+
+    def role_mask(self, role: int) -> numpy.ndarray:
+        """
+        Find the nodes which have the role.
+
+        :param role: Role identifier, see `bblfsh.role_id()`.
+        :return: Boolean array with one element per node.
+        """
+        return numpy.array([role in role_set for role_set in self.role_sets],
+                           dtype=bool)[self.roles]
+
+    def postorder(self) -> numpy.ndarray:
+        """
+        Calculate the positions of the nodes in the postorder traversal.
+
+        :return: Array with one element per node.
+        """
+        sizes = [1] * len(self.nodes)
+        parent = self.parent.tolist()
+        # the descendants always follow their ancestors in the preorder
+        for i in range(len(sizes) - 1, 0, -1):
+            sizes[parent[i]] += sizes[i]
+        return numpy.arange(len(sizes)) + numpy.array(sizes) - 1 - self.depth
+
+    def parents_mapping(self) -> Dict[int, bblfsh.Node]:
+        """
+        Build the mapping from the id of a node to its parent node.
+
+        :return: The mapping for every node except the root.
+        """
+        nodes = self.nodes
+        return {id(nodes[i]): nodes[p] for i, p in enumerate(self.parent.tolist()) if p >= 0}
+
+    @staticmethod
+    def remap(table: Sequence, other_table: Sequence) -> numpy.ndarray:
+        """
+        Translate the indices in `other_table` to the indices in `table`.
+
+        :param table: Interned values, e.g. `tokens`.
+        :param other_table: Interned values of another FlatUAST.
+        :return: Array which maps the indices in `other_table` to the indices in `table`, \
+                 -1 if the value is missing in `table`.
+        """
+        index = {value: i for i, value in enumerate(table)}
+        return numpy.array([index.get(value, -1) for value in other_table], dtype=numpy.int32)
@@ -206,10 +206,15 @@ class FormatAnalyzer(Analyzer):
             # ensure that the features are reproducible
             train_files = sorted(train_files, key=lambda x: x.path)
             test_files = sorted(test_files, key=lambda x: x.path)
-            X_train, y_train, _ = fe.extract_features(train_files)
+            if lang_config["streaming_extraction"]:
+                extract_features = functools.partial(fe.extract_features_streaming,
+                                                     n_jobs=lang_config["n_jobs"])
+            else:
+                extract_features = fe.extract_features
+            X_train, y_train = extract_features(train_files)[:2]
             X_train, selected_features = fe.select_features(X_train, y_train)
             if test_files:
-                X_test, y_test, _ = fe.extract_features(test_files)
+                X_test, y_test = extract_features(test_files)[:2]
             if lang_config["test_dataset_ratio"]:
                 _log.debug("Real test ratio is %.3f",
                            X_test.shape[0] / (X_test.shape[0] + X_train.shape[0])
@@ -243,13 +248,17 @@ class FormatAnalyzer(Analyzer):
                 "\n\t".join("%-55s %.5E" % (fe.feature_names[i], importances[i])
                             for i in numpy.argsort(-importances)[:25] if importances[i] > 1e-5))
             trainable_rules.prune_categorical_attributes(fe)
+            if lang_config["prune_dominated_rules"]:
+                trainable_rules.prune_dominated_rules()
             _log.info("obtained %d rules, generating the classification report",
                       len(trainable_rules.rules))
             trainable_rules.rules.generate_classification_report(
-                X_train, y_train, "train", fe.composite_class_representations)
+                X_train, y_train, "train", fe.composite_class_representations,
+                n_jobs=lang_config["n_jobs"])
             if test_files:
                 trainable_rules.rules.generate_classification_report(
-                    X_test, y_test, "test", fe.composite_class_representations)
+                    X_test, y_test, "test", fe.composite_class_representations,
+                    n_jobs=lang_config["n_jobs"])
             submit_event("%s.train.%s.rules" % (cls.name, language), len(trainable_rules.rules))
             if trainable_rules.rules.rules:
                 model[language] = trainable_rules.rules
@@ -279,10 +288,11 @@ class FormatAnalyzer(Analyzer):
                 log.warning("skipped %d written in %s. Rules for %s do not exist in model",
                             len(head_files), lang, lang)
                 continue
-            rules = self.model[lang]
             config = self.analyze_config[lang]
-            rules = rules.filter_by_confidence(config["confidence_threshold"]) \
-                .filter_by_support(config["support_threshold"])
+            rules = self.model.filter_rules(
+                lang, config["confidence_threshold"], config["support_threshold"],
+                generated_rules_dir=config["generated_rules_dir"],
+                early_exit=config["rules_early_exit"])
             for file in filter_files(head_files, rules.origin_config["line_length_limit"],
                                      rules.origin_config["overall_size_limit"], log=log):
                 processed_files_counter[lang] += 1
@@ -297,7 +307,12 @@ class FormatAnalyzer(Analyzer):
                         find_deleted_lines(prev_file, file),
                     )))
                 log.debug("%s %s", file.path, lines)
-                fe = FeatureExtractor(language=lang, **rules.origin_config["feature_extractor"])
+                # only the features referenced by the filtered rules are computed
+                # and only around the changed lines; the vnode parents cover the labeled
+                # vnodes on those lines which is all that UASTStabilityChecker needs
+                fe = FeatureExtractor.from_cache(language=lang, used_features=rules.used_features,
+                                                 windowed=True,
+                                                 **rules.origin_config["feature_extractor"])
                 feature_extractor_output = fe.extract_features([file], [lines])
                 if feature_extractor_output is None:
                     submit_event("%s.analyze.%s.parse_failures" % (self.name, lang), 1)
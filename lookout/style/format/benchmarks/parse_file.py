@@ -0,0 +1,71 @@
+"""Benchmark the conversion of the parsed files to the virtual nodes."""
+import glob
+import logging
+import os
+import tarfile
+import tempfile
+import timeit
+from typing import Dict, Sequence
+
+from bblfsh import BblfshClient
+from lookout.core.api.service_data_pb2 import File
+from lookout.core.lib import parse_files
+
+from lookout.style.flat_uast import FlatUAST
+from lookout.style.format.analyzer import FormatAnalyzer
+from lookout.style.format.feature_extractor import FeatureExtractor
+
+
+def benchmark_parse_file(feature_extractor: FeatureExtractor, files: Sequence[File],
+                         repeat: int = 3) -> Dict[str, float]:
+    """
+    Measure the time of `FeatureExtractor._parse_file()` on the given files.
+
+    The UASTs are flattened in advance so that only the tokenization of the gaps and \
+    the computation of the positions are measured.
+
+    :param feature_extractor: FeatureExtractor which parses the files.
+    :param files: Parsed files.
+    :param repeat: Number of measurements. The best time is reported.
+    :return: The number of the files, the number of the virtual nodes and the best time \
+             in seconds.
+    """
+    parsed = [(file.content.decode("utf-8", "replace"),
+               FlatUAST(file.uast, feature_extractor.node_fixtures), file.path)
+              for file in files]
+
+    def parse_all():
+        return sum(len(feature_extractor._parse_file(*args)[0]) for args in parsed)
+
+    return {
+        "files": len(parsed),
+        "vnodes": parse_all(),
+        "time": min(timeit.repeat(parse_all, number=1, repeat=repeat)),
+    }
+
+
+def bench_parse_file_entry(input_path: str, bblfsh: str, language: str, repeat: int) -> None:
+    """
+    Entry point for `python -m lookout.style.format bench-parse-file` command.
+
+    :param input_path: Path to the tar.xz archive with the repositories, for example, \
+                       `benchmarks/data/js_smoke_init.tar.xz`.
+    :param bblfsh: Babelfish server's address.
+    :param language: Language of the files to parse.
+    :param repeat: Number of measurements.
+    """
+    log = logging.getLogger("bench_parse_file")
+    config = FormatAnalyzer._load_config({})["train"][language]
+    feature_extractor = FeatureExtractor(language=language, **config["feature_extractor"])
+    with tempfile.TemporaryDirectory(prefix="bench-parse-file-") as tmpdir:
+        with tarfile.open(input_path) as archive:
+            archive.extractall(tmpdir)
+        filepaths = glob.glob(os.path.join(tmpdir, "**", "*.js"), recursive=True)
+        files = parse_files(filepaths=filepaths,
+                            line_length_limit=config["line_length_limit"],
+                            overall_size_limit=config["overall_size_limit"],
+                            client=BblfshClient(bblfsh), language=language, log=log)
+    log.info("Parsed %d files out of %d", len(files), len(filepaths))
+    result = benchmark_parse_file(feature_extractor, files, repeat)
+    print("%d files, %d virtual nodes: %.3fs" % (
+        result["files"], result["vnodes"], result["time"]))
@@ -0,0 +1,201 @@
+"""Benchmark the vectorized rules evaluation modes against the row-wise implementation."""
+from collections import defaultdict
+import functools
+import logging
+import timeit
+from typing import Dict, Optional, Tuple, Union
+
+import numpy
+from scipy.sparse import csr_matrix
+
+from lookout.style.format.feature_extractor import FEATURES_MAX, FEATURES_MIN, \
+    FEATURES_NUMPY_TYPE
+from lookout.style.format.model import FormatModel
+from lookout.style.format.rules import Rules
+
+
+def generate_features(rules: Rules, n_samples: int, density: float,
+                      n_features: Optional[int] = None, random_state: int = 7) -> csr_matrix:
+    """
+    Generate random sparse features which trigger the rules in a realistic way.
+
+    The non-zero values of each feature are sampled around the thresholds of that feature \
+    in the rules so that the attributes are both satisfied and violated.
+
+    :param rules: Rules which are going to be evaluated.
+    :param n_samples: Number of rows to generate.
+    :param density: Fraction of the non-zero values in every column used by the rules.
+    :param n_features: Number of columns. If None, the selected features count of the origin \
+                       config is taken or the maximum feature index plus one as a fallback.
+    :param random_state: Seed of the random generator.
+    :return: Features matrix of FEATURES_NUMPY_TYPE.
+    """
+    thresholds = defaultdict(list)
+    for rule in rules.rules:
+        for attr in rule.attrs:
+            thresholds[attr.feature].append(attr.threshold)
+    if n_features is None:
+        try:
+            n_features = len(rules.origin_config["feature_extractor"]["selected_features"])
+        except (KeyError, TypeError):
+            n_features = max(thresholds, default=-1) + 1
+    random = numpy.random.RandomState(random_state)
+    data, indices, indptr = [], [], [0]
+    columns = {}
+    for feature, values in thresholds.items():
+        if feature >= n_features:
+            continue
+        values = numpy.floor(values)
+        columns[feature] = numpy.unique(numpy.clip(
+            numpy.concatenate((values, values + 1)), FEATURES_MIN + 1, FEATURES_MAX))
+    features = numpy.array(sorted(columns), dtype=numpy.int32)
+    for _ in range(n_samples):
+        row = features[random.rand(len(features)) < density]
+        indices.append(row)
+        data.append([random.choice(columns[feature]) for feature in row])
+        indptr.append(indptr[-1] + len(row))
+    return csr_matrix((numpy.concatenate(data).astype(FEATURES_NUMPY_TYPE),
+                       numpy.concatenate(indices), indptr), shape=(n_samples, n_features))
+
+
+def compute_triggered(rules: Rules, x: numpy.ndarray) -> numpy.ndarray:
+    """
+    Find the rules which are triggered by a single sample.
+
+    :param rules: Rules to evaluate.
+    :param x: Dense features of the sample.
+    :return: Indices of the triggered rules.
+    """
+    compiled_rules = rules._compiled
+    searchsorted = numpy.searchsorted
+    values, values_offsets = compiled_rules.values, compiled_rules.values_offsets
+    attr_rules, attr_offsets = compiled_rules.attr_rules, compiled_rules.attr_offsets
+    false_ends, true_starts = compiled_rules.false_ends, compiled_rules.true_starts
+    triggered = numpy.ones(len(rules.rules), dtype=bool)
+    for i, feature in enumerate(compiled_rules.features):
+        if feature >= len(x):
+            break
+        bucket = values_offsets[i] + i + searchsorted(
+            values[values_offsets[i]:values_offsets[i + 1]], x[feature])
+        triggered[attr_rules[attr_offsets[i]:false_ends[bucket]]] = False
+        triggered[attr_rules[true_starts[bucket]:attr_offsets[i + 1]]] = False
+    return numpy.nonzero(triggered)[0]
+
+
+def apply_rowwise(rules: Rules, X_csr: csr_matrix, return_winner_indices=False,
+                  ) -> Union[numpy.ndarray, Tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Evaluate the rules against the given features one sample after another.
+
+    This is the reference implementation of `Rules.apply()` which is much slower.
+
+    :param rules: Rules to evaluate.
+    :param X_csr: input features.
+    :param return_winner_indices: whether to return the winning rule index for each sample.
+    :return: the same as `Rules.apply()`.
+    """
+    X = X_csr.toarray()
+    rule_set = rules.rules
+    confs = rule_set.conf.astype(numpy.float32)
+    prediction = numpy.full(len(X), -1, dtype=numpy.int32)
+    if return_winner_indices:
+        winner_indices = numpy.full(len(X), -2, dtype=numpy.int32)
+    for xi, x in enumerate(X):
+        ris = compute_triggered(rules, x)
+        if len(ris) == 0:
+            continue
+        if len(ris) > 1:
+            winner_index = ris[numpy.argmax(confs[ris])]
+        else:
+            winner_index = ris[0]
+        prediction[xi] = rule_set.cls[winner_index]
+        if return_winner_indices:
+            winner_indices[xi] = winner_index
+    if return_winner_indices:
+        return prediction, winner_indices
+    return prediction
+
+
+def benchmark_rules_apply(rules: Rules, X: csr_matrix, repeat: int = 3) -> Dict[str, float]:
+    """
+    Measure the time of `Rules.apply()` and compare it with `apply_rowwise()`.
+
+    Both the set-based batch evaluation and the confidence-ordered early exit evaluation \
+    are measured.
+
+    :param rules: Rules to evaluate.
+    :param X: Features matrix.
+    :param repeat: Number of measurements. The best time is reported.
+    :return: The best times of the implementations in seconds and the speedups.
+    """
+    expected = apply_rowwise(rules, X, return_winner_indices=True)
+    modes = (("batch", rules._apply_batch), ("early_exit", rules._apply_early_exit))
+    for mode, apply in modes:
+        for name, exp, act in zip(("predictions", "winner indices"), expected, apply(X)):
+            if not numpy.array_equal(exp, act):
+                raise AssertionError("The %s %s differ in %d samples" % (
+                    mode, name, numpy.count_nonzero(exp != act)))
+    times = {
+        "rowwise": min(timeit.repeat(lambda: apply_rowwise(rules, X, True),
+                                     number=1, repeat=repeat)),
+    }
+    for mode, apply in modes:
+        times[mode] = min(timeit.repeat(functools.partial(apply, X), number=1,
+                                        repeat=repeat))
+    times["speedup"] = times["rowwise"] / times["batch"]
+    times["early_exit_speedup"] = times["batch"] / times["early_exit"]
+    return times
+
+
+def benchmark_rules_pruning(rules: Rules, X: csr_matrix, repeat: int = 3) -> Dict[str, float]:
+    """
+    Measure how `Rules.prune_dominated()` shrinks the rules and speeds up `Rules.apply()`.
+
+    :param rules: Rules to prune.
+    :param X: Features matrix.
+    :param repeat: Number of measurements. The best time is reported.
+    :return: The numbers of the rules before and after pruning, the best times of `apply()` \
+             in seconds and the speedup.
+    """
+    pruned = rules.prune_dominated()
+    if not numpy.array_equal(rules.apply(X), pruned.apply(X)):
+        raise AssertionError("The predictions of the pruned rules differ")
+    result = {
+        "rules": len(rules),
+        "pruned_rules": len(pruned),
+        "time": min(timeit.repeat(functools.partial(rules.apply, X), number=1, repeat=repeat)),
+        "pruned_time": min(timeit.repeat(functools.partial(pruned.apply, X), number=1,
+                                         repeat=repeat)),
+    }
+    result["speedup"] = result["time"] / result["pruned_time"]
+    return result
+
+
+def bench_rules_apply_entry(model_path: str, language: str, confidence_threshold: float,
+                            support_threshold: int, samples: int, density: float,
+                            repeat: int) -> None:
+    """
+    Entry point for `python -m lookout.style.format bench-rules-apply` command.
+
+    :param model_path: Path to the saved FormatModel.
+    :param language: Language of the rules to evaluate.
+    :param confidence_threshold: Confidence threshold to filter relevant rules.
+    :param support_threshold: Support threshold to filter relevant rules.
+    :param samples: Number of generated samples.
+    :param density: Fraction of the non-zero features in the generated samples.
+    :param repeat: Number of measurements.
+    """
+    log = logging.getLogger("bench_rules_apply")
+    rules = FormatModel().load(model_path).filter_rules(
+        language, confidence_threshold, support_threshold)
+    X = generate_features(rules, samples, density)
+    log.info("Generated %d samples with %d non-zero features on average", X.shape[0],
+             X.nnz / max(X.shape[0], 1))
+    times = benchmark_rules_apply(rules, X, repeat)
+    print("%s\nrow-wise:   %.3fs\nbatch:      %.3fs (%.1fx)\nearly exit: %.3fs (%.1fx)" % (
+        rules, times["rowwise"], times["batch"], times["speedup"], times["early_exit"],
+        times["early_exit_speedup"]))
+    pruning = benchmark_rules_pruning(rules, X, repeat)
+    print("dominated:  %d/%d rules removed, %.3fs -> %.3fs (%.1fx)" % (
+        pruning["rules"] - pruning["pruned_rules"], pruning["rules"], pruning["time"],
+        pruning["pruned_time"], pruning["speedup"]))
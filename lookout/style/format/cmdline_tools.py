@@ -94,7 +94,9 @@ def create_parser() -> ArgumentParser:
     from lookout.style.format.benchmarks.generate_smoke import generate_smoke_entry
     from lookout.style.format.benchmarks.quality_report import generate_quality_report
     from lookout.style.format.benchmarks.general_report import print_reports
+    from lookout.style.format.benchmarks.parse_file import bench_parse_file_entry
     from lookout.style.format.benchmarks.quality_report_noisy import quality_report_noisy
+    from lookout.style.format.benchmarks.rules_apply import bench_rules_apply_entry
     from lookout.style.format.benchmarks.expected_vnodes_number import \
         calc_expected_vnodes_number_entry
 
@@ -222,6 +224,34 @@ def create_parser() -> ArgumentParser:
     rule_parser.add_argument("model", help="Path to the model file.")
     rule_parser.add_argument("hash", help="Hash of the rule (8 chars).")
 
+    # Benchmark the rules evaluation
+    bench_rules_apply_parser = add_parser(
+        "bench-rules-apply", "Measure the speed of the rules evaluation on generated features.")
+    bench_rules_apply_parser.set_defaults(handler=bench_rules_apply_entry)
+    add_model_args(bench_rules_apply_parser)
+    add_rules_thresholds(bench_rules_apply_parser)
+    bench_rules_apply_parser.add_argument(
+        "-n", "--samples", type=int, default=10000, help="Number of samples to generate.")
+    bench_rules_apply_parser.add_argument(
+        "--density", type=float, default=0.1,
+        help="Fraction of the non-zero values of each feature used by the rules.")
+    bench_rules_apply_parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of measurements.")
+
+    # Benchmark the conversion of the files to the virtual nodes
+    bench_parse_file_parser = add_parser(
+        "bench-parse-file", "Measure the speed of the files conversion to the virtual nodes.")
+    bench_parse_file_parser.set_defaults(handler=bench_parse_file_entry)
+    bench_parse_file_parser.add_argument(
+        "input_path", type=str,
+        help="Path to the tar.xz archive containing the repositories to parse, e.g. "
+             "benchmarks/data/js_smoke_init.tar.xz.")
+    add_bblfsh_arg(bench_parse_file_parser)
+    bench_parse_file_parser.add_argument(
+        "--language", default="javascript", help="Language of the files to parse.")
+    bench_parse_file_parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of measurements.")
+
     # FIXME(zurk): remove when https://github.com/src-d/style-analyzer/issues/557 is resolved
     calc_expected_vnodes = add_parser("calc-expected-vnodes-number",
                                       "Write the CSV file with expected numbers of virtual nodes "
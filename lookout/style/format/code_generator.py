@@ -115,7 +115,8 @@ class CodeGenerator:
         :param vnodes_y: Sequence of the labeled `VirtualNode`-s corresponding to labeled samples.\
                          Should be ordered by start position value.
         :param rule_winners: Sequence of applied rules to generate y_pred.
-        :param rules: Rules that were used for prediction.
+        :param rules: Rules that were used for prediction, including the artificial ones - \
+                      usually the `LayeredRules` returned by `Rules.predict()`.
         :return: The list of VirtualNode-s with adjusted labels. "y_old" attribute of each node \
                  contains the previous label.
         """
@@ -56,11 +56,23 @@ DEFAULT_CONFIG = {
                 "min_samples_split_max": 240,
             },
             "random_state": 42,
+            # processes to evaluate the rules for the classification report and to extract
+            # the features in the streaming mode, negative values are counted from the number
+            # of CPUs. The processes are forked, and forking the multi-threaded analyzer
+            # service (gRPC workers, held locks) can deadlock the children, so only increase
+            # it when training in a standalone process.
+            "n_jobs": 1,
             "test_dataset_ratio": 0.0,
             "line_length_limit": 500,
             "lower_bound_instances": 500,
             "overall_size_limit": 5 << 20,  # 5 MB
             "lines_ratio_train_trigger": 0.2,
+            # parse and convert the files one by one to bound the memory, see
+            # FeatureExtractor.extract_features_streaming()
+            "streaming_extraction": False,
+            # remove the rules which can never win, the predictions stay the same,
+            # see Rules.prune_dominated()
+            "prune_dominated_rules": False,
         },
     },
     "analyze": {
@@ -71,6 +83,11 @@ DEFAULT_CONFIG = {
             "report_triggered_rules": False,
             "report_parse_failures": False,
             "uast_break_check": True,
+            # evaluate the rules with the generated code cached in this directory,
+            # see Rules.use_generated_code()
+            "generated_rules_dir": None,
+            # evaluate the rules in the order of decreasing confidence, see Rules.use_early_exit()
+            "rules_early_exit": False,
         },
         "comment_template": os.path.join(os.path.join(os.path.dirname(__file__), "templates"),
                                          "comment.jinja2"),
@@ -1,26 +1,33 @@
 """Feature extraction module."""
 from collections import defaultdict, OrderedDict
+import copy
+import hashlib
 import importlib
 from itertools import chain, islice, zip_longest
+import json
 import logging
 from operator import itemgetter
-from typing import (Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple, Union)
+import threading
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional,
+                    Sequence, Set, Tuple, Union)
 
 import bblfsh
 from lookout.core.api.service_data_pb2 import File
 import numpy
-from scipy.sparse import csr_matrix, hstack, vstack
+from scipy.sparse import csr_matrix, vstack
 from sklearn.exceptions import NotFittedError
 from sklearn.feature_selection import SelectKBest, VarianceThreshold
 
+from lookout.style.flat_uast import FlatUAST
 from lookout.style.format.classes import (
     CLASS_INDEX, CLASS_PRINTABLES, CLASS_REPRESENTATIONS, CLS_DOUBLE_QUOTE, CLS_NOOP,
     CLS_SINGLE_QUOTE, CLS_SPACE, CLS_SPACE_DEC, CLS_SPACE_INC, CLS_TAB, CLS_TAB_DEC, CLS_TAB_INC,
     INDEX_CLS_TO_STR, NEWLINE_INDEX, QUOTES_INDEX)
 from lookout.style.format.features import (  # noqa: F401
-    Feature, FEATURE_CLASSES, FeatureGroup, FeatureId, FeatureLayout, Layout,
+    COOBuffer, CSRBuffer, Feature, FEATURE_CLASSES, FeatureGroup, FeatureId, FeatureLayout, Layout,
     MultipleValuesFeature, MutableFeatureLayout, MutableLayout)
-from lookout.style.format.virtual_node import AnyNode, Position, VirtualNode
+from lookout.style.format.utils import can_fork, get_processes_number, map_forked
+from lookout.style.format.virtual_node import AnyNode, Position, VirtualNode, VNodeTable
 
 
 IndexToFeature = List[Tuple[FeatureGroup, int, FeatureId, int]]
@@ -29,11 +36,63 @@ FEATURES_NUMPY_TYPE = numpy.uint8
 FEATURES_MIN = numpy.iinfo(FEATURES_NUMPY_TYPE).min
 FEATURES_MAX = numpy.iinfo(FEATURES_NUMPY_TYPE).max
 
+_NOOP_Y = (CLASS_INDEX[CLS_NOOP],)
+_QUOTE_CLASSES = frozenset((CLASS_INDEX[CLS_DOUBLE_QUOTE], CLASS_INDEX[CLS_SINGLE_QUOTE]))
+
+
+class _SiblingsIndex(NamedTuple("_SiblingsIndex", (("indices", List[int]),
+                                                   ("positions", List[int])))):
+    """
+    Sorted indices of the vnodes which can be siblings.
+
+    `positions[i]` is the number of the siblings before the i-th vnode, so the nearest \
+    siblings of any vnode are found with a slice of `indices`.
+    """
+
+    @classmethod
+    def build(cls, indices: List[int], size: int) -> "_SiblingsIndex":
+        """
+        Construct the index from the sorted sibling indices.
+
+        :param indices: Sorted indices of the siblings.
+        :param size: Number of the vnodes.
+        :return: New _SiblingsIndex.
+        """
+        positions = numpy.searchsorted(indices, numpy.arange(size + 1)).tolist()
+        return cls(indices, positions)
+
+
+def _shard_args(state: Tuple["FeatureExtractor", Sequence[File], Optional[List[List[int]]]],
+                bounds: Tuple[int, int]) -> Tuple[Sequence[File], Optional[List[List[int]]]]:
+    # the feature extractor, the files and the lines are inherited by the forked worker
+    # processes, see FeatureExtractor._map_shards()
+    _, files, lines = state
+    start, end = bounds
+    return files[start:end], lines[start:end] if lines is not None else None
+
+
+def _count_labels_support_shard(
+        state: Tuple["FeatureExtractor", Sequence[File], Optional[List[List[int]]]],
+        bounds: Tuple[int, int]) -> Dict[Tuple[int, ...], int]:
+    fe = state[0]
+    files, lines = _shard_args(state, bounds)
+    return dict(fe._count_labels_support(chain.from_iterable(
+        file_vnodes for _, file_vnodes, _, _ in fe._iter_parsed_files(files, lines))))
+
+
+def _extract_features_shard(
+        state: Tuple["FeatureExtractor", Sequence[File], Optional[List[List[int]]]],
+        bounds: Tuple[int, int]) -> Optional[Tuple[csr_matrix, numpy.ndarray]]:
+    return state[0]._extract_features_sequentially(*_shard_args(state, bounds))
+
 
 class FeatureExtractor:
     """Extract features for downstream models."""
 
     _log = logging.getLogger("FeaturesExtractor")
+    _cache = OrderedDict()  # type: Dict[Tuple[str, str], FeatureExtractor]
+    _cache_size = 16
+    _cache_lock = threading.Lock()
 
     def __init__(self, *, language: str, left_siblings_window: int, right_siblings_window: int,
                  parents_depth: int, node_features: Sequence[str], left_features: Sequence[str],
@@ -42,7 +101,9 @@ class FeatureExtractor:
                  debug_parsing: bool, return_sibling_indices: bool,
                  selected_features: Optional[numpy.ndarray] = None,
                  label_composites: Optional[List[Tuple[int, ...]]] = None,
-                 cutoff_label_support: int = 0) -> None:
+                 cutoff_label_support: int = 0,
+                 used_features: Optional[numpy.ndarray] = None,
+                 windowed: bool = False) -> None:
         """
         Construct a `FeatureExtractor`.
 
@@ -66,6 +127,18 @@ class FeatureExtractor:
                                  this mapping inside `extract_features()`. Otherwise, we are in \
                                  "analyze" stage.
         :param cutoff_label_support: Minimum number of samples for each class to be included.
+        :param used_features: Indices of the selected features which are used downstream, \
+                              e.g. `Rules.used_features` at the "analyze" stage. Only these \
+                              columns are computed, the rest of the features matrix stays \
+                              zero. If None, all the selected features are computed.
+        :param windowed: Whether to search the neighbours and the parents only around the \
+                         enabled lines if they are specified, e.g. the changed lines at the \
+                         "analyze" stage. The features are the same as without the window, \
+                         but the returned vnode parents are limited to the labeled vnodes on \
+                         those lines and the vnodes between them. The whole file is still \
+                         parsed: the labels and the noops of the vnodes depend on the preceding \
+                         vnodes, and the returned vnodes must reproduce the whole file for the \
+                         code generator.
         """
         self.language = language.lower()
         self.left_siblings_window = left_siblings_window
@@ -81,6 +154,8 @@ class FeatureExtractor:
         self.return_sibling_indices = return_sibling_indices
         self.selected_features = selected_features
         self.cutoff_label_support = cutoff_label_support
+        self.used_features = used_features
+        self.windowed = windowed
         self.labels_to_class_sequences = list(map(tuple, label_composites)) \
             if label_composites is not None else []
         self.class_sequences_to_labels = {
@@ -103,6 +178,56 @@ class FeatureExtractor:
         if self.labels_to_class_sequences:
             self._compute_feature_info()
 
+    @classmethod
+    def from_cache(cls, *, language: str, **config: Any) -> "FeatureExtractor":
+        """
+        Get the feature extractor with the given parameters, constructing it only once.
+
+        The constructed feature extractors are cached by the language and the hash of the \
+        configuration, so that the features are not created again for each analyzed file. \
+        The configuration must include `label_composites` ("analyze" stage) for the result \
+        to be usable. The returned instance is a `clone()`, so it is safe to use it in parallel.
+
+        :param language: Which language to extract features for.
+        :param config: The rest of `__init__()` arguments, e.g. \
+                       `Rules.origin_config["feature_extractor"]`.
+        :return: FeatureExtractor which shares the immutable state with the cached one.
+        """
+        key = language, cls._hash_config(config)
+        with cls._cache_lock:
+            try:
+                fe = cls._cache[key]
+                cls._cache.move_to_end(key)
+            except KeyError:
+                fe = cls._cache[key] = cls(language=language, **config)
+                if len(cls._cache) > cls._cache_size:
+                    cls._cache.popitem(last=False)
+        return fe.clone()
+
+    def clone(self) -> "FeatureExtractor":
+        """
+        Make a cheap copy which shares the immutable state with this instance.
+
+        The features and the language modules are shared. The mapping between the labels and \
+        the class sequences is copied because `Rules.harmonize_quotes()` extends it.
+
+        :return: New FeatureExtractor.
+        """
+        fe = copy.copy(self)
+        fe.labels_to_class_sequences = list(self.labels_to_class_sequences)
+        fe.class_sequences_to_labels = dict(self.class_sequences_to_labels)
+        return fe
+
+    @staticmethod
+    def _hash_config(config: Mapping[str, Any]) -> str:
+        def default(obj: Any) -> Any:
+            if isinstance(obj, (numpy.ndarray, numpy.generic)):
+                return obj.tolist()
+            raise TypeError("%s is not JSON serializable" % type(obj).__name__)
+
+        return hashlib.sha256(json.dumps(config, sort_keys=True, default=default).encode()) \
+            .hexdigest()
+
     @property
     def index_to_feature(self) -> IndexToFeature:
         """Return the mapping from integer indices to the corresponding feature names."""
@@ -187,7 +312,10 @@ class FeatureExtractor:
                       mentioned will not be extracted.
         :return: tuple of numpy.ndarray (2 and 1 dimensional respectively): features and labels, \
                  the corresponding `VirtualNode`-s and the parents mapping \
-                 or None in case no features were extracted.
+                 or None in case no features were extracted. The vnode parents map the ids of \
+                 all the vnodes unless `windowed` is True and `lines` are specified; then only \
+                 the labeled vnodes on the lines and the vnodes between them are mapped, which \
+                 includes all the returned labeled vnodes.
         """
         parsed_files, node_parents, vnode_parents = self._parse_vnodes(files, lines)
         xy = self._convert_files_to_xy(parsed_files)
@@ -199,6 +327,52 @@ class FeatureExtractor:
             return X, y, (vnodes_y, vnodes, vnode_parents, node_parents, sibling_indices_list)
         return X, y, (vnodes_y, vnodes, vnode_parents, node_parents)
 
+    def extract_features_streaming(self, files: Sequence[File],
+                                   lines: Optional[List[List[int]]] = None, n_jobs: int = 1,
+                                   ) -> Optional[Tuple[csr_matrix, numpy.ndarray]]:
+        """
+        Compute features and labels file by file without keeping the parsed files in memory.
+
+        Each file is parsed, converted to the rows of the features matrix and released before \
+        the next one, so the memory is bounded by the largest file instead of all the files. \
+        If the labels are not known yet, the files are parsed twice: the first pass counts \
+        the support of the labels.
+
+        Both passes can run in several forked processes, each takes a contiguous range of \
+        the files. The label support of the ranges is merged in the order of the files and \
+        the rows are concatenated in the same order, so the result does not depend on `n_jobs`.
+
+        :param files: the list of `File`-s (see service_data.proto) of the same language.
+        :param lines: the list of enabled line numbers per file. The lines which are not \
+                      mentioned will not be extracted.
+        :param n_jobs: number of processes. Negative values are counted from the number of \
+                       CPUs like in joblib: -1 means all the CPUs.
+        :return: The same features and labels as `extract_features()` returns, without \
+                 the `VirtualNode`-s, or None in case no features were extracted.
+        """
+        n_jobs = get_processes_number(n_jobs)
+        shards = self._split_files(files, n_jobs)
+        if not self.labels_to_class_sequences:
+            support = defaultdict(int)  # type: Dict[Tuple[int, ...], int]
+            for shard_support in self._map_shards(_count_labels_support_shard, files, lines,
+                                                  shards, n_jobs):
+                for class_seq, count in shard_support.items():
+                    support[class_seq] += count
+            self._compute_labels_mappings_from_support(support)
+            self._compute_feature_info()
+        results = self._map_shards(_extract_features_shard, files, lines, shards, n_jobs)
+        if not any(result is not None for result in results):
+            # nothing was extracted
+            return None
+        results = [result for result in results if result is not None]
+        if len(results) == 1:
+            X, y = results[0]
+        else:
+            X = vstack([X for X, _ in results], format="csr")
+            y = numpy.concatenate([y for _, y in results])
+        self._log.debug("Features shape: %s", X.shape)
+        return X, y
+
     def select_features(self, X: csr_matrix, y: numpy.ndarray) -> Tuple[csr_matrix, numpy.ndarray]:
         """
         Select the most useful features based on sklearn's univariate feature selection.
@@ -235,6 +409,8 @@ class FeatureExtractor:
     def _compute_feature_info(self) -> None:
         if self.selected_features is not None:
             selected_features_set = set(self.selected_features)
+        if self.used_features is not None:
+            used_features_set = set(self.used_features)
 
         def populate_indices(feature_group: FeatureGroup, feature_names: Sequence[str],
                              nodes_number: int, total_index: int) -> int:
@@ -254,10 +430,15 @@ class FeatureExtractor:
                         neighbour_group=feature_group,
                         neighbour_index=node_index)
                     selected_indices = []
+                    used_indices, used_columns = [], []
                     names = feature_pre_selection.names
                     for index, name in enumerate(names):
                         if self.selected_features is None or total_index in selected_features_set:
                             selected_indices.append(index)
+                            column = len(self._index_to_feature)
+                            if self.used_features is None or column in used_features_set:
+                                used_indices.append(index)
+                                used_columns.append(column)
                             if issubclass(feature_class, MultipleValuesFeature):
                                 last_name_part = "%s.%s" % (feature_pre_selection.id.name, name)
                             else:
@@ -270,17 +451,34 @@ class FeatureExtractor:
                             self._index_to_feature.append((feature_group, node_index, feature_id,
                                                            index))
                         total_index += 1
-                    self._features[feature_group][node_index][feature_id] = feature_class(
-                        language=self.language,
-                        labels_to_class_sequences=self.labels_to_class_sequences,
-                        selected_indices=selected_indices,
-                        neighbour_group=feature_group,
-                        neighbour_index=node_index)
+                    if not selected_indices:
+                        # nothing to compute, the feature does not have columns after selection
+                        continue
+                    feature = self._features[feature_group][node_index][feature_id] = \
+                        feature_class(
+                            language=self.language,
+                            labels_to_class_sequences=self.labels_to_class_sequences,
+                            selected_indices=selected_indices,
+                            neighbour_group=feature_group,
+                            neighbour_index=node_index)
+                    if not used_indices:
+                        continue
+                    if len(used_indices) < len(selected_indices):
+                        feature = feature_class(
+                            language=self.language,
+                            labels_to_class_sequences=self.labels_to_class_sequences,
+                            selected_indices=used_indices,
+                            neighbour_group=feature_group,
+                            neighbour_index=node_index)
+                    self._computed_features.append(
+                        (feature, numpy.array(used_columns, dtype=numpy.int64)))
             return total_index
         self._index_to_feature = []  # type: IndexToFeature
         self._feature_to_indices = OrderedDict()  # type: MutableFeatureLayout[List[int]]
         self._feature_names = []  # type: List[str]
         self._features = OrderedDict()  # type: MutableFeatureLayout[Feature]
+        # the features which are computed and their columns in the features matrix
+        self._computed_features = []  # type: List[Tuple[Feature, numpy.ndarray]]
         total_index = 0
         total_index = populate_indices(FeatureGroup.node, self.node_features, 1, total_index)
         total_index = populate_indices(FeatureGroup.left, self.left_features,
@@ -298,19 +496,70 @@ class FeatureExtractor:
                                       for group, counts in self._feature_node_counts.items()}
         self._feature_count = sum(self._feature_group_counts.values())
 
-    def _parse_vnodes(self, files: Iterable[File], lines: Optional[List[List[int]]] = None,
-                      ) -> Tuple[List[Tuple[List[VirtualNode], Dict[int, bblfsh.Node], Set[int]]],
-                                 Dict[int, bblfsh.Node],
-                                 Dict[int, bblfsh.Node]]:
-        node_parents = {}
-        vnode_parents = {}
-        parsed_files = []
+    def _extract_features_sequentially(self, files: Sequence[File],
+                                       lines: Optional[List[List[int]]],
+                                       ) -> Optional[Tuple[csr_matrix, numpy.ndarray]]:
+        matrix = CSRBuffer(self._feature_count)
+        buffer = COOBuffer()
+        labels = []
+        for _, file_vnodes, file_parents, file_lines in self._iter_parsed_files(files, lines):
+            file_vnodes_y, labeled_range = self._select_labeled(file_vnodes, file_lines)
+            labels.append([self.class_sequences_to_labels[vnode.y] for vnode in file_vnodes_y])
+            self._append_file_features(matrix, buffer, file_vnodes, file_vnodes_y, labeled_range,
+                                       file_parents)
+        if not labels:
+            return None
+        y = numpy.array(list(chain.from_iterable(labels)), dtype=numpy.int64)
+        assert len(y) == matrix.rows
+        return matrix.to_csr(), y
+
+    @staticmethod
+    def _split_files(files: Sequence[File], n_jobs: int) -> List[Tuple[int, int]]:
+        """
+        Split the files into contiguous ranges of roughly the same total size.
+
+        :param files: `File`-s to split.
+        :param n_jobs: positive number of processes.
+        :return: Bounds of the ranges. There is a single range if the files should be \
+                 processed in the current process.
+        """
+        if n_jobs <= 1 or len(files) <= 1 or not can_fork():
+            return [(0, len(files))]
+        # several ranges per process to even out the load
+        n_shards = min(len(files), n_jobs * 4)
+        sizes = numpy.cumsum([len(file.content) for file in files])
+        borders = numpy.searchsorted(
+            sizes, numpy.linspace(0, sizes[-1], n_shards + 1)[1:-1], side="right")
+        borders = numpy.unique(numpy.concatenate(([0], borders, [len(files)]))).tolist()
+        return list(zip(borders[:-1], borders[1:]))
+
+    def _map_shards(self, func: Callable[[Tuple[int, int]], Any], files: Sequence[File],
+                    lines: Optional[List[List[int]]], shards: List[Tuple[int, int]],
+                    n_jobs: int) -> List[Any]:
+        """
+        Call the function on each range of the files, in forked processes if there are several.
+
+        :param func: Module-level function which takes this object, the files and the lines \
+                     together and the bounds of the range.
+        :param files: All the `File`-s.
+        :param lines: the list of enabled line numbers per file.
+        :param shards: Bounds of the ranges, see `_split_files()`.
+        :param n_jobs: positive number of processes.
+        :return: The results of the function in the order of the ranges.
+        """
+        if len(shards) > 1:
+            self._log.debug("processing %d files in %d ranges in parallel", len(files),
+                            len(shards))
+        return map_forked(func, shards, (self, files, lines), n_jobs)
+
+    def _iter_parsed_files(self, files: Iterable[File], lines: Optional[List[List[int]]] = None,
+                           ) -> Iterator[Tuple[File, List[VirtualNode], Dict[int, bblfsh.Node],
+                                               Optional[Set[int]]]]:
         index_labels = not self.labels_to_class_sequences
         for i, file in enumerate(files):
             contents = file.content.decode("utf-8", "replace")
-            uast = file.uast
             try:
-                file_vnodes, file_parents = self._parse_file(contents, uast, file.path)
+                file_vnodes, file_parents = self._parse_file(contents, file.uast, file.path)
             except AssertionError as e:
                 self._log.warning("could not parse file %s with error '%s', skipping",
                                   file.path, e)
@@ -325,9 +574,20 @@ class FeatureExtractor:
             file_vnodes = self._add_noops(list(file_vnodes_iterator), file.path,
                                           index_labels=index_labels)
             file_lines = set(lines[i]) if lines is not None and lines[i] is not None else None
+            yield file, file_vnodes, file_parents, file_lines
+
+    def _parse_vnodes(self, files: Iterable[File], lines: Optional[List[List[int]]] = None,
+                      ) -> Tuple[List[Tuple[List[VirtualNode], Dict[int, bblfsh.Node], Set[int]]],
+                                 Dict[int, bblfsh.Node],
+                                 Dict[int, bblfsh.Node]]:
+        node_parents = {}
+        vnode_parents = {}
+        parsed_files = []
+        for file, file_vnodes, file_parents, file_lines in self._iter_parsed_files(files, lines):
             parsed_files.append((file_vnodes, file_parents, file_lines))
             node_parents.update(file_parents)
-            self._fill_vnode_parents(file_parents, file_vnodes, uast, vnode_parents)
+            self._fill_vnode_parents(file_parents, file_vnodes, file.uast, vnode_parents,
+                                     file_lines)
         vnodes_parsed_number = sum(len(vn) for vn, _, _ in parsed_files)
         self._log.debug("Parsed %d vnodes", vnodes_parsed_number)
         return parsed_files, node_parents, vnode_parents
@@ -341,13 +601,11 @@ class FeatureExtractor:
         # filter composite labels by support
         if index_labels:
             self._compute_labels_mappings(chain.from_iterable(vn for vn, _, _ in parsed_files))
-        files_vnodes_y = [[vnode for vnode in file_vnodes
-                           if vnode.is_labeled_on_lines(file_lines) and
-                           vnode.y in self.class_sequences_to_labels]
-                          for file_vnodes, _, file_lines in parsed_files]
+        files_labeled = [self._select_labeled(file_vnodes, file_lines)
+                         for file_vnodes, _, file_lines in parsed_files]
         labels = [[self.class_sequences_to_labels[vnode.y]
                    for vnode in file_vnodes_y]
-                  for file_vnodes_y in files_vnodes_y]
+                  for file_vnodes_y, _ in files_labeled]
         if not labels:
             # nothing was extracted
             return None
@@ -356,25 +614,86 @@ class FeatureExtractor:
                         vnodes_parsed_number)
         if index_labels:
             self._compute_feature_info()
-        features = [feature for group_features in self._features.values()
-                    for node_features in group_features for feature in node_features.values()]
-        xs = []
+        matrix = CSRBuffer(self._feature_count, len(y),
+                           len(y) * len(self._computed_features) // 2)
+        buffer = COOBuffer()
         vnodes = []
         vnodes_y = []
         sibling_indices_list = []
-        assert len(parsed_files) == len(files_vnodes_y)
-        for (file_vnodes, file_parents, _), file_vnodes_y in zip(parsed_files, files_vnodes_y):
+        assert len(parsed_files) == len(files_labeled)
+        for (file_vnodes, file_parents, _), (file_vnodes_y, labeled_range) in zip(
+                parsed_files, files_labeled):
             vnodes.extend(file_vnodes)
             vnodes_y.extend(file_vnodes_y)
-            neighbours, sibling_indices = self._create_neighbours(
-                file_vnodes, file_vnodes_y, file_parents, self.return_sibling_indices)
-            xs.append(hstack([feature(neighbours) for feature in features]))
+            sibling_indices = self._append_file_features(
+                matrix, buffer, file_vnodes, file_vnodes_y, labeled_range, file_parents,
+                self.return_sibling_indices)
             if self.return_sibling_indices:
                 sibling_indices_list.extend(sibling_indices)
-        assert len(y) == len(vnodes_y)
-        X = vstack(xs)
+        assert len(y) == len(vnodes_y) == matrix.rows
+        X = matrix.to_csr()
         return X, y, vnodes_y, vnodes, sibling_indices_list
 
+    def _select_labeled(self, vnodes: Sequence[VirtualNode], lines: Optional[Set[int]],
+                        ) -> Tuple[List[VirtualNode], Tuple[int, int]]:
+        """
+        Find the vnodes of a file which become the samples.
+
+        :param vnodes: All the `VirtualNode`-s of the file.
+        :param lines: Set of the enabled lines or None for all the lines.
+        :return: The labeled `VirtualNode`-s on the lines with the known labels and the range \
+                 of their indices in `vnodes`, empty if there are none.
+        """
+        start, stop = self._get_lines_range(vnodes, lines)
+        indices = [i for i in range(start, stop)
+                   if vnodes[i].is_labeled_on_lines(lines) and
+                   vnodes[i].y in self.class_sequences_to_labels]
+        if not indices:
+            return [], (start, start)
+        return [vnodes[i] for i in indices], (indices[0], indices[-1] + 1)
+
+    def _append_file_features(self, matrix: CSRBuffer, buffer: COOBuffer,
+                              vnodes: Sequence[VirtualNode], vnodes_y: Sequence[VirtualNode],
+                              labeled_range: Tuple[int, int], parents: Mapping[int, bblfsh.Node],
+                              return_sibling_indices: bool = False,
+                              ) -> Optional[List[List[int]]]:
+        """
+        Compute the features of the labeled vnodes of a file and write them to the matrix.
+
+        :param matrix: Features matrix, one row per labeled vnode is appended.
+        :param buffer: Reusable buffer for the values of the file.
+        :param vnodes: All the `VirtualNode`-s of the file.
+        :param vnodes_y: The labeled `VirtualNode`-s of the file.
+        :param labeled_range: The range of the indices of `vnodes_y` in `vnodes`, see \
+                              `_select_labeled()`.
+        :param parents: Mapping from the id of a UAST node to its parent UAST node.
+        :param return_sibling_indices: Whether to find the sibling indices.
+        :return: The sibling indices of each labeled vnode or None.
+        """
+        offset = 0
+        if self.windowed and vnodes_y:
+            start, stop = labeled_range
+            windows = self._get_neighbour_windows(return_sibling_indices)
+            offset, end = self._get_window(
+                vnodes, start, stop, windows[FeatureGroup.left], windows[FeatureGroup.right],
+                bool(windows[FeatureGroup.parents]))
+            vnodes = vnodes[offset:end]
+        neighbours, sibling_indices = self._create_neighbours(
+            vnodes, vnodes_y, parents, return_sibling_indices)
+        if return_sibling_indices and offset:
+            sibling_indices = [[index + offset for index in indices]
+                               for indices in sibling_indices]
+        table = VNodeTable(vnodes, parents,
+                           class_sequences_to_labels=self.class_sequences_to_labels,
+                           reserved_index=self.tokens.RESERVED_INDEX,
+                           internal_types_index=self.roles.INTERNAL_TYPES_INDEX,
+                           roles_by_id=self.roles.ROLES_BY_ID)
+        buffer.clear()
+        for feature, columns in self._computed_features:
+            feature.compute_batch(neighbours, table, buffer, 0, columns)
+        matrix.append(buffer, len(vnodes_y))
+        return sibling_indices
+
     def _create_neighbours(self, vnodes: Sequence[VirtualNode], vnodes_y: Sequence[VirtualNode],
                            parents: Mapping[int, bblfsh.Node],
                            return_sibling_indices: bool = False,
@@ -382,19 +701,20 @@ class FeatureExtractor:
                                       Optional[List[List[int]]]]:
         if self.return_sibling_indices:
             sibling_indices_list = []
+        windows = self._get_neighbour_windows(return_sibling_indices)
+        left_window, right_window, parents_depth = \
+            windows[FeatureGroup.left], windows[FeatureGroup.right], windows[FeatureGroup.parents]
         neighbours = OrderedDict()  # type: MutableLayout[List[Optional[AnyNode]]]
-        for group_id, size in zip([FeatureGroup.node, FeatureGroup.left, FeatureGroup.right,
-                                   FeatureGroup.parents],
-                                  [1, self.left_siblings_window, self.right_siblings_window,
-                                   self.parents_depth]):
+        for group_id, size in windows.items():
             neighbours[group_id] = [[] for _ in range(size)]
 
         vnodes_y_set = frozenset(id(vnode_y) for vnode_y in vnodes_y)
-        closest_left_node_id = None
+        search_siblings = bool(left_window or right_window or return_sibling_indices)
+        if search_siblings:
+            siblings, unquoted_siblings, unlabeled_siblings = self._index_siblings(vnodes)
+        vnode_parents = self._find_parents(vnodes, parents) if parents_depth else None
 
         for i, vnode in enumerate(vnodes):
-            if vnode.node:
-                closest_left_node_id = id(vnode.node)
             if id(vnode) not in vnodes_y_set:
                 continue
 
@@ -402,44 +722,37 @@ class FeatureExtractor:
             neighbours[FeatureGroup.node][0].append(vnode)
 
             # Current node's parents
-            parent = (self._find_parent(i, vnodes, parents, closest_left_node_id)
-                      if self.parents_depth else None)
+            parent = vnode_parents[i] if parents_depth else None
             parents_list = []
             if parent:
                 current_ancestor = parent
-                for _ in range(self.parents_depth):
+                for _ in range(parents_depth):
                     parents_list.append(current_ancestor)
                     current_ancestor_id = id(current_ancestor)
                     if current_ancestor_id not in parents:
                         break
                     current_ancestor = parents[current_ancestor_id]
-            for j, node in zip_longest(range(self.parents_depth), parents_list):
+            for j, node in zip_longest(range(parents_depth), parents_list):
                 neighbours[FeatureGroup.parents][j].append(node)
 
+            if not search_siblings:
+                continue
+
             # Current node's left siblings
-            left_sibling_indices = []
-            for j in range(i - 1, 0, -1):
-                if len(left_sibling_indices) >= self.left_siblings_window:
-                    break
-                if not self._keep_sibling(vnodes[j], vnode, include_labeled=True):
-                    continue
-                left_sibling_indices.append(j)
-            for j, node_index in zip_longest(range(self.left_siblings_window),
-                                             left_sibling_indices):
+            quoted = not _QUOTE_CLASSES.isdisjoint(vnode.y)
+            left_siblings = unquoted_siblings if quoted else siblings
+            position = left_siblings.positions[i]
+            left_sibling_indices = left_siblings.indices[
+                max(position - left_window, 0):position][::-1]
+            for j, node_index in zip_longest(range(left_window), left_sibling_indices):
                 neighbours[FeatureGroup.left][j].append(None if node_index is None
                                                         else vnodes[node_index])
 
             # Current node's right siblings
-            right_sibling_indices = []
-            for j in range(i + 1, len(vnodes)):
-                if len(right_sibling_indices) >= self.right_siblings_window:
-                    break
-                if not self._keep_sibling(vnodes[j], vnode,
-                                          include_labeled=not self.no_labels_on_right):
-                    continue
-                right_sibling_indices.append(j)
-            for j, node_index in zip_longest(range(self.right_siblings_window),
-                                             right_sibling_indices):
+            right_siblings = unlabeled_siblings if self.no_labels_on_right else left_siblings
+            position = right_siblings.positions[i + 1]
+            right_sibling_indices = right_siblings.indices[position:position + right_window]
+            for j, node_index in zip_longest(range(right_window), right_sibling_indices):
                 neighbours[FeatureGroup.right][j].append(None if node_index is None
                                                          else vnodes[node_index])
 
@@ -447,6 +760,37 @@ class FeatureExtractor:
                 sibling_indices_list.append(left_sibling_indices + right_sibling_indices)
         return neighbours, sibling_indices_list if return_sibling_indices else None
 
+    def _get_neighbour_windows(self, return_sibling_indices: bool = False,
+                               ) -> Dict[FeatureGroup, int]:
+        """
+        Calculate how many neighbours of each group are required by the computed features.
+
+        The trailing siblings and parents without the selected (or used) features are not \
+        searched.
+
+        :param return_sibling_indices: Whether the full sibling windows are required to return \
+                                       the sibling indices.
+        :return: Mapping from the feature group to the number of the neighbours.
+        """
+        windows = OrderedDict([
+            (FeatureGroup.node, 1),
+            (FeatureGroup.left, self.left_siblings_window),
+            (FeatureGroup.right, self.right_siblings_window),
+            (FeatureGroup.parents, self.parents_depth),
+        ])
+        computed_features = getattr(self, "_computed_features", None)
+        if computed_features is None:
+            return windows
+        used = defaultdict(int)  # type: Dict[FeatureGroup, int]
+        for feature, _ in computed_features:
+            used[feature.neighbour_group] = max(used[feature.neighbour_group],
+                                                feature.neighbour_index + 1)
+        groups = (FeatureGroup.parents,) if return_sibling_indices else \
+            (FeatureGroup.left, FeatureGroup.right, FeatureGroup.parents)
+        for group in groups:
+            windows[group] = min(windows[group], used[group])
+        return windows
+
     def _classify_vnodes(self, nodes: Iterable[VirtualNode], path: str) -> Iterable[VirtualNode]:
         """
         Fill "y" attribute in the VirtualNode-s extracted from _parse_file().
@@ -647,49 +991,123 @@ class FeatureExtractor:
         return augmented_vnodes
 
     @staticmethod
-    def _find_parent(vnode_index: int, vnodes: Sequence[VirtualNode],
-                     parents: Mapping[int, bblfsh.Node], closest_left_node_id: int,
-                     ) -> Optional[bblfsh.Node]:
+    def _find_parents(vnodes: Sequence[VirtualNode], parents: Mapping[int, bblfsh.Node],
+                      ) -> List[Optional[bblfsh.Node]]:
         """
-        Compute vnode parent as the LCA of the closest left and right babelfish nodes.
+        Compute the parents of the vnodes as the LCA of the closest left and right babelfish nodes.
+
+        The closest left node is the last bblfsh node at or before the vnode and the closest \
+        right node is the first bblfsh node after it. The parent is their deepest common strict \
+        ancestor. The lowest common ancestors of all the vnodes are found at once by binary \
+        lifting over the tree of the bblfsh nodes, so the complexity is O(n log(depth)).
 
-        :param vnode_index: the index of the current node
         :param vnodes: the sequence of `VirtualNode`-s being transformed into features
         :param parents: the id of bblfsh node to parent bblfsh node mapping
-        :param closest_left_node_id: bblfsh node of the closest parent already gone through
-        :return: The bblfsh.Node of the found parent or None if no parent was found.
+        :return: The bblfsh.Node of the found parent or None if no parent was found, \
+                 for each vnode.
         """
-        left_ancestors = set()
-        current_left_ancestor_id = closest_left_node_id
-        while current_left_ancestor_id in parents:
-            left_ancestors.add(id(parents[current_left_ancestor_id]))
-            current_left_ancestor_id = id(parents[current_left_ancestor_id])
+        nodes = []  # type: List[bblfsh.Node]
+        node_indices = {}  # type: Dict[int, int]
+        node_parents = []  # type: List[int]
 
-        for future_vnode in vnodes[vnode_index + 1:]:
-            if future_vnode.node:
+        def index_node(node: bblfsh.Node) -> int:
+            # register the node and all its ancestors which were not seen before
+            result = child = None
+            while node is not None:
+                index = node_indices.get(id(node))
+                seen = index is not None
+                if not seen:
+                    index = node_indices[id(node)] = len(nodes)
+                    nodes.append(node)
+                    node_parents.append(-1)
+                if child is not None:
+                    node_parents[child] = index
+                if result is None:
+                    result = index
+                if seen:
+                    break
+                child = index
+                node = parents.get(id(node))
+            return result
+
+        vnode_nodes = numpy.array([-1 if vnode.node is None else index_node(vnode.node)
+                                   for vnode in vnodes], dtype=numpy.int64)
+        if not nodes:
+            return [None] * len(vnodes)
+        positions = numpy.arange(len(vnodes))
+        has_node = vnode_nodes >= 0
+        left = numpy.maximum.accumulate(numpy.where(has_node, positions, -1))
+        right = numpy.minimum.accumulate(
+            numpy.where(has_node, positions, len(vnodes))[::-1])[::-1]
+        right = numpy.append(right[1:], len(vnodes))
+        queries = numpy.flatnonzero((left >= 0) & (right < len(vnodes)))
+        left_nodes = vnode_nodes[left[queries]]
+        right_nodes = vnode_nodes[right[queries]]
+
+        # ancestors[k] is the 2^k-th ancestor, the roots are their own ancestors
+        node_parents = numpy.array(node_parents, dtype=numpy.int64)
+        roots = node_parents < 0
+        ancestors = [numpy.where(roots, numpy.arange(len(nodes)), node_parents)]
+        depths = (~roots).astype(numpy.int64)
+        while True:
+            ancestor = ancestors[-1][ancestors[-1]]
+            if numpy.array_equal(ancestor, ancestors[-1]):
                 break
-        else:
-            return None
-        current_right_ancestor_id = id(future_vnode.node)
-        while current_right_ancestor_id in parents:
-            if id(parents[current_right_ancestor_id]) in left_ancestors:
-                return parents[current_right_ancestor_id]
-            current_right_ancestor_id = id(parents[current_right_ancestor_id])
-        return None
-
-    def _keep_sibling(self, sibling: VirtualNode, vnode: VirtualNode, include_labeled: bool,
-                      ) -> bool:
-        if not include_labeled and (
-                sibling.y is not None or sibling.node is None and sibling.value.isspace()):
-            return False
-        if sibling.y == (CLASS_INDEX[CLS_NOOP],):
-            return False
-        if sibling.y is None:
-            return True
-        quote_classes = set([CLASS_INDEX[CLS_DOUBLE_QUOTE], CLASS_INDEX[CLS_SINGLE_QUOTE]])
-        return not (quote_classes & set(vnode.y) and quote_classes & set(sibling.y))
-
-    def _parse_file(self, contents: str, root: bblfsh.Node, path: str) -> \
+            depths = depths + depths[ancestors[-1]]
+            ancestors.append(ancestor)
+        deeper = numpy.where(depths[left_nodes] >= depths[right_nodes], left_nodes, right_nodes)
+        shallower = numpy.where(deeper == left_nodes, right_nodes, left_nodes)
+        diff = depths[deeper] - depths[shallower]
+        for k, ancestor in enumerate(ancestors):
+            deeper = numpy.where((diff >> k) & 1, ancestor[deeper], deeper)
+        for ancestor in reversed(ancestors):
+            differ = ancestor[deeper] != ancestor[shallower]
+            deeper = numpy.where(differ, ancestor[deeper], deeper)
+            shallower = numpy.where(differ, ancestor[shallower], shallower)
+        lcas = numpy.where(deeper == shallower, deeper, ancestors[0][deeper])
+        # the nodes from different trees do not have common ancestors
+        lcas[ancestors[0][deeper] != ancestors[0][shallower]] = -1
+        # the LCA must be a strict ancestor of both nodes
+        same = (lcas == left_nodes) | (lcas == right_nodes)
+        lcas[same] = node_parents[lcas[same]]
+        result = [None] * len(vnodes)  # type: List[Optional[bblfsh.Node]]
+        for i, lca in zip(queries.tolist(), lcas.tolist()):
+            if lca >= 0:
+                result[i] = nodes[lca]
+        return result
+
+    @staticmethod
+    def _index_siblings(vnodes: Sequence[VirtualNode]) -> Tuple["_SiblingsIndex",
+                                                                "_SiblingsIndex",
+                                                                "_SiblingsIndex"]:
+        """
+        Find the vnodes which can be the siblings of the labeled vnodes.
+
+        NOOP-s are never siblings. Quote-labeled vnodes cannot be the siblings of the other \
+        quote-labeled vnodes. The first vnode is never a sibling.
+
+        :param vnodes: the sequence of `VirtualNode`-s being transformed into features
+        :return: The siblings if the labeled vnodes are allowed, the same without the \
+                 quote-labeled vnodes for the quote-labeled vnodes, and the siblings if the \
+                 labeled vnodes are not allowed.
+        """
+        siblings, unquoted_siblings, unlabeled_siblings = [], [], []
+        for j in range(1, len(vnodes)):
+            sibling = vnodes[j]
+            y = sibling.y
+            if y is None:
+                siblings.append(j)
+                unquoted_siblings.append(j)
+                if sibling.node is not None or not sibling.value.isspace():
+                    unlabeled_siblings.append(j)
+            elif y != _NOOP_Y:
+                siblings.append(j)
+                if _QUOTE_CLASSES.isdisjoint(y):
+                    unquoted_siblings.append(j)
+        return tuple(_SiblingsIndex.build(indices, len(vnodes))
+                     for indices in (siblings, unquoted_siblings, unlabeled_siblings))
+
+    def _parse_file(self, contents: str, root: Union[bblfsh.Node, FlatUAST], path: str) -> \
             Tuple[List[VirtualNode], Dict[int, bblfsh.Node]]:
         """
         Parse a file into a sequence of `VirtuaNode`-s and a mapping from VirtualNode to parent.
@@ -700,7 +1118,7 @@ class FeatureExtractor:
         `id(node)` to its parent `bblfsh.Node`.
 
         :param contents: source file text
-        :param root: UAST root node
+        :param root: UAST root node or the UAST flattened with the same `node_fixtures`
         :param path: path to the file, used for debugging
         :return: list of `VirtualNode`-s and the parents.
         """
@@ -714,60 +1132,65 @@ class FeatureExtractor:
             # We add last line as empty one because it actually exists, but .splitlines() does not
             # return it.
             lines.append("")
-        line_offsets = numpy.zeros(len(lines) + 1, dtype=numpy.int32)
-        pos = 0
-        for i, line in enumerate(lines):
-            line_offsets[i] = pos
-            pos += len(line)
-        line_offsets[-1] = pos + 1
-
-        # walk the tree: collect nodes with assigned tokens and build the parents map
-        node_tokens = []
-        parents = {}
-        queue = [root]
-        while queue:
-            node = queue.pop()
-            if node.internal_type in self.node_fixtures:
-                node = self.node_fixtures[node.internal_type](node)
-            for child in node.children:
-                parents[id(child)] = node
-            queue.extend(node.children)
-            if (node.token or node.start_position and node.end_position
-                    and node.start_position != node.end_position and not node.children):
-                node_tokens.append(node)
-        node_tokens.sort(key=lambda n: n.start_position.offset)
-        sentinel = bblfsh.Node()
-        sentinel.start_position.offset = len(contents)
-        sentinel.start_position.line = len(lines)
-        node_tokens.append(sentinel)
-
-        # scan `node_tokens` and fill the gaps with imaginary nodes
-        result = []
+        line_offsets = numpy.zeros(len(lines) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.fromiter(map(len, lines[:-1]), dtype=numpy.int64,
+                                    count=len(lines) - 1), out=line_offsets[1:-1])
+        line_offsets[-1] = len(contents) + 1
+
+        # collect nodes with assigned tokens and build the parents map
+        uast = root if isinstance(root, FlatUAST) else FlatUAST(root, self.node_fixtures)
+        parents = uast.parents_mapping()
+        empty_span = ((uast.start_offset == uast.end_offset) &
+                      (uast.start_line == uast.end_line) & (uast.start_col == uast.end_col))
+        node_tokens = numpy.flatnonzero(
+            (uast.token != 0) | (~empty_span & (uast.children_count == 0)))
+        # sort by the start offset, the ties are kept in the reverse postorder which is
+        # the order of the depth-first traversal with a stack
+        node_tokens = node_tokens[numpy.lexsort(
+            (-uast.postorder()[node_tokens], uast.start_offset[node_tokens]))]
+        # the sentinel is the end of the file
+        starts = uast.start_offset[node_tokens].tolist() + [len(contents)]
+        ends = uast.end_offset[node_tokens].tolist() + [len(contents)]
+        node_tokens = node_tokens.tolist() + [-1]
+
+        # scan `node_tokens` and fill the gaps with imaginary nodes; their positions are
+        # resolved after the scan, the slots in `result` are reserved with None-s
+        result = []  # type: List[Optional[VirtualNode]]
+        gap_slots, gap_tokens, gap_offsets = [], [], []
         pos = 0
         parser = self.tokens.PARSER
-        searchsorted = numpy.searchsorted
-        for node in node_tokens:
-            if node.start_position.offset < pos:
+        for node_index, start, end in zip(node_tokens, starts, ends):
+            if start < pos:
                 continue
-            if node.start_position.offset > pos:
+            if start > pos:
                 sumlen = 0
-                diff = contents[pos:node.start_position.offset]
+                diff = contents[pos:start]
                 for match in parser.finditer(diff):
-                    positions = []
-                    for suboff in (match.start(), match.end()):
-                        offset = pos + suboff
-                        line = searchsorted(line_offsets, offset, side="right")
-                        col = offset - line_offsets[line - 1] + 1
-                        positions.append(Position(offset, line, col))
                     token = match.group()
                     sumlen += len(token)
-                    result.append(VirtualNode(token, *positions, path=path))
-                assert sumlen == node.start_position.offset - pos, \
-                    "missed some imaginary tokens: \"%s\"" % diff
-            if node is sentinel:
+                    gap_slots.append(len(result))
+                    gap_tokens.append(token)
+                    gap_offsets.append(pos + match.start())
+                    result.append(None)
+                assert sumlen == start - pos, "missed some imaginary tokens: \"%s\"" % diff
+            if node_index < 0:
                 break
-            result.extend(VirtualNode.from_node(node, contents, path, self.token_unwrappers))
-            pos = node.end_position.offset
+            result.extend(VirtualNode.from_node(uast.nodes[node_index], contents, path,
+                                                self.token_unwrappers))
+            pos = end
+        if gap_tokens:
+            offsets = numpy.array(gap_offsets, dtype=numpy.int64)
+            # the start and the end offsets of all the imaginary nodes at once
+            offsets = numpy.concatenate((offsets, offsets + numpy.fromiter(
+                map(len, gap_tokens), dtype=numpy.int64, count=len(gap_tokens))))
+            lines = numpy.searchsorted(line_offsets, offsets, side="right")
+            cols = offsets - line_offsets[lines - 1] + 1
+            size = len(gap_tokens)
+            positions = [Position(*position)
+                         for position in zip(offsets.tolist(), lines.tolist(), cols.tolist())]
+            for slot, token, start_position, end_position in zip(
+                    gap_slots, gap_tokens, positions[:size], positions[size:]):
+                result[slot] = VirtualNode(token, start_position, end_position, path=path)
         return result, parents
 
     def _compute_labels_mappings(self, vnodes: Iterable[VirtualNode]) -> None:
@@ -778,13 +1201,33 @@ class FeatureExtractor:
 
         :param vnodes: The virtual nodes extracted from all the files.
         """
-        assert len(self.class_sequences_to_labels) == 0, self.class_sequences_to_labels
-        assert len(self.labels_to_class_sequences) == 0, self.labels_to_class_sequences
+        self._compute_labels_mappings_from_support(self._count_labels_support(vnodes))
+
+    @staticmethod
+    def _count_labels_support(vnodes: Iterable[VirtualNode]) -> Dict[Tuple[int, ...], int]:
+        """
+        Count the occurrences of each class sequence.
+
+        :param vnodes: The virtual nodes.
+        :return: Mapping from the class sequences to their support. The sequences are ordered \
+                 by the first occurrence.
+        """
         support = defaultdict(int)
         for vnode in vnodes:
             if vnode.y is not None:
                 support[vnode.y] += 1
+        return support
+
+    def _compute_labels_mappings_from_support(self, support: Mapping[Tuple[int, ...], int],
+                                              ) -> None:
+        """
+        Calculate the labels mappings from the support of the class sequences.
 
+        :param support: Mapping from the class sequences to their support in all the files, \
+                        ordered by the first occurrence. The ties are resolved by that order.
+        """
+        assert len(self.class_sequences_to_labels) == 0, self.class_sequences_to_labels
+        assert len(self.labels_to_class_sequences) == 0, self.labels_to_class_sequences
         # Sort by support to create labels from most frequent to the least frequent
         self.labels_to_class_sequences = [
             key for key, val in sorted(support.items(), key=itemgetter(1), reverse=True)
@@ -797,12 +1240,96 @@ class FeatureExtractor:
 
     def _fill_vnode_parents(self, file_parents: Mapping[int, bblfsh.Node],
                             file_vnodes: List[VirtualNode], uast: bblfsh.Node,
-                            vnode_parents: Mapping[int, bblfsh.Node]):
-        closest_left_node_id = None
-        for j, vn in enumerate(file_vnodes):
-            if vn.node:
-                closest_left_node_id = id(vn.node)
-            parent = self._find_parent(j, file_vnodes, file_parents, closest_left_node_id)
+                            vnode_parents: Mapping[int, bblfsh.Node],
+                            file_lines: Optional[Set[int]] = None):
+        start, stop = 0, len(file_vnodes)
+        if self.windowed and file_lines is not None:
+            labeled = [i for i in range(*self._get_lines_range(file_vnodes, file_lines))
+                       if file_vnodes[i].is_labeled_on_lines(file_lines)]
+            if not labeled:
+                return
+            start, stop = labeled[0], labeled[-1] + 1
+        offset, end = self._get_window(file_vnodes, start, stop, 0, 0, True)
+        found_parents = self._find_parents(file_vnodes[offset:end], file_parents)
+        for vn, parent in zip(file_vnodes[start:stop],
+                              found_parents[start - offset:stop - offset]):
             if parent is None:
                 parent = uast
             vnode_parents[id(vn)] = parent
+
+    @staticmethod
+    def _get_lines_range(vnodes: Sequence[VirtualNode], lines: Optional[Set[int]],
+                         ) -> Tuple[int, int]:
+        """
+        Find the range of the vnodes which can be located on the specified lines.
+
+        The lines of the vnodes do not decrease, so the range is found by binary search.
+
+        :param vnodes: All the `VirtualNode`-s of the file.
+        :param lines: Set of the enabled lines or None for all the lines.
+        :return: The start and the end of the range.
+        """
+        if lines is None:
+            return 0, len(vnodes)
+        if not lines:
+            return 0, 0
+        first_line, last_line = min(lines), max(lines)
+        start, stop = 0, len(vnodes)
+        while start < stop:
+            middle = (start + stop) // 2
+            if vnodes[middle].end.line < first_line:
+                start = middle + 1
+            else:
+                stop = middle
+        stop = len(vnodes)
+        end = start
+        while end < stop:
+            middle = (end + stop) // 2
+            if vnodes[middle].start.line <= last_line:
+                end = middle + 1
+            else:
+                stop = middle
+        return start, end
+
+    @staticmethod
+    def _get_window(vnodes: Sequence[VirtualNode], start: int, stop: int, left_window: int,
+                    right_window: int, with_parents: bool) -> Tuple[int, int]:
+        """
+        Find the slice of the vnodes which has the same neighbours for the vnodes in a range.
+
+        The slice includes `left_window` vnodes before `start` and `right_window` vnodes \
+        after `stop` which are siblings in any case: unlabeled and not whitespace-only without \
+        a node. The other siblings are never farther. The first vnode of a slice is never \
+        a sibling, so one more vnode is taken on the left. The parents require the closest \
+        vnodes with bblfsh nodes on both sides.
+
+        :param vnodes: All the `VirtualNode`-s of the file.
+        :param start: Index of the first vnode in the range.
+        :param stop: Index after the last vnode in the range.
+        :param left_window: Number of the left siblings.
+        :param right_window: Number of the right siblings.
+        :param with_parents: Whether the parents of the vnodes in the range are required.
+        :return: The start and the end of the slice.
+        """
+        def is_sibling(vnode: VirtualNode) -> bool:
+            return vnode.y is None and (vnode.node is not None or not vnode.value.isspace())
+
+        left, found = start, 0
+        while left > 1 and found < left_window:
+            left -= 1
+            found += is_sibling(vnodes[left])
+        left = max(left - 1, 0)
+        right, found = stop - 1, 0
+        while right < len(vnodes) - 1 and found < right_window:
+            right += 1
+            found += is_sibling(vnodes[right])
+        right += 1
+        if with_parents:
+            node_left = start
+            while node_left > 0 and vnodes[node_left].node is None:
+                node_left -= 1
+            node_right = stop
+            while node_right < len(vnodes) - 1 and vnodes[node_right].node is None:
+                node_right += 1
+            left, right = min(left, node_left), max(right, node_right + 1)
+        return left, min(right, len(vnodes))
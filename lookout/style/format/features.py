@@ -11,7 +11,7 @@ import numpy
 from scipy.sparse import csr_matrix
 
 from lookout.style.format.classes import CLASSES
-from lookout.style.format.virtual_node import AnyNode, VirtualNode
+from lookout.style.format.virtual_node import AnyNode, VirtualNode, VNodeTable
 
 FEATURES_NUMPY_TYPE = numpy.uint8
 FEATURES_MIN = numpy.iinfo(FEATURES_NUMPY_TYPE).min
@@ -89,6 +89,136 @@ class FeatureId(Enum):
         return self.value < other.value
 
 
+def _reserve(buffer: Any, names: Sequence[str], size: int, end: int) -> None:
+    """Grow the arrays of the buffer so that `end` elements fit in, keep the first `size`."""
+    if end <= len(getattr(buffer, names[0])):
+        return
+    capacity = max(end, 2 * len(getattr(buffer, names[0])))
+    for name in names:
+        old = getattr(buffer, name)
+        new = numpy.empty(capacity, dtype=old.dtype)
+        new[:size] = old[:size]
+        setattr(buffer, name, new)
+
+
+class COOBuffer:
+    """
+    Growing coordinate buffer which collects the values of all the features at once.
+
+    The features write their values there with `Feature.compute_batch()` and the whole \
+    features matrix is assembled only once in the end.
+    """
+
+    def __init__(self, capacity: int = 0) -> None:
+        """
+        Construct a COOBuffer.
+
+        :param capacity: Initial number of the values which fit in without reallocations.
+        """
+        self.data = numpy.empty(capacity, dtype=FEATURES_NUMPY_TYPE)
+        self.rows = numpy.empty(capacity, dtype=numpy.int32)
+        self.cols = numpy.empty(capacity, dtype=numpy.int32)
+        self.size = 0
+
+    def __len__(self) -> int:
+        """Return the number of the written values."""
+        return self.size
+
+    def append(self, values: Sequence[int], rows: Sequence[int], cols: Sequence[int]) -> None:
+        """
+        Write more values to the buffer.
+
+        :param values: Feature values.
+        :param rows: Row indices of the values.
+        :param cols: Column indices of the values.
+        """
+        end = self.size + len(values)
+        _reserve(self, ("data", "rows", "cols"), self.size, end)
+        self.data[self.size:end] = values
+        self.rows[self.size:end] = rows
+        self.cols[self.size:end] = cols
+        self.size = end
+
+    def clear(self) -> None:
+        """Forget the written values and keep the allocated memory."""
+        self.size = 0
+
+    def to_csr(self, shape: Tuple[int, int]) -> csr_matrix:
+        """
+        Assemble the sparse matrix from the written values.
+
+        :param shape: Shape of the matrix.
+        :return: CSR matrix of FEATURES_NUMPY_TYPE. The duplicate values are summed.
+        """
+        size = self.size
+        return csr_matrix((self.data[:size], (self.rows[:size], self.cols[:size])),
+                          dtype=FEATURES_NUMPY_TYPE, shape=shape)
+
+
+class CSRBuffer:
+    """
+    Growing CSR matrix which is filled with consecutive blocks of rows.
+
+    Each block is collected in a `COOBuffer` and is sorted by rows on its own, so the values \
+    of all the blocks are written straight to the final arrays. The coordinates of the whole \
+    matrix never exist and the matrix is constructed only once in the end.
+    """
+
+    def __init__(self, columns: int, rows: int = 0, capacity: int = 0) -> None:
+        """
+        Construct a CSRBuffer.
+
+        :param columns: Number of the columns of the matrix.
+        :param rows: Initial number of the rows which fit in without reallocations.
+        :param capacity: Initial number of the values which fit in without reallocations.
+        """
+        self.columns = columns
+        self.data = numpy.empty(capacity, dtype=FEATURES_NUMPY_TYPE)
+        self.indices = numpy.empty(capacity, dtype=numpy.int32)
+        self.indptr = numpy.zeros(rows + 1, dtype=numpy.int64)
+        self.rows = 0
+
+    def __len__(self) -> int:
+        """Return the number of the written values."""
+        return int(self.indptr[self.rows])
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """Return the shape of the written part of the matrix."""
+        return self.rows, self.columns
+
+    def append(self, block: COOBuffer, rows: int) -> None:
+        """
+        Write the next rows.
+
+        :param block: Values of the rows. The row indices are relative to the first row \
+                      of the block.
+        :param rows: Number of the rows in the block.
+        """
+        matrix = block.to_csr((rows, self.columns))
+        size = len(self)
+        end = size + matrix.nnz
+        _reserve(self, ("data", "indices"), size, end)
+        _reserve(self, ("indptr",), self.rows + 1, self.rows + rows + 1)
+        self.data[size:end] = matrix.data
+        self.indices[size:end] = matrix.indices
+        self.indptr[self.rows + 1:self.rows + rows + 1] = matrix.indptr[1:] + size
+        self.rows += rows
+
+    def to_csr(self) -> csr_matrix:
+        """
+        Construct the matrix from the written rows. The buffer must not be used afterwards.
+
+        :return: CSR matrix of FEATURES_NUMPY_TYPE which shares the memory with the buffer.
+        """
+        size = len(self)
+        # shrink the arrays in place, usually without copying
+        self.data.resize(size, refcheck=False)
+        self.indices.resize(size, refcheck=False)
+        self.indptr.resize(self.rows + 1, refcheck=False)
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape, copy=False)
+
+
 TV = TypeVar("TV")
 Layout = Mapping[FeatureGroup, Sequence[TV]]
 MutableLayout = MutableMapping[FeatureGroup, List[TV]]
@@ -102,6 +232,7 @@ class Feature:
     """Base type for features."""
 
     id = None  # type: FeatureId
+    columnar = False  # whether the feature can be computed on VNodeTable
 
     def __init__(self, *, language: str, labels_to_class_sequences: Sequence[Tuple[int, ...]],
                  selected_indices: Optional[Sequence[int]] = None, **kwargs: Any) -> None:
@@ -131,28 +262,64 @@ class Feature:
         self._selected_names = None  # type: Optional[List[str]]
         self._selected_names_index = None  # type: Optional[Mapping[str, int]]
 
-    def __call__(self, neighbours: Layout[Sequence[Optional[AnyNode]]]) -> csr_matrix:
+    def __call__(self, neighbours: Layout[Sequence[Optional[AnyNode]]],
+                 table: Optional[VNodeTable] = None) -> csr_matrix:
         """
         Compute the relevant values for this feature.
 
         This method only creates the resulting array and delegates the filling to subclasses.
 
         :param neighbours: Neighbouring nodes to the current sample.
+        :param table: Columnar representation of all the `VirtualNode`-s in `neighbours`. \
+                      The features which support it are computed with numpy expressions on \
+                      this table instead of the loops over the nodes.
         :return: Numpy array containing the feature values. 2-dimensional.
         """
         X_shape = len(neighbours[FeatureGroup.node][0]), len(self.selected_names)
-        values, row_indices, column_indices = self._compute(neighbours)
         if not X_shape[1]:
             return csr_matrix(X_shape, dtype=FEATURES_NUMPY_TYPE)
+        values, row_indices, column_indices = self._compute(neighbours, table)
         return csr_matrix((values, (row_indices, column_indices)), dtype=FEATURES_NUMPY_TYPE,
                           shape=X_shape)
 
+    def compute_batch(self, neighbours: Layout[Sequence[Optional[AnyNode]]],
+                      table: Optional[VNodeTable], buffer: COOBuffer, row_offset: int,
+                      columns: numpy.ndarray) -> None:
+        """
+        Compute the relevant values for this feature and write them to the shared buffer.
+
+        The features which support `VNodeTable` compute whole columns at once, the others \
+        fall back to the row-wise computation.
+
+        :param neighbours: Neighbouring nodes to the current samples.
+        :param table: Columnar representation of all the `VirtualNode`-s in `neighbours`.
+        :param buffer: Buffer of the whole features matrix.
+        :param row_offset: Row index of the first sample in the whole features matrix.
+        :param columns: Column indices of the selected names of this feature in the whole \
+                        features matrix.
+        """
+        if not self.selected_names:
+            return
+        values, row_indices, column_indices = self._compute(neighbours, table)
+        buffer.append(values, numpy.asarray(row_indices, dtype=numpy.int64) + row_offset,
+                      columns[numpy.asarray(column_indices, dtype=numpy.int64)])
+
     @staticmethod
     def _clip_int(integer: int) -> int:
         return max(FEATURES_MIN, min(FEATURES_MAX, integer))
 
+    @staticmethod
+    def _clip_column(values: numpy.ndarray, row_indices: numpy.ndarray,
+                     ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        # negative values mark the rows where the feature does not exist
+        exists = values >= 0
+        row_indices = row_indices[exists]
+        return (numpy.clip(values[exists], FEATURES_MIN, FEATURES_MAX), row_indices,
+                numpy.zeros_like(row_indices))
+
     def _compute(self, neighbours: Layout[Sequence[Optional[AnyNode]]],
-                 ) -> Tuple[List[int], List[int],  List[int]]:
+                 table: Optional[VNodeTable] = None,
+                 ) -> Tuple[Sequence[int], Sequence[int], Sequence[int]]:
         raise NotImplementedError()
 
     @property
@@ -196,7 +363,23 @@ class Feature:
 class MultipleValuesFeature(Feature):
     """Base type for features that produce multiple values."""
 
-    pass
+    def __init__(self, **kwargs: Any) -> None:
+        """Construct a MultipleValuesFeature."""
+        super().__init__(**kwargs)
+        self._columns = None  # type: Optional[numpy.ndarray]
+
+    @property
+    def columns(self) -> numpy.ndarray:
+        """
+        Return the mapping from the indices in `names` to the columns after feature selection.
+
+        The columns of the names which are not selected are -1. The extra trailing -1 maps \
+        the missing index -1 to the missing column.
+        """
+        if self._columns is None:
+            self._columns = numpy.full(len(self.names) + 1, -1, dtype=numpy.int64)
+            self._columns[self.selected_indices] = numpy.arange(len(self.selected_indices))
+        return self._columns
 
 
 class CategoricalFeature(MultipleValuesFeature):
@@ -259,11 +442,18 @@ class ComparisonFeature(NeighbourFeature[TVAnyNode]):
     """Base type for features that compare the current node to one of its neighbours."""
 
     def _compute(self, neighbours: Layout[Sequence[Optional[AnyNode]]],
-                 ) -> Tuple[List[int], List[int], List[int]]:
+                 table: Optional[VNodeTable] = None,
+                 ) -> Tuple[Sequence[int], Sequence[int], Sequence[int]]:
         """Focus on the relevant nodes and compute the feature values."""
-        return self._focused_compute(  # type: ignore
-            neighbours[FeatureGroup.node][0],
-            self._convert_nodes(neighbours[self.neighbour_group][self.neighbour_index]))
+        nodes = neighbours[FeatureGroup.node][0]
+        focused_neighbours = self._convert_nodes(
+            neighbours[self.neighbour_group][self.neighbour_index])
+        if table is not None and self.columnar:
+            neighbour_rows = table.rows(focused_neighbours)
+            row_indices = numpy.flatnonzero(neighbour_rows >= 0)
+            return self._clip_column(self._compute_column(
+                table, table.rows(nodes)[row_indices], neighbour_rows[row_indices]), row_indices)
+        return self._focused_compute(nodes, focused_neighbours)  # type: ignore
 
     def _focused_compute(self, nodes: Sequence[VirtualNode],
                          neighbours: Sequence[Optional[TVAnyNode]],
@@ -286,6 +476,18 @@ class ComparisonFeature(NeighbourFeature[TVAnyNode]):
         """Compute the feature value(s) for a given node and its neighbour."""
         raise NotImplementedError()
 
+    def _compute_column(self, table: VNodeTable, node_rows: numpy.ndarray,
+                        neighbour_rows: numpy.ndarray) -> numpy.ndarray:
+        """
+        Compute the values of a single column feature for the existing neighbours at once.
+
+        :param table: Columnar representation of the nodes.
+        :param node_rows: Rows of the current nodes in the table.
+        :param neighbour_rows: Rows of the neighbours in the table.
+        :return: Feature values before clipping, negative if the feature does not exist.
+        """
+        raise NotImplementedError()
+
 
 class VirtualNodeComparisonFeature(ComparisonFeature[VirtualNode]):
     """Base type for Feature-s that compare the current virtual node to another virtual node."""
@@ -297,10 +499,25 @@ class NodeFeature(NeighbourFeature[TVAnyNode]):
     """Base type for features that compute a property of a single node."""
 
     def _compute(self, neighbours: Layout[Sequence[Optional[AnyNode]]],
-                 ) -> Tuple[List[int], List[int], List[int]]:
+                 table: Optional[VNodeTable] = None,
+                 ) -> Tuple[Sequence[int], Sequence[int], Sequence[int]]:
         """Focus on the relevant nodes and compute the feature values."""
-        return self._focused_compute(
-            self._convert_nodes(neighbours[self.neighbour_group][self.neighbour_index]))
+        nodes = neighbours[self.neighbour_group][self.neighbour_index]
+        if table is not None and self.columnar:
+            rows = self._table_rows(table, nodes)
+            row_indices = numpy.flatnonzero(rows >= 0)
+            return self._compute_columns(table, rows[row_indices], row_indices)
+        return self._focused_compute(self._convert_nodes(nodes))
+
+    def _table_rows(self, table: VNodeTable, nodes: Sequence[Optional[AnyNode]]) -> numpy.ndarray:
+        """
+        Find the rows of the focused nodes in the table.
+
+        :param table: Columnar representation of the nodes.
+        :param nodes: Nodes of the neighbour group before the conversion to the target type.
+        :return: Row indices, -1 where the node does not exist.
+        """
+        return table.rows(self._convert_nodes(nodes))
 
     def _focused_compute(self, nodes: Sequence[Optional[TVAnyNode]],
                          ) -> Tuple[List[int], List[int], List[int]]:
@@ -322,6 +539,28 @@ class NodeFeature(NeighbourFeature[TVAnyNode]):
         """Compute the feature value(s) for a given node."""
         raise NotImplementedError()
 
+    def _compute_columns(self, table: VNodeTable, rows: numpy.ndarray, row_indices: numpy.ndarray,
+                         ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """
+        Compute the feature values for the existing nodes at once.
+
+        :param table: Columnar representation of the nodes.
+        :param rows: Rows of the nodes in the table.
+        :param row_indices: Row indices of the nodes in the resulting matrix.
+        :return: Feature values, row indices and column indices.
+        """
+        return self._clip_column(self._compute_column(table, rows), row_indices)
+
+    def _compute_column(self, table: VNodeTable, rows: numpy.ndarray) -> numpy.ndarray:
+        """
+        Compute the values of a single column feature for the existing nodes at once.
+
+        :param table: Columnar representation of the nodes.
+        :param rows: Rows of the nodes in the table.
+        :return: Feature values before clipping, negative if the feature does not exist.
+        """
+        raise NotImplementedError()
+
 
 class VirtualNodeFeature(NodeFeature[VirtualNode]):
     """Base type for Feature-s computed on a virtual node per sample."""
@@ -334,6 +573,19 @@ class BblfshNodeFeature(NodeFeature[bblfsh.Node]):
 
     target_type = bblfsh.Node
 
+    def _table_rows(self, table: VNodeTable, nodes: Sequence[Optional[AnyNode]]) -> numpy.ndarray:
+        """
+        Find the rows of the focused nodes in the UAST nodes of the table.
+
+        :param table: Columnar representation of the nodes.
+        :param nodes: Nodes of the neighbour group before the conversion to the target type.
+        :return: Indices in `table.uast_nodes`, -1 where the node does not exist.
+        """
+        if issubclass(FEATURE_GROUP_TYPES[self.neighbour_group], VirtualNode):
+            rows = table.rows(nodes)
+            return numpy.where(rows >= 0, table.node[rows], -1)
+        return table.uast_rows(nodes)
+
 
 FEATURE_CLASSES = {}  # type: MutableMapping[FeatureId, Type[Feature]]
 
@@ -351,42 +603,65 @@ class _FeatureDiffCol(OrdinalFeature, VirtualNodeComparisonFeature):
 
     id = FeatureId.diff_col
     feature_groups_whitelist = (FeatureGroup.left,)
+    columnar = True
 
     def _compute_row(self, node: VirtualNode, neighbour: VirtualNode) -> Iterable[Tuple[int, int]]:
         yield self._clip_int(abs(neighbour.start.col - node.start.col)), 0
 
+    def _compute_column(self, table: VNodeTable, node_rows: numpy.ndarray,
+                        neighbour_rows: numpy.ndarray) -> numpy.ndarray:
+        return numpy.abs(table.start_col[neighbour_rows] - table.start_col[node_rows])
+
 
 @register_feature
 class _FeatureDiffLine(OrdinalFeature, VirtualNodeComparisonFeature):
 
     id = FeatureId.diff_line
     feature_groups_whitelist = (FeatureGroup.left,)
+    columnar = True
 
     def _compute_row(self, node: VirtualNode, neighbour: VirtualNode) -> Iterable[Tuple[int, int]]:
         yield (self._clip_int(min(abs(neighbour.start.line - node.end.line),
                                   abs(neighbour.end.line - node.start.line))),
                0)
 
+    def _compute_column(self, table: VNodeTable, node_rows: numpy.ndarray,
+                        neighbour_rows: numpy.ndarray) -> numpy.ndarray:
+        return numpy.minimum(
+            numpy.abs(table.start_line[neighbour_rows] - table.end_line[node_rows]),
+            numpy.abs(table.end_line[neighbour_rows] - table.start_line[node_rows]))
+
 
 @register_feature
 class _FeatureDiffOffset(OrdinalFeature, VirtualNodeComparisonFeature):
 
     id = FeatureId.diff_offset
     feature_groups_whitelist = (FeatureGroup.left,)
+    columnar = True
 
     def _compute_row(self, node: VirtualNode, neighbour: VirtualNode) -> Iterable[Tuple[int, int]]:
         yield self._clip_int(abs(neighbour.start.offset - node.start.offset)), 0
 
+    def _compute_column(self, table: VNodeTable, node_rows: numpy.ndarray,
+                        neighbour_rows: numpy.ndarray) -> numpy.ndarray:
+        return numpy.abs(table.start_offset[neighbour_rows] - table.start_offset[node_rows])
+
 
 @register_feature
 class _FeatureIndexInternalType(OrdinalFeature, BblfshNodeFeature):
 
     id = FeatureId.index_internal_type
 
+    columnar = True
+
     def _compute_row(self, node: bblfsh.Node) -> Iterable[Tuple[int, int]]:
         if node.internal_type in self.roles.INTERNAL_TYPES_INDEX:
             yield self._clip_int(self.roles.INTERNAL_TYPES_INDEX[node.internal_type] + 1), 0
 
+    def _compute_column(self, table: VNodeTable, rows: numpy.ndarray) -> numpy.ndarray:
+        internal_type = table.uast_internal_type[rows]
+        return numpy.where(internal_type >= 0, internal_type + 1, -1)
+
 
 @register_feature
 class _FeatureIndexLabel(OrdinalFeature, VirtualNodeFeature):
@@ -394,25 +669,42 @@ class _FeatureIndexLabel(OrdinalFeature, VirtualNodeFeature):
     id = FeatureId.index_label
     feature_groups_whitelist = (FeatureGroup.left,)
 
+    columnar = True
+
     def _compute_row(self, node: VirtualNode) -> Iterable[Tuple[int, int]]:
         if node.y is not None:
             yield self._clip_int(self.class_sequences_to_labels[node.y] + 1), 0
 
+    def _compute_column(self, table: VNodeTable, rows: numpy.ndarray) -> numpy.ndarray:
+        labels = table.label[rows]
+        unknown = labels == VNodeTable.UNKNOWN_LABEL
+        if unknown.any():
+            raise KeyError(table.vnodes[rows[numpy.argmax(unknown)]].y)
+        return numpy.where(labels == VNodeTable.NO_LABEL, -1, labels + 1)
+
 
 @register_feature
 class _FeatureIndexReserved(OrdinalFeature, VirtualNodeFeature):
 
     id = FeatureId.index_reserved
+    columnar = True
 
     def _compute_row(self, node: VirtualNode) -> Iterable[Tuple[int, int]]:
         if not (node.y is None or node.node) and node.value in self.tokens.RESERVED_INDEX:
             yield self._clip_int(self.tokens.RESERVED_INDEX[node.value] + 1), 0
 
+    def _compute_column(self, table: VNodeTable, rows: numpy.ndarray) -> numpy.ndarray:
+        reserved = table.reserved[rows]
+        exists = ((table.label[rows] != VNodeTable.NO_LABEL) & ~table.has_node[rows] &
+                  (reserved >= 0))
+        return numpy.where(exists, reserved + 1, -1)
+
 
 @register_feature
 class _FeatureInternalType(CategoricalFeature, BblfshNodeFeature):
 
     id = FeatureId.internal_type
+    columnar = True
 
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
@@ -423,6 +715,13 @@ class _FeatureInternalType(CategoricalFeature, BblfshNodeFeature):
         if internal_type in self.selected_names_index:
             yield 1, self.selected_names_index[internal_type]
 
+    def _compute_columns(self, table: VNodeTable, rows: numpy.ndarray, row_indices: numpy.ndarray,
+                         ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        columns = self.columns[table.uast_internal_type[rows]]
+        exists = columns >= 0
+        return (numpy.ones(numpy.count_nonzero(exists), dtype=FEATURES_NUMPY_TYPE),
+                row_indices[exists], columns[exists])
+
 
 @register_feature
 class _FeatureLabel(BagFeature, VirtualNodeFeature):
@@ -448,6 +747,7 @@ class _FeatureLabel(BagFeature, VirtualNodeFeature):
 class _FeatureReserved(CategoricalFeature, VirtualNodeFeature):
 
     id = FeatureId.reserved
+    columnar = True
 
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
@@ -457,21 +757,45 @@ class _FeatureReserved(CategoricalFeature, VirtualNodeFeature):
         if node.value in self.selected_names_index:
             yield 1, self.selected_names_index[node.value]
 
+    def _compute_columns(self, table: VNodeTable, rows: numpy.ndarray, row_indices: numpy.ndarray,
+                         ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        columns = self.columns[table.reserved[rows]]
+        exists = columns >= 0
+        return (numpy.ones(numpy.count_nonzero(exists), dtype=FEATURES_NUMPY_TYPE),
+                row_indices[exists], columns[exists])
+
 
 @register_feature
 class _FeatureRoles(BagFeature, BblfshNodeFeature):
 
     id = FeatureId.roles
+    columnar = True
 
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
         self._names = self.roles.ROLES
+        self._role_columns = None  # type: Optional[List[int]]
 
     def _compute_row(self, node: bblfsh.Node) -> Iterable[Tuple[int, int]]:
+        if self._role_columns is None:
+            self._role_columns = self.columns[self.roles.ROLES_BY_ID].tolist()
+        role_columns = self._role_columns
         for role_id in node.roles:
-            role = bblfsh.role_name(role_id)
-            if role in self.selected_names_index:
-                yield 1, self.selected_names_index[role]
+            if role_id < len(role_columns) and role_columns[role_id] >= 0:
+                yield 1, role_columns[role_id]
+
+    def _compute_columns(self, table: VNodeTable, rows: numpy.ndarray, row_indices: numpy.ndarray,
+                         ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        indptr, roles = table.uast_roles
+        counts = indptr[rows + 1] - indptr[rows]
+        # the positions of the roles of each node in the concatenated roles
+        shifts = indptr[rows] - (numpy.cumsum(counts) - counts)
+        positions = numpy.arange(counts.sum()) + numpy.repeat(shifts, counts)
+        columns = self.columns[roles[positions]]
+        row_indices = numpy.repeat(row_indices, counts)
+        exists = columns >= 0
+        return (numpy.ones(numpy.count_nonzero(exists), dtype=FEATURES_NUMPY_TYPE),
+                row_indices[exists], columns[exists])
 
 
 @register_feature
@@ -479,26 +803,39 @@ class _FeatureLength(OrdinalFeature, VirtualNodeFeature):
 
     id = FeatureId.length
     feature_groups_whitelist = (FeatureGroup.left, FeatureGroup.right)
+    columnar = True
 
     def _compute_row(self, node: VirtualNode) -> Iterable[Tuple[int, int]]:
         yield self._clip_int(node.end.offset - node.start.offset), 0
 
+    def _compute_column(self, table: VNodeTable, rows: numpy.ndarray) -> numpy.ndarray:
+        # the length is never negative, so every node has the feature
+        return table.length[rows]
+
 
 @register_feature
 class _FeatureStartCol(OrdinalFeature, VirtualNodeFeature):
 
     id = FeatureId.start_col
     feature_groups_whitelist = (FeatureGroup.left, FeatureGroup.node)
+    columnar = True
 
     def _compute_row(self, node: VirtualNode) -> Iterable[Tuple[int, int]]:
         yield self._clip_int(node.start.col), 0
 
+    def _compute_column(self, table: VNodeTable, rows: numpy.ndarray) -> numpy.ndarray:
+        return table.start_col[rows]
+
 
 @register_feature
 class _FeatureStartLine(OrdinalFeature, VirtualNodeFeature):
 
     id = FeatureId.start_line
     feature_groups_whitelist = (FeatureGroup.left, FeatureGroup.node)
+    columnar = True
 
     def _compute_row(self, node: VirtualNode) -> Iterable[Tuple[int, int]]:
         yield self._clip_int(node.start.line), 0
+
+    def _compute_column(self, table: VNodeTable, rows: numpy.ndarray) -> numpy.ndarray:
+        return table.start_line[rows]
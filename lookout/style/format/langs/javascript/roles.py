@@ -1,4 +1,6 @@
 """Javascript specific bablefish roles and internal types tooling."""
+import bblfsh
+import numpy
 
 
 INTERNAL_TYPES_FREQ = {
@@ -250,3 +252,8 @@ INTERNAL_TYPES = sorted(INTERNAL_TYPES_FREQ)
 INTERNAL_TYPES_INDEX = {r:  i for i, r in enumerate(INTERNAL_TYPES)}
 ROLES = sorted(ROLES_FREQ)
 ROLES_INDEX = {r:  i for i, r in enumerate(ROLES)}
+
+# dense tables for the integer lookups in the hot loops: bblfsh role id -> index in ROLES
+ROLE_IDS = [bblfsh.role_id(role) for role in ROLES]
+ROLES_BY_ID = numpy.full(max(ROLE_IDS) + 1, -1, dtype=numpy.int32)
+ROLES_BY_ID[ROLE_IDS] = numpy.arange(len(ROLES), dtype=numpy.int32)
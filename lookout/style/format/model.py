@@ -1,15 +1,14 @@
 """Modelforge model for the format analyzer."""
-from copy import deepcopy
+from copy import copy, deepcopy
 import io
-from itertools import islice
 from pprint import pprint
-from typing import Dict, Iterable, List, Mapping, Tuple  # noqa: F401
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple  # noqa: F401
 
 from lookout.core.analyzer import AnalyzerModel
 import numpy
 from sourced.ml.models.license import DEFAULT_LICENSE
 
-from lookout.style.format.rules import Rule, RuleAttribute, Rules, RuleStats
+from lookout.style.format.rules import Rule, Rules, RuleSet
 
 
 class FormatModel(AnalyzerModel):
@@ -27,10 +26,22 @@ class FormatModel(AnalyzerModel):
 
     LICENSE = DEFAULT_LICENSE
 
-    def __init__(self, **kwargs):
-        """Construct a FormatModel."""
+    def __init__(self, *, rules_thresholds: Sequence[Tuple[float, int]] = (), **kwargs):
+        """
+        Construct a FormatModel.
+
+        :param rules_thresholds: Pairs of confidence and support thresholds for which the \
+                                 filtered rules of every language are built right after loading. \
+                                 See `filter_rules()`. This is for the standalone tools and the \
+                                 benchmarks: the analyzer service loads the models with the \
+                                 defaults and the filtered rules are built and cached on the \
+                                 first analysis instead.
+        :param kwargs: Passed to AnalyzerModel.__init__().
+        """
         super().__init__(**kwargs)
         self._rules_by_lang = {}  # type: Dict[str, Rules]
+        self._filtered_rules = {}  # type: Dict[tuple, Rules]
+        self._rules_thresholds = tuple(rules_thresholds)
 
     @property
     def languages(self) -> List[str]:
@@ -42,7 +53,8 @@ class FormatModel(AnalyzerModel):
         result = io.StringIO()
         result.write(super().dump())
         for lang, rules in sorted(self._rules_by_lang.items()):
-            result.write("\n\n# %s\n%s\n" % (lang, rules))
+            result.write("\n\n# %s\n%s\ncompiled: %d bytes\n" % (
+                lang, rules, rules.compiled_size))
             try:
                 for ds in ("train", "test"):
                     print("## %s" % ds, file=result)
@@ -64,6 +76,8 @@ class FormatModel(AnalyzerModel):
             languages=languages,
             origin_configs=[self[lang].origin_config for lang in languages],
             ruless=[self._disassemble_rules(self[lang].rules) for lang in languages],
+            compiled_ruless=[self._disassemble_compiled_rules(self[lang])
+                             for lang in languages],
             classification_reports=[self._disassemble_classification_report(
                 self[lang].classification_report) for lang in languages],
         )
@@ -71,11 +85,17 @@ class FormatModel(AnalyzerModel):
 
     def _load_tree(self, tree: dict) -> None:
         super()._load_tree(tree)
-        for lang, origin_config, rules, report in zip(
-                tree["languages"], tree["origin_configs"], tree["ruless"],
+        # models saved before the compiled rules were stored are compiled on load
+        compiled_ruless = tree.get("compiled_ruless", [None] * len(tree["languages"]))
+        for lang, origin_config, rules, compiled_rules, report in zip(
+                tree["languages"], tree["origin_configs"], tree["ruless"], compiled_ruless,
                 tree["classification_reports"]):
-            self[lang] = Rules(self._assemble_rules(rules), deepcopy(origin_config))
+            self[lang] = Rules(self._assemble_rules(rules), deepcopy(origin_config),
+                               self._assemble_compiled_rules(compiled_rules))
             self[lang]._classification_report = self._assemble_classification_report(report)
+        for lang in self.languages:
+            for confidence_threshold, support_threshold in self._rules_thresholds:
+                self.filter_rules(lang, confidence_threshold, support_threshold)
 
     def __len__(self) -> int:
         return len(self._rules_by_lang)
@@ -94,6 +114,43 @@ class FormatModel(AnalyzerModel):
         Set a new Rules estimator to the model by its language.
         """
         self._rules_by_lang[lang] = rules
+        for key in [key for key in self._filtered_rules if key[0] == lang]:
+            del self._filtered_rules[key]
+
+    def filter_rules(self, lang: str, confidence_threshold: float, support_threshold: int,
+                     generated_rules_dir: Optional[str] = None, early_exit: bool = False,
+                     ) -> Rules:
+        """
+        Get the compiled Rules of the language filtered by confidence and support.
+
+        The result is cached, so repeated calls with the same arguments are free. The rules \
+        which are evaluated in different modes share the filtered and compiled rules.
+
+        :param lang: Estimator language.
+        :param confidence_threshold: Minimum confidence value, see `Rules.filter_by_confidence()`.
+        :param support_threshold: Minimum support value, see `Rules.filter_by_support()`.
+        :param generated_rules_dir: If not None, the rules are evaluated with the generated \
+                                    code which is cached in this directory, usually next to the \
+                                    model. See `Rules.use_generated_code()`.
+        :param early_exit: Whether to evaluate the rules with the early exit, see \
+                           `Rules.use_early_exit()`.
+        :return: Filtered Rules estimator instance which must not be modified.
+        """
+        key = lang, confidence_threshold, support_threshold, generated_rules_dir, early_exit
+        try:
+            return self._filtered_rules[key]
+        except KeyError:
+            pass
+        if generated_rules_dir is None and not early_exit:
+            rules = self[lang].filter_by_confidence(confidence_threshold) \
+                .filter_by_support(support_threshold)
+        else:
+            rules = copy(self.filter_rules(lang, confidence_threshold, support_threshold)) \
+                .use_early_exit(early_exit)
+            if generated_rules_dir is not None:
+                rules.use_generated_code(generated_rules_dir)
+        self._filtered_rules[key] = rules
+        return rules
 
     def __iter__(self):
         yield from self._rules_by_lang.__iter__()
@@ -117,38 +174,45 @@ class FormatModel(AnalyzerModel):
         return report
 
     @staticmethod
-    def _assemble_rules(rules_tree: dict) -> List[Rule]:
-        rules = []
-        rule_attrs = (RuleAttribute(*params) for params in
-                      zip(rules_tree["features"],  rules_tree["cmps"], rules_tree["thresholds"]))
-        for cls, conf, support, artificial, length in zip(
-                rules_tree["cls"], rules_tree["conf"], rules_tree["support"],
-                rules_tree["artificial"], rules_tree["lengths"]):
-            rules.append(Rule(attrs=tuple(islice(rule_attrs, int(length))),
-                              stats=RuleStats(int(cls), float(conf), int(support)),
-                              artificial=bool(artificial)))
-        return rules
+    def _assemble_compiled_rules(compiled_rules_tree: Optional[dict],
+                                 ) -> Optional[Rules.CompiledRules]:
+        if compiled_rules_tree is None or \
+                compiled_rules_tree.get("version") != Rules.COMPILED_VERSION:
+            return None
+        # the arrays are taken as is to avoid copying
+        return Rules.CompiledRules(**{field: numpy.asarray(compiled_rules_tree[field])
+                                      for field in Rules.CompiledRules._fields})
+
+    @staticmethod
+    def _disassemble_compiled_rules(rules: Rules) -> Dict[str, Any]:
+        tree = dict(rules._compiled._asdict())
+        tree["version"] = Rules.COMPILED_VERSION
+        return tree
+
+    @staticmethod
+    def _assemble_rules(rules_tree: dict) -> RuleSet:
+        lengths = numpy.asarray(rules_tree["lengths"])
+        offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        return RuleSet(features=numpy.asarray(rules_tree["features"]),
+                       cmps=numpy.asarray(rules_tree["cmps"]),
+                       thresholds=numpy.asarray(rules_tree["thresholds"]),
+                       offsets=offsets,
+                       cls=numpy.asarray(rules_tree["cls"]),
+                       conf=numpy.asarray(rules_tree["conf"]),
+                       support=numpy.asarray(rules_tree["support"]),
+                       artificial=numpy.asarray(rules_tree["artificial"]))
 
     @staticmethod
     def _disassemble_rules(rules: Iterable[Rule]) -> Mapping[str, numpy.ndarray]:
-        def disassemble_rule(rule: Rule) -> Tuple[int, float, int, bool, numpy.ndarray,
-                                                  numpy.ndarray, numpy.ndarray, numpy.ndarray]:
-            rule_len = len(rule.attrs)
-            features, cmps, thresholds = zip(*rule.attrs)
-            features = numpy.fromiter(features, numpy.uint16, rule_len)
-            cmps = numpy.fromiter(cmps, numpy.bool, rule_len)
-            thresholds = numpy.fromiter(thresholds, numpy.float32, rule_len)
-            return (rule.stats.cls, rule.stats.conf, rule.stats.support, rule.artificial, features,
-                    cmps, thresholds, rule_len)
-
-        disassembled_rules = list(zip(*[disassemble_rule(rule) for rule in rules]))
+        rules = RuleSet.from_rules(rules)
         return dict(
-            cls=numpy.array(disassembled_rules[0], dtype=numpy.uint16),
-            conf=numpy.array(disassembled_rules[1], dtype=numpy.float32),
-            support=numpy.array(disassembled_rules[2], dtype=numpy.uint16),
-            artificial=numpy.array(disassembled_rules[3], dtype=numpy.bool),
-            features=numpy.concatenate(disassembled_rules[4]),
-            cmps=numpy.concatenate(disassembled_rules[5]),
-            thresholds=numpy.concatenate(disassembled_rules[6]),
-            lengths=numpy.array(disassembled_rules[7], dtype=numpy.uint16),
+            cls=rules.cls.astype(numpy.uint16),
+            conf=rules.conf.astype(numpy.float32),
+            support=rules.support.astype(numpy.uint16),
+            artificial=rules.artificial.astype(numpy.bool),
+            features=rules.features.astype(numpy.uint16),
+            cmps=rules.cmps.astype(numpy.bool),
+            thresholds=rules.thresholds.astype(numpy.float32),
+            lengths=rules.lengths.astype(numpy.uint16),
         )
@@ -1,15 +1,15 @@
 """Train and compile rules for multi-class classification using an sklearn base model."""
 from collections import defaultdict, OrderedDict
-from copy import deepcopy
+from copy import copy, deepcopy
 import functools
 from importlib import import_module
 from itertools import islice
 import logging
 import sys
+from types import ModuleType
 from typing import (Any, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional,
                     Sequence, Set, Tuple, Union)
 
-from bblfsh import role_name
 from igraph import Graph
 from lookout.core import slogging
 from lookout.core.ports import Type
@@ -28,7 +28,9 @@ from tqdm import tqdm
 from lookout.style.format.classes import CLASS_INDEX, CLS_DOUBLE_QUOTE, CLS_SINGLE_QUOTE
 from lookout.style.format.feature_extractor import FeatureExtractor
 from lookout.style.format.features import CategoricalFeature, Feature, FeatureGroup, FeatureId
-from lookout.style.format.utils import get_classification_report
+from lookout.style.format.rules_codegen import RulesCodeGenerator
+from lookout.style.format.utils import can_fork, get_classification_report, \
+    get_processes_number, map_forked
 from lookout.style.format.virtual_node import VirtualNode
 
 RuleAttribute = NamedTuple(
@@ -80,38 +82,219 @@ class Rule(NamedTuple("RuleType", (("attrs", Tuple[RuleAttribute, ...]), ("stats
                     yield feature, feature_id, splits, node_index, group
 
 
+def _expand_ranges(starts: numpy.ndarray, ends: numpy.ndarray) -> numpy.ndarray:
+    """Concatenate `numpy.arange(start, end)` for each pair of `starts` and `ends`."""
+    lengths = ends - starts
+    if not len(lengths):
+        return numpy.zeros(0, dtype=numpy.int64)
+    offsets = numpy.cumsum(lengths)
+    return numpy.arange(offsets[-1]) - numpy.repeat(offsets - lengths - starts, lengths)
+
+
+class RuleSet(Sequence[Rule]):
+    """
+    Columnar storage of rules backed by numpy arrays.
+
+    The attributes of all the rules are concatenated in `features`, `cmps` and `thresholds`; \
+    the attributes of the i-th rule are at `offsets[i]:offsets[i + 1]`. The statistics are \
+    stored in `cls`, `conf`, `support` and `artificial`. Indexing by an integer returns a `Rule` \
+    view, indexing by a slice, a boolean mask or an array of indices returns a new `RuleSet`.
+    """
+
+    def __init__(self, features: numpy.ndarray, cmps: numpy.ndarray, thresholds: numpy.ndarray,
+                 offsets: numpy.ndarray, cls: numpy.ndarray, conf: numpy.ndarray,
+                 support: numpy.ndarray, artificial: numpy.ndarray):
+        """
+        Initialize a new instance of RuleSet class. The arrays are not copied.
+
+        :param features: Feature indices of the attributes of all the rules.
+        :param cmps: Comparison types of the attributes: True is "x > v", False is "x <= v".
+        :param thresholds: Threshold values of the attributes.
+        :param offsets: Start indices of the attributes of each rule and the total number of \
+                        the attributes at the end.
+        :param cls: Predicted classes of the rules.
+        :param conf: Confidences of the rules.
+        :param support: Supports of the rules.
+        :param artificial: Flags which indicate whether the rules were created outside of the \
+                           training.
+        """
+        assert len(features) == len(cmps) == len(thresholds) == offsets[-1]
+        assert len(offsets) - 1 == len(cls) == len(conf) == len(support) == len(artificial)
+        self.features = features
+        self.cmps = cmps
+        self.thresholds = thresholds
+        self.offsets = offsets
+        self.cls = cls
+        self.conf = conf
+        self.support = support
+        self.artificial = artificial
+
+    @classmethod
+    def from_rules(cls, rules: Iterable[Rule]) -> "RuleSet":
+        """
+        Convert the rules to the columnar form.
+
+        :param rules: Rules to convert. RuleSet is returned as is.
+        :return: RuleSet with the same rules.
+        """
+        if isinstance(rules, RuleSet):
+            return rules
+        rules = list(rules)
+        attrs = [attr for rule in rules for attr in rule.attrs]
+        offsets = numpy.zeros(len(rules) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(rule.attrs) for rule in rules], out=offsets[1:])
+
+        def column(values: Sequence, dtype: numpy.dtype) -> numpy.ndarray:
+            # the types of the values are preserved if possible, e.g. support may be a float
+            return numpy.array(values) if values else numpy.zeros(0, dtype=dtype)
+
+        return cls(features=column([attr.feature for attr in attrs], numpy.int64),
+                   cmps=numpy.array([attr.cmp for attr in attrs], dtype=bool),
+                   thresholds=column([attr.threshold for attr in attrs], numpy.float64),
+                   offsets=offsets,
+                   cls=column([rule.stats.cls for rule in rules], numpy.int64),
+                   conf=column([rule.stats.conf for rule in rules], numpy.float64),
+                   support=column([rule.stats.support for rule in rules], numpy.int64),
+                   artificial=numpy.array([rule.artificial for rule in rules], dtype=bool))
+
+    @property
+    def lengths(self) -> numpy.ndarray:
+        """Return the number of attributes in each rule."""
+        return numpy.diff(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.cls)
+
+    def __getitem__(self, index: Union[int, slice, numpy.ndarray]) -> Union[Rule, "RuleSet"]:
+        if isinstance(index, (int, numpy.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("rule index out of range")
+            start, finish = self.offsets[index], self.offsets[index + 1]
+            return Rule(
+                attrs=tuple(map(RuleAttribute, self.features[start:finish].tolist(),
+                                self.cmps[start:finish].tolist(),
+                                self.thresholds[start:finish].tolist())),
+                stats=RuleStats(self.cls[index].item(), self.conf[index].item(),
+                                self.support[index].item()),
+                artificial=self.artificial[index].item())
+        indices = numpy.arange(len(self))[index]
+        starts, ends = self.offsets[indices], self.offsets[indices + 1]
+        positions = _expand_ranges(starts, ends)
+        offsets = numpy.zeros(len(indices) + 1, dtype=numpy.int64)
+        numpy.cumsum(ends - starts, out=offsets[1:])
+        return RuleSet(features=self.features[positions], cmps=self.cmps[positions],
+                       thresholds=self.thresholds[positions], offsets=offsets,
+                       cls=self.cls[indices], conf=self.conf[indices],
+                       support=self.support[indices], artificial=self.artificial[indices])
+
+    def __iter__(self) -> Iterator[Rule]:
+        features, cmps = self.features.tolist(), self.cmps.tolist()
+        thresholds, offsets = self.thresholds.tolist(), self.offsets.tolist()
+        for i, (cls, conf, support, artificial) in enumerate(zip(
+                self.cls.tolist(), self.conf.tolist(), self.support.tolist(),
+                self.artificial.tolist())):
+            start, finish = offsets[i], offsets[i + 1]
+            yield Rule(attrs=tuple(map(RuleAttribute, features[start:finish],
+                                       cmps[start:finish], thresholds[start:finish])),
+                       stats=RuleStats(cls, conf, support), artificial=artificial)
+
+    def __add__(self, other: Sequence[Rule]) -> "RuleSet":
+        other = RuleSet.from_rules(other)
+        return RuleSet(
+            features=numpy.concatenate((self.features, other.features)),
+            cmps=numpy.concatenate((self.cmps, other.cmps)),
+            thresholds=numpy.concatenate((self.thresholds, other.thresholds)),
+            offsets=numpy.concatenate((self.offsets, other.offsets[1:] + self.offsets[-1])),
+            cls=numpy.concatenate((self.cls, other.cls)),
+            conf=numpy.concatenate((self.conf, other.conf)),
+            support=numpy.concatenate((self.support, other.support)),
+            artificial=numpy.concatenate((self.artificial, other.artificial)))
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return "RuleSet(%d rules, %d attributes)" % (len(self), len(self.features))
+
+    @property
+    def nbytes(self) -> int:
+        """Return the memory size of the arrays in bytes."""
+        return sum(arr.nbytes for arr in (
+            self.features, self.cmps, self.thresholds, self.offsets, self.cls, self.conf,
+            self.support, self.artificial))
+
+
 QuotedNodeTriple = NamedTuple("QuotedNodeTriple", (("left", VirtualNode), ("target", VirtualNode),
                                                    ("right", VirtualNode)))
 QuotedNodeTripleMapping = Mapping[int, Optional[QuotedNodeTriple]]
 
 
+def _evaluate_shard(state: Tuple["Rules", csr_matrix], bounds: Tuple[int, int],
+                    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # the rules and the features are inherited by the forked worker processes,
+    # see Rules._apply_sharded()
+    rules, X_csr = state
+    return rules._evaluate(X_csr[bounds[0]:bounds[1]])
+
+
 class Rules:
     """Store already trained rules for downstream prediction tasks."""
 
-    CompiledNegatedRules = NamedTuple("CompiledNegatedRules", (
-        ("false", numpy.ndarray), ("true", numpy.ndarray)))
+    CompiledRules = NamedTuple("CompiledRules", (
+        ("features", numpy.ndarray), ("values_offsets", numpy.ndarray),
+        ("values", numpy.ndarray), ("zero_buckets", numpy.ndarray),
+        ("attr_offsets", numpy.ndarray), ("attr_rules", numpy.ndarray),
+        ("false_ends", numpy.ndarray), ("true_starts", numpy.ndarray),
+        ("ranks", numpy.ndarray), ("classes", numpy.ndarray)))
     """
-    Each ndarray contains the rule indices which are **false** given
-    the corresponding feature, threshold value and the comparison type ("false" and "true").
+    Compiled rules which answer which rules are false given the feature value. The memory \
+    is linear in the number of the rule attributes.
+
+    `features` are the sorted distinct feature indices referenced by the rules. For the i-th
+    feature, `values[values_offsets[i]:values_offsets[i + 1]]` are the sorted distinct thresholds
+    and `attr_rules[attr_offsets[i]:attr_offsets[i + 1]]` are the rule indices of the attributes
+    of that feature: "x <= v" attributes first, then "x > v", each sorted by the threshold.
+    The feature value falls into the bucket `values_offsets[i] + i + searchsorted(values, x)`.
+    The attributes which are **false** in bucket `b` are `attr_rules[attr_offsets[i]:
+    false_ends[b]]` and `attr_rules[true_starts[b]:attr_offsets[i + 1]]`. `zero_buckets` are
+    the buckets of zero values. `ranks` are the rule positions ordered by descending confidence
+    and `classes` are the predicted classes of the rules.
     """
-    CompiledFeatureRules = NamedTuple("CompiledRule", (
-        ("values", numpy.ndarray), ("negated", Tuple[CompiledNegatedRules, ...])))
 
-    CompiledRulesType = Dict[int, CompiledFeatureRules]
+    COMPILED_VERSION = 1
+    """Bump it whenever the layout of CompiledRules changes, e.g. in the saved models."""
 
     _log = logging.getLogger("Rules")
+    _batch_size = 1 << 22  # maximum number of (sample, rule) pairs evaluated at once
+    _min_shard_size = 10000  # minimum number of samples evaluated by each process
 
-    def __init__(self, rules: List[Rule], origin_config: Mapping[str, Any]):
+    def __init__(self, rules: Union[RuleSet, Sequence[Rule]], origin_config: Mapping[str, Any],
+                 compiled: Optional[CompiledRules] = None):
         """
         Initialize the rules so that it is possible to call predict() afterwards.
 
-        :param rules: List of rules to assign.
+        :param rules: Rules to assign. They are converted to RuleSet if needed.
         :param origin_config: All parameters that are used for the model training.
+        :param compiled: Previously compiled `rules`, for example, loaded from a model. \
+                         The rules are compiled from scratch if None.
         """
         super().__init__()
         assert rules is not None, "rules may not be None"
-        self._rules = tuple(rules)  # Rule list is constant
-        self._compiled = self._compile(rules)
+        self._rules = RuleSet.from_rules(rules)  # RuleSet is constant
+        if compiled is None:
+            compiled = self._compile(self._rules)
+        else:
+            assert len(compiled.ranks) == len(self._rules), \
+                "compiled does not match the rules"
+        self._compiled = compiled
+        self._generated = None
+        self._early_exit = False
         self._origin_config = origin_config
         self._classification_report = {"test": {}, "train": {}}  # type: Dict[str, Dict[str, Any]]
 
@@ -132,43 +315,188 @@ class Rules:
         """
         return self._classification_report
 
-    def apply(self, X_csr: csr_matrix, return_winner_indices=False,
+    def apply(self, X_csr: csr_matrix, return_winner_indices=False, n_jobs: int = 1,
               ) -> Union[numpy.ndarray, Tuple[numpy.ndarray, numpy.ndarray]]:
         """
         Evaluate the rules against the given features.
 
         :param X_csr: input features.
         :param return_winner_indices: whether to return the winning rule index for each sample.
+        :param n_jobs: number of processes which evaluate the shards of the samples. Negative \
+                       values count from the number of CPUs: -1 means all of them.
         :return: array of the same length as X with predictions or tuple of two arrays of the same\
                  length as X containing (predictions, winner rule indices). In case no rule was \
                  triggered for feature row, corresponding result equals to -1.
         """
-        X = X_csr.toarray()
-        self._log.debug("predicting %d samples using %d rules", len(X), len(self._rules))
-        rules = self._rules
-        _compute_triggered = self._compute_triggered
-        prediction = numpy.full(len(X), -1, dtype=numpy.int32)
-        if return_winner_indices:
-            winner_indices = numpy.full(len(X), -2, dtype=numpy.int32)
-        for xi, x in enumerate(X):
-            ris = _compute_triggered(self._compiled, rules, x)
-            if len(ris) == 0:
-                continue
-            if len(ris) > 1:
-                confs = numpy.zeros(len(ris), dtype=numpy.float32)
-                for i, ri in enumerate(ris):
-                    confs[i] = rules[ri].stats.conf
-                winner_index = ris[numpy.argmax(confs)]
-            else:
-                winner_index = ris[0]
-            prediction[xi] = rules[winner_index].stats.cls
-            if return_winner_indices:
-                winner_indices[xi] = winner_index
+        self._log.debug("predicting %d samples using %d rules", X_csr.shape[0], len(self._rules))
+        if n_jobs == 1:
+            prediction, winner_indices = self._evaluate(X_csr)
+        else:
+            prediction, winner_indices = self._apply_sharded(X_csr, n_jobs)
         self._log.debug("No rule was triggered in %d cases.", numpy.sum(prediction == -1))
         if return_winner_indices:
             return prediction, winner_indices
         return prediction
 
+    def use_generated_code(self, cache_dir: Optional[str] = None) -> "Rules":
+        """
+        Evaluate the rules with the specialized generated code in `apply()`.
+
+        See `RulesCodeGenerator` for the details. The results are exactly the same as without \
+        the generated code.
+
+        :param cache_dir: Directory where the generated code is cached, for example, next to \
+                          the model. The code is generated again every time if None.
+        :return: self
+        """
+        self._generated = RulesCodeGenerator(cache_dir).load(
+            self._rules.features, self._rules.cmps, self._rules.thresholds, self._rules.offsets,
+            self._compiled.ranks)
+        return self
+
+    def use_early_exit(self, enabled: bool = True) -> "Rules":
+        """
+        Evaluate the rules in the order of decreasing confidence in `apply()`.
+
+        The first triggered rule is the winner, so the evaluation of a sample stops as soon as \
+        any rule is triggered. This is faster than the evaluation of all the rules if most of \
+        the samples are matched by the high-confidence rules. The results are exactly the same. \
+        The generated code takes precedence, see `use_generated_code()`.
+
+        :param enabled: Whether to enable the early exit.
+        :return: self
+        """
+        self._early_exit = enabled
+        return self
+
+    def _apply_sharded(self, X_csr: csr_matrix, n_jobs: int,
+                       ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Evaluate the rules in several processes, each takes a contiguous range of the samples.
+
+        The worker processes are forked, so the rules and the features are shared copy-on-write \
+        and only the results are transferred back. The rules are evaluated in the current \
+        process if forking is not possible or there are too few samples.
+
+        :param X_csr: input features.
+        :param n_jobs: number of processes, see `apply()`.
+        :return: predictions and winner rule indices, the same as in `apply()`.
+        """
+        n_samples = X_csr.shape[0]
+        n_shards = min(get_processes_number(n_jobs), n_samples // self._min_shard_size)
+        if n_shards <= 1 or not can_fork():
+            return self._evaluate(X_csr)
+        borders = numpy.linspace(0, n_samples, n_shards + 1).astype(int).tolist()
+        self._log.debug("evaluating %d samples in %d processes", n_samples, n_shards)
+        results = map_forked(_evaluate_shard, list(zip(borders[:-1], borders[1:])),
+                             (self, X_csr), n_shards)
+        predictions, winner_indices = zip(*results)
+        return numpy.concatenate(predictions), numpy.concatenate(winner_indices)
+
+    def _evaluate(self, X_csr: csr_matrix) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        if self._generated is not None:
+            return self._apply_generated(X_csr)
+        if self._early_exit:
+            return self._apply_early_exit(X_csr)
+        return self._apply_batch(X_csr)
+
+    def _apply_early_exit(self, X_csr: csr_matrix) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Evaluate the rules in the order of their ranks and stop as soon as there is a winner.
+
+        The samples are processed in batches. The pending samples of each batch are checked \
+        against the growing chunks of the ordered rules, and the samples which trigger any rule \
+        in the chunk are decided by the first triggered rule.
+
+        :param X_csr: input features.
+        :return: predictions and winner rule indices, the same as in `apply()`.
+        """
+        compiled = self._compiled
+        rules = self._rules
+        n_samples, n_features = X_csr.shape
+        n_rules = len(rules)
+        prediction = numpy.full(n_samples, -1, dtype=numpy.int32)
+        winner_indices = numpy.full(n_samples, -2, dtype=numpy.int32)
+        if n_samples == 0 or n_rules == 0:
+            return prediction, winner_indices
+        n_used = numpy.searchsorted(compiled.features, n_features)
+        used_features = compiled.features[:n_used]
+        rank_to_rule = numpy.argsort(compiled.ranks)
+        # the attributes of the rules ordered by the rank
+        starts, ends = rules.offsets[rank_to_rule], rules.offsets[rank_to_rule + 1]
+        positions = _expand_ranges(starts, ends)
+        rank_offsets = numpy.zeros(n_rules + 1, dtype=numpy.int64)
+        numpy.cumsum(ends - starts, out=rank_offsets[1:])
+        attr_columns = numpy.searchsorted(compiled.features, rules.features[positions])
+        cmps = rules.cmps[positions].astype(bool)
+        thresholds = rules.thresholds[positions].astype(numpy.float32)
+        # the attributes of the missing features refer to the zero column and are always true
+        missing = attr_columns >= n_used
+        attr_columns[missing] = n_used
+        cmps[missing] = False
+        thresholds[missing] = numpy.inf
+        # the same type as the thresholds are compared with in numpy.searchsorted()
+        dtype = numpy.result_type(X_csr.dtype, numpy.float32)
+        batch_size = max(1, self._batch_size // max(n_used, 1))
+        for batch_start in range(0, n_samples, batch_size):
+            batch_finish = min(batch_start + batch_size, n_samples)
+            columns = numpy.zeros((n_used + 1, batch_finish - batch_start), dtype=dtype)
+            columns[:n_used] = X_csr[batch_start:batch_finish][:, used_features].toarray().T
+            pending = numpy.arange(batch_finish - batch_start)
+            rank, chunk_size = 0, 8
+            while len(pending) > 0 and rank < n_rules:
+                max_attrs = rank_offsets[rank] + max(1, self._batch_size // len(pending))
+                finish = max(rank + 1, min(rank + chunk_size, n_rules,
+                                           numpy.searchsorted(rank_offsets, max_attrs) - 1))
+                attrs_start, attrs_finish = rank_offsets[rank], rank_offsets[finish]
+                values = columns[attr_columns[attrs_start:attrs_finish, None], pending]
+                falses = numpy.zeros((attrs_finish - attrs_start + 1, len(pending)),
+                                     dtype=numpy.int32)
+                numpy.cumsum((values > thresholds[attrs_start:attrs_finish, None])
+                             != cmps[attrs_start:attrs_finish, None], axis=0, out=falses[1:])
+                borders = rank_offsets[rank:finish + 1] - attrs_start
+                triggered = falses[borders[1:]] == falses[borders[:-1]]
+                decided = triggered.any(axis=0)
+                winners = rank_to_rule[rank + triggered[:, decided].argmax(axis=0)]
+                samples = batch_start + pending[decided]
+                winner_indices[samples] = winners
+                prediction[samples] = compiled.classes[winners]
+                pending = pending[~decided]
+                rank = finish
+                chunk_size *= 2
+        return prediction, winner_indices
+
+    def _apply_generated(self, X_csr: csr_matrix) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Evaluate the rules with the generated code from `use_generated_code()`.
+
+        :param X_csr: input features.
+        :return: predictions and winner rule indices, the same as in `apply()`.
+        """
+        compiled = self._compiled
+        n_samples, n_features = X_csr.shape
+        n_rules = len(self._rules)
+        prediction = numpy.full(n_samples, -1, dtype=numpy.int32)
+        winner_indices = numpy.full(n_samples, -2, dtype=numpy.int32)
+        if n_samples == 0 or n_rules == 0:
+            return prediction, winner_indices
+        used_features = compiled.features[:numpy.searchsorted(compiled.features, n_features)]
+        # the same type as the thresholds are compared with in numpy.searchsorted()
+        dtype = numpy.result_type(X_csr.dtype, numpy.float32)
+        rank_to_rule = numpy.argsort(compiled.ranks)
+        batch_size = max(1, self._batch_size // max(len(used_features), 1))
+        for batch_start in range(0, n_samples, batch_size):
+            batch_finish = min(batch_start + batch_size, n_samples)
+            columns = X_csr[batch_start:batch_finish][:, used_features] \
+                .toarray(order="F").astype(dtype, copy=False).T
+            best = numpy.full(batch_finish - batch_start, n_rules, dtype=numpy.int32)
+            self._generated(columns, best)
+            triggered = best < n_rules
+            winners = rank_to_rule[best[triggered]]
+            winner_indices[batch_start:batch_finish][triggered] = winners
+            prediction[batch_start:batch_finish][triggered] = compiled.classes[winners]
+        return prediction, winner_indices
+
     def predict(
             self, X: csr_matrix, vnodes_y: Sequence[VirtualNode], vnodes: Sequence[VirtualNode],
             feature_extractor: FeatureExtractor,
@@ -180,12 +508,14 @@ class Rules:
         :param vnodes_y: Sequence of the labeled `VirtualNode`-s corresponding to labeled samples.
         :param vnodes: Sequence of all the `VirtualNode`-s corresponding to the input.
         :param feature_extractor: FeatureExtractor used to extract features.
-        :return: The predictions, the winning rules and the new Rules.
+        :return: The predictions, the winning rules and the new Rules with the artificial quote \
+                 rules, see `harmonize_quotes()`.
         """
         y_pred, winners = self.apply(X, True)
         triggered = y_pred > 0
         vnodes_y_triggered = [vny for t, vny in zip(triggered, vnodes_y) if t]
-        grouped_quote_predictions = self._group_quote_predictions(vnodes_y_triggered, vnodes)
+        grouped_quote_predictions = self._group_quote_predictions(
+            vnodes_y_triggered, vnodes, feature_extractor.roles)
         y_pred[triggered], winners[triggered], new_rules = self.harmonize_quotes(
             y_pred=y_pred[triggered], vnodes_y=vnodes_y_triggered, vnodes=vnodes,
             winners=winners[triggered], feature_extractor=feature_extractor,
@@ -212,11 +542,12 @@ class Rules:
         """
         Filter rules according to a confidence threshold.
 
-        :param confidence_threshold: Minimum confidence value.
+        :param confidence_threshold: Only the rules with a higher confidence are kept.
         :return: Filtered rules.
         """
-        rules = [rule for rule in self._rules if rule.stats.conf > confidence_threshold]
-        self._log.debug("Filtered rules by confidence >= %.3f: %d -> %d",
+        # the loaded confidences are float32, the threshold must not be rounded to float32
+        rules = self._rules[self._rules.conf.astype(numpy.float64) > confidence_threshold]
+        self._log.debug("Filtered rules by confidence > %.3f: %d -> %d",
                         confidence_threshold, len(self._rules), len(rules))
         return Rules(rules, self._origin_config)
 
@@ -224,16 +555,81 @@ class Rules:
         """
         Filter rules according to a support threshold.
 
-        :param support_threshold: Minimum support value.
+        :param support_threshold: Only the rules with a higher support are kept.
         :return: Filtered rules.
         """
-        rules = [rule for rule in self._rules if rule.stats.support > support_threshold]
-        self._log.debug("Filtered rules by support >= %d: %d -> %d",
+        rules = self._rules[self._rules.support > support_threshold]
+        self._log.debug("Filtered rules by support > %d: %d -> %d",
                         support_threshold, len(self._rules), len(rules))
         return Rules(rules, self._origin_config)
 
+    def prune_dominated(self) -> "Rules":
+        """
+        Remove the rules which can never win.
+
+        Rule A is dominated by rule B if every sample which triggers A triggers B, that is, each \
+        attribute of B is implied by an attribute of A, and B wins over A: it has a lower \
+        compiled rank, the same as in `apply()`. B must have at least the same confidence and \
+        support as well, compared in the same types as in `filter_by_confidence()` and \
+        `filter_by_support()`, so that the filters never keep A without B. The ranks are built \
+        from the float32 confidences while the filters compare the float64 ones, so both \
+        conditions are required. Thus the predictions of the pruned rules stay the same for any \
+        features and thresholds.
+
+        :return: Rules without the dominated rules.
+        """
+        rules = self._rules
+        n_rules = len(rules)
+        ranks = self._compiled.ranks
+        features = rules.features.astype(numpy.int64)
+        cmps = rules.cmps.astype(bool)
+        thresholds = rules.thresholds.astype(numpy.float32)
+        offsets = rules.offsets
+        confs = rules.conf.astype(numpy.float64)
+        support = rules.support
+        n_features = features.max() + 1 if len(features) else 0
+        rank_to_rule = numpy.argsort(ranks)
+        dominated = numpy.zeros(n_rules, dtype=bool)
+        block_size = max(1, self._batch_size // max(len(features), 1))
+        # the rules are checked in the order of their ranks, so only the preceding rules and
+        # their attributes are considered
+        for block_start in range(0, n_rules, block_size):
+            block_finish = min(block_start + block_size, n_rules)
+            block = rank_to_rule[block_start:block_finish]
+            winners = rank_to_rule[:block_finish]
+            winner_lengths = offsets[winners + 1] - offsets[winners]
+            positions = _expand_ranges(offsets[winners], offsets[winners + 1])
+            winner_offsets = numpy.zeros(len(winners) + 1, dtype=numpy.int64)
+            numpy.cumsum(winner_lengths, out=winner_offsets[1:])
+            # the strictest bounds of each rule in the block: "x > lower" and "x <= upper"
+            lower = numpy.full((len(block), n_features), -numpy.inf, dtype=numpy.float32)
+            upper = numpy.full((len(block), n_features), numpy.inf, dtype=numpy.float32)
+            starts, ends = offsets[block], offsets[block + 1]
+            block_positions = _expand_ranges(starts, ends)
+            rows = numpy.repeat(numpy.arange(len(block)), ends - starts)
+            block_cmps = cmps[block_positions]
+            numpy.maximum.at(lower, (rows[block_cmps], features[block_positions][block_cmps]),
+                             thresholds[block_positions][block_cmps])
+            numpy.minimum.at(upper, (rows[~block_cmps], features[block_positions][~block_cmps]),
+                             thresholds[block_positions][~block_cmps])
+            winner_features = features[positions]
+            winner_thresholds = thresholds[positions]
+            violated = numpy.where(cmps[positions], lower[:, winner_features] < winner_thresholds,
+                                   upper[:, winner_features] > winner_thresholds)
+            del lower, upper
+            cumulative = numpy.zeros((len(block), len(positions) + 1), dtype=numpy.int32)
+            numpy.cumsum(violated, axis=1, out=cumulative[:, 1:])
+            del violated
+            implied = cumulative[:, winner_offsets[1:]] == cumulative[:, winner_offsets[:-1]]
+            wins = ((ranks[winners] < ranks[block, None])
+                    & (confs[winners] >= confs[block, None])
+                    & (support[winners] >= support[block, None]))
+            dominated[block] = (implied & wins).any(axis=1)
+        self._log.info("pruned %d/%d dominated rules", dominated.sum(), n_rules)
+        return Rules(rules[~dominated], self._origin_config)
+
     def generate_classification_report(self, X: csr_matrix, y: numpy.ndarray, dataset_type: str,
-                                       target_names: Sequence[str]) -> None:
+                                       target_names: Sequence[str], n_jobs: int = 1) -> None:
         """
         Calculate and store classification report with quality metrics for given dataset.
 
@@ -242,11 +638,12 @@ class Rules:
         :param dataset_type: Can be set to "test" or "train" only. Marks passing data as train or \
                              test.
         :param target_names: Classes names in y.
+        :param n_jobs: Number of processes which evaluate the rules, see `apply()`.
         """
         # TODO(zurk): multi-language support.
         assert dataset_type in {"test", "train"}, "Unknown dataset_type='%s'. Known are 'test' " \
                                                   "and 'train'" % dataset_type
-        y_pred = self.apply(X)
+        y_pred = self.apply(X, n_jobs=n_jobs)
         self._classification_report[dataset_type] = get_classification_report(
             y_pred, y, target_names)
 
@@ -260,8 +657,10 @@ class Rules:
         return len(feature_extractor.labels_to_class_sequences) - 1
 
     def _group_quote_predictions(self, vnodes_y: Sequence[VirtualNode],
-                                 vnodes: Sequence[VirtualNode]) -> QuotedNodeTripleMapping:
+                                 vnodes: Sequence[VirtualNode], roles: ModuleType,
+                                 ) -> QuotedNodeTripleMapping:
         quotes_classes = frozenset((CLASS_INDEX[CLS_DOUBLE_QUOTE], CLASS_INDEX[CLS_SINGLE_QUOTE]))
+        string_role = roles.ROLE_IDS[roles.ROLES_INDEX["STRING"]]
         y_indices = {id(vnode): i for i, vnode in enumerate(vnodes_y)}
         grouped_predictions = OrderedDict()
         for vnode1, vnode2, vnode3 in zip(vnodes, islice(vnodes, 1, None),
@@ -269,8 +668,7 @@ class Rules:
             if (id(vnode1) not in y_indices or id(vnode3) not in y_indices or vnode2.node is None
                     or vnode1.y[-1] not in quotes_classes or vnode3.y[0] != vnode1.y[-1]):
                 continue
-            vnode2_roles = frozenset(role_name(role_id) for role_id in vnode2.node.roles)
-            if "STRING" in vnode2_roles:
+            if string_role in vnode2.node.roles:
                 grouped_predictions[id(vnode1)] = vnode1, vnode2, vnode3
                 grouped_predictions[id(vnode3)] = None
         return grouped_predictions
@@ -293,10 +691,12 @@ class Rules:
         :param winners: Indices of the rules that were used to compute the predictions.
         :param feature_extractor: FeatureExtractor used to extract features.
         :param grouped_quote_predictions: Quotes predictions (handled differenlty from the rest).
-        :return: Updated y, winners and new rules.
+        :return: Updated y, winners and new rules. The new rules are `LayeredRules` on top of \
+                 these ones so that the compiled rules are reused.
         """
         quotes_classes = {CLASS_INDEX[CLS_DOUBLE_QUOTE], CLASS_INDEX[CLS_SINGLE_QUOTE]}
-        processed_rules = list(self.rules)
+        rules = self._rules
+        artificial_rules = []
         processed_y = y_pred.copy()
         processed_winners = winners.copy()
         new_rules = {}
@@ -306,15 +706,15 @@ class Rules:
             if rule_id in new_rules:
                 rule_index = new_rules[rule_id]
             else:
-                processed_rules.append(
+                artificial_rules.append(
                     Rule(attrs=tuple(),
                          stats=RuleStats(cls=Rules._get_composite(feature_extractor, labels),
                                          conf=conf, support=support),
                          artificial=True))
-                rule_index = len(processed_rules) - 1
+                rule_index = len(rules) + len(artificial_rules) - 1
                 new_rules[rule_id] = rule_index
             processed_winners[y_i] = rule_index
-            processed_y[y_i] = processed_rules[rule_index].stats.cls
+            processed_y[y_i] = artificial_rules[rule_index - len(rules)].stats.cls
 
         y_indices = {id(vnode): i for i, vnode in enumerate(vnodes_y)}
         for group in grouped_quote_predictions.values():
@@ -323,8 +723,8 @@ class Rules:
             vnode1, vnode2, vnode3 = group
             y_i_1 = y_indices[id(vnode1)]
             y_i_3 = y_indices[id(vnode3)]
-            stats_vnode1 = processed_rules[winners[y_i_1]].stats
-            stats_vnode3 = processed_rules[winners[y_i_3]].stats
+            stats_vnode1 = rules[winners[y_i_1]].stats
+            stats_vnode3 = rules[winners[y_i_3]].stats
             labels1 = list(feature_extractor.labels_to_class_sequences[y_pred[y_i_1]])
             labels3 = list(feature_extractor.labels_to_class_sequences[y_pred[y_i_3]])
             if labels1[-1] not in quotes_classes or labels3[0] not in quotes_classes:
@@ -338,11 +738,11 @@ class Rules:
                 else:
                     labels3[0] = quote
                     append_new_rule(tuple(labels3), y_i_3, stats_vnode1.conf, stats_vnode1.support)
-        return processed_y, processed_winners, Rules(processed_rules, self._origin_config)
+        return processed_y, processed_winners, LayeredRules(self, artificial_rules)
 
     @property
-    def rules(self) -> List[Rule]:
-        """Return the list of rules."""
+    def rules(self) -> RuleSet:
+        """Return the rules."""
         return self._rules
 
     @property
@@ -350,57 +750,234 @@ class Rules:
         """Return the configuration used for the model training."""
         return self._origin_config
 
+    @property
+    def used_features(self) -> numpy.ndarray:
+        """
+        Return the sorted distinct indices of the features referenced by the rules.
+
+        The other columns of the features matrix never influence the predictions, see \
+        `FeatureExtractor(used_features=...)`.
+        """
+        return self._compiled.features
+
+    @property
+    def compiled_size(self) -> int:
+        """Return the memory size of the compiled rules in bytes."""
+        return sum(arr.nbytes for arr in self._compiled)
+
     @property
     def avg_rule_len(self) -> float:
         """Compute the average length of the rules."""
         if not self._rules:
             return 0
-        return sum(len(r.attrs) for r in self._rules) / len(self._rules)
+        return len(self._rules.features) / len(self._rules)
 
     @classmethod
-    def _compile(cls, rules: Sequence[Rule]) -> CompiledRulesType:
+    def _compile(cls, rules: Union[RuleSet, Sequence[Rule]]) -> CompiledRules:
         cls._log.debug("compiling %d rules", len(rules))
-        attrs = defaultdict(lambda: defaultdict(lambda: [[], []]))
-        for i, (branch, _, _) in enumerate(rules):
-            for rule in branch:
-                attrs[rule.feature][rule.threshold][int(rule.cmp)].append(i)
-        compiled_attrs = {}
-        for key, attr in attrs.items():
-            vals = sorted(attr)
-            false_rules = set()
-            true_rules = set()
-            vr = [[None, None] for _ in vals]
-            for i in range(len(vals)):
-                false_rules.update(attr[vals[i]][False])
-                true_rules.update(attr[vals[len(vals) - i - 1]][True])
-                vr[i][False] = numpy.array(sorted(false_rules))
-                vr[len(vr) - i - 1][True] = numpy.array(sorted(true_rules))
-            compiled_attrs[key] = cls.CompiledFeatureRules(
-                numpy.array(vals, dtype=numpy.float32),
-                tuple(cls.CompiledNegatedRules(*v) for v in vr))
-        return compiled_attrs
+        rules = RuleSet.from_rules(rules)
+        n_attrs = len(rules.features)
+        features = rules.features.astype(numpy.int32)
+        cmps = rules.cmps.astype(bool)
+        thresholds = rules.thresholds.astype(numpy.float32)
+        rule_indices = numpy.repeat(numpy.arange(len(rules), dtype=numpy.int32), rules.lengths)
+        # sort by the feature, then "x <= v" before "x > v", then by the threshold
+        order = numpy.lexsort((thresholds, cmps, features))
+        features, cmps = features[order], cmps[order]
+        thresholds, rule_indices = thresholds[order], rule_indices[order]
+        unique_features, attr_offsets = numpy.unique(features, return_index=True)
+        attr_offsets = numpy.append(attr_offsets, n_attrs).astype(numpy.int32)
+        values, false_ends, true_starts = [], [], []
+        values_offsets = numpy.zeros(len(unique_features) + 1, dtype=numpy.int32)
+        zero_buckets = numpy.zeros(len(unique_features), dtype=numpy.int32)
+        for i, (start, finish) in enumerate(zip(attr_offsets[:-1], attr_offsets[1:])):
+            split = start + numpy.count_nonzero(~cmps[start:finish])
+            vals = numpy.unique(thresholds[start:finish])
+            values.append(vals)
+            values_offsets[i + 1] = values_offsets[i] + len(vals)
+            zero_buckets[i] = values_offsets[i] + i + numpy.searchsorted(vals, 0)
+            # bucket b contains x-s such that vals[b - 1] < x <= vals[b]
+            false_ends.append([start])
+            false_ends.append(start + numpy.searchsorted(thresholds[start:split], vals, "right"))
+            true_starts.append(split + numpy.searchsorted(thresholds[split:finish], vals, "left"))
+            true_starts.append([finish])
+        confs = rules.conf.astype(numpy.float32)
+        ranks = numpy.empty(len(rules), dtype=numpy.int32)
+        ranks[numpy.argsort(-confs, kind="stable")] = numpy.arange(len(rules), dtype=numpy.int32)
+        return cls.CompiledRules(
+            features=unique_features, values_offsets=values_offsets,
+            values=numpy.concatenate(values) if values else numpy.zeros(0, numpy.float32),
+            zero_buckets=zero_buckets, attr_offsets=attr_offsets, attr_rules=rule_indices,
+            false_ends=numpy.concatenate(false_ends).astype(numpy.int32)
+            if false_ends else numpy.zeros(0, numpy.int32),
+            true_starts=numpy.concatenate(true_starts).astype(numpy.int32)
+            if true_starts else numpy.zeros(0, numpy.int32),
+            ranks=ranks,
+            classes=rules.cls.astype(numpy.int32))
+
+    def _apply_batch(self, X_csr: csr_matrix) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Evaluate the rules against all the samples at once.
 
-    @classmethod
-    def _compute_triggered(cls, compiled_rules: CompiledRulesType,
-                           rules: Sequence[Rule], x: numpy.ndarray,
-                           ) -> numpy.ndarray:
-        searchsorted = numpy.searchsorted
-        triggered = numpy.full(len(rules), 0xff, dtype=numpy.int8)
-        for i, v in enumerate(x):
-            try:
-                vals, arules = compiled_rules[i]
-            except KeyError:
+        Each rule counts its false attributes. The counters are initialized with the values \
+        for the all-zero sample and are then corrected for the stored elements of the sparse \
+        matrix. The rule is triggered if the counter is zero, and the winner is the triggered \
+        rule with the highest confidence and the lowest index among equals.
+
+        :param X_csr: input features.
+        :return: predictions and winner rule indices, the same as in `apply()`.
+        """
+        compiled = self._compiled
+        n_samples, n_features = X_csr.shape
+        n_rules = len(self._rules)
+        prediction = numpy.full(n_samples, -1, dtype=numpy.int32)
+        winner_indices = numpy.full(n_samples, -2, dtype=numpy.int32)
+        if n_samples == 0 or n_rules == 0:
+            return prediction, winner_indices
+        X_csc = X_csr.tocsc()
+        if not X_csc.has_canonical_format:
+            X_csc = X_csc.copy()
+            X_csc.sum_duplicates()
+        attr_offsets, false_ends, true_starts = (
+            compiled.attr_offsets, compiled.false_ends, compiled.true_starts)
+        n_used = numpy.searchsorted(compiled.features, n_features)
+        zero_buckets = compiled.zero_buckets[:n_used]
+        zero_falses = numpy.concatenate((
+            _expand_ranges(attr_offsets[:n_used], false_ends[zero_buckets]),
+            _expand_ranges(true_starts[zero_buckets], attr_offsets[1:n_used + 1])))
+        zero_counts = numpy.bincount(compiled.attr_rules[zero_falses], minlength=n_rules)
+        # (sample, begin, end, sign) ranges in attr_rules which correct zero_counts
+        samples, begins, ends, signs = [], [], [], []
+        for i, feature in enumerate(compiled.features[:n_used]):
+            start, finish = X_csc.indptr[feature], X_csc.indptr[feature + 1]
+            if start == finish:
                 continue
-            border = searchsorted(vals, v)
-            if border > 0:
-                indices = arules[border - 1][False]
-                if len(indices):
-                    triggered[indices] = 0
-            if border < len(arules):
-                indices = arules[border][True]
-                if len(indices):
-                    triggered[indices] = 0
-        return numpy.nonzero(triggered)[0]
+            values = compiled.values[compiled.values_offsets[i]:compiled.values_offsets[i + 1]]
+            buckets = compiled.values_offsets[i] + i + numpy.searchsorted(
+                values, X_csc.data[start:finish])
+            changed = buckets != zero_buckets[i]
+            if not changed.any():
+                continue
+            feature_samples, buckets = X_csc.indices[start:finish][changed], buckets[changed]
+            for borders, zero_border, sign in ((false_ends[buckets], false_ends[zero_buckets[i]],
+                                                1),
+                                               (true_starts[buckets], true_starts[zero_buckets[i]],
+                                                -1)):
+                samples.append(feature_samples)
+                begins.append(numpy.minimum(borders, zero_border))
+                ends.append(numpy.maximum(borders, zero_border))
+                signs.append(numpy.where(borders > zero_border, sign, -sign))
+        if samples:
+            samples, begins, ends, signs = (
+                numpy.concatenate(arr) for arr in (samples, begins, ends, signs))
+            order = numpy.argsort(samples, kind="stable")
+            samples, begins, ends, signs = (
+                arr[order] for arr in (samples, begins, ends, signs))
+        else:
+            samples = begins = ends = signs = numpy.zeros(0, dtype=numpy.int64)
+        ranks = compiled.ranks
+        rank_to_rule = numpy.argsort(ranks)
+        batch_size = max(1, self._batch_size // n_rules)
+        for batch_start in range(0, n_samples, batch_size):
+            batch_finish = min(batch_start + batch_size, n_samples)
+            left, right = numpy.searchsorted(samples, (batch_start, batch_finish))
+            lengths = ends[left:right] - begins[left:right]
+            positions = _expand_ranges(begins[left:right], ends[left:right])
+            flat_indices = (numpy.repeat(samples[left:right] - batch_start, lengths) * n_rules
+                            + compiled.attr_rules[positions])
+            counts = numpy.bincount(
+                flat_indices, weights=numpy.repeat(signs[left:right], lengths),
+                minlength=(batch_finish - batch_start) * n_rules,
+            ).reshape(batch_finish - batch_start, n_rules)
+            counts += zero_counts
+            triggered_ranks = numpy.where(counts == 0, ranks, n_rules).min(axis=1)
+            triggered = triggered_ranks < n_rules
+            winners = rank_to_rule[triggered_ranks[triggered]]
+            winner_indices[batch_start:batch_finish][triggered] = winners
+            prediction[batch_start:batch_finish][triggered] = compiled.classes[winners]
+        return prediction, winner_indices
+
+
+class LayeredRules(Rules):
+    """
+    Artificial rules on top of the shared compiled base rules.
+
+    The artificial rules do not have attributes and are thus always triggered. The base rules \
+    are neither copied nor compiled again, so creating this object is cheap.
+    """
+
+    def __init__(self, base: Rules, artificial_rules: Sequence[Rule]):
+        """
+        Initialize the rules layer.
+
+        :param base: Rules to extend. If they are `LayeredRules` themselves, the new artificial \
+                     rules are appended to the existing layer.
+        :param artificial_rules: Rules without attributes which are indexed after the base ones.
+        """
+        assert all(rule.artificial and not rule.attrs for rule in artificial_rules), \
+            "only artificial rules without attributes can be layered"
+        if isinstance(base, LayeredRules):
+            artificial_rules = base._artificial_rules + tuple(artificial_rules)
+            evaluator = base._evaluator
+            base = base._base
+        else:
+            evaluator = base
+        # Rules.__init__() is not called on purpose to avoid the compilation
+        self._base = base
+        # evaluates the base rules in the mode of this layer, never configured in place
+        self._evaluator = evaluator
+        self._artificial_rules = tuple(artificial_rules)
+        self._rules = base.rules + self._artificial_rules
+        self._compiled = base._compiled
+        self._generated = None
+        self._early_exit = False
+        self._origin_config = base.origin_config
+        self._classification_report = {"test": {}, "train": {}}  # type: Dict[str, Dict[str, Any]]
+
+    @property
+    def base(self) -> Rules:
+        """Return the rules which are extended by the artificial rules."""
+        return self._base
+
+    def use_generated_code(self, cache_dir: Optional[str] = None) -> "Rules":
+        """
+        Evaluate the base rules with the specialized generated code.
+
+        The base rules are shared with the other layers and the model, so they are not \
+        changed: this layer evaluates them through its own shallow copy.
+
+        :param cache_dir: See `Rules.use_generated_code()`.
+        :return: self
+        """
+        self._evaluator = copy(self._evaluator).use_generated_code(cache_dir)
+        return self
+
+    def use_early_exit(self, enabled: bool = True) -> "Rules":
+        """
+        Evaluate the base rules in the order of decreasing confidence.
+
+        The base rules are not changed, see `use_generated_code()`.
+
+        :param enabled: See `Rules.use_early_exit()`.
+        :return: self
+        """
+        self._evaluator = copy(self._evaluator).use_early_exit(enabled)
+        return self
+
+    def _apply_batch(self, X_csr: csr_matrix) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        prediction, winner_indices = self._evaluator._evaluate(X_csr)
+        if not self._artificial_rules:
+            return prediction, winner_indices
+        confs = numpy.array([rule.stats.conf for rule in self._artificial_rules],
+                            dtype=numpy.float32)
+        best = int(numpy.argmax(confs))
+        base_confs = self._base.rules.conf.astype(numpy.float32)
+        # the base winner has a lower index and thus wins the ties
+        overridden = winner_indices < 0
+        overridden[~overridden] = base_confs[winner_indices[~overridden]] < confs[best]
+        winner_indices[overridden] = len(self._base) + best
+        prediction[overridden] = self._artificial_rules[best].stats.cls
+        return prediction, winner_indices
 
 
 LabelScore = NamedTuple("LabelScore", (
@@ -520,11 +1097,13 @@ class TrainableRules(BaseEstimator, ClassifierMixin):
                 self._log.debug("pruned %d/%d branches with reduced error pruning", old - new, old)
 
         def count_attrs():
+            if isinstance(rules, RuleSet):
+                return len(rules.features)
             return sum(len(r.attrs) for r in rules)
 
         old = count_attrs()
-        rules = [rule for rule in rules if rule.stats.conf > self.confidence_threshold]
-        rules = self._merge_rules(rules)
+        rules = RuleSet.from_rules(rules)
+        rules = self._merge_rules(rules[rules.conf > self.confidence_threshold])
         self._log.debug("merged %d/%d attributes", old - count_attrs(), old)
         if "top-down-greedy" in self.prune_branches_algorithms:
             old = len(rules)
@@ -542,6 +1121,16 @@ class TrainableRules(BaseEstimator, ClassifierMixin):
         self._rules = Rules(rules, self._origin_config)
         return self
 
+    def prune_dominated_rules(self) -> None:
+        """
+        Remove the rules which can never win. The predictions do not change.
+
+        See `Rules.prune_dominated()`.
+
+        :return: Nothing
+        """
+        self._rules = self._rules.prune_dominated()
+
     def prune_categorical_attributes(self, feature_extractor: FeatureExtractor) -> None:
         """
         Remove "not in" categorical assertions which are overridden by strict equalities.
@@ -699,27 +1288,32 @@ class TrainableRules(BaseEstimator, ClassifierMixin):
         return rules, leaf2rule
 
     @classmethod
-    def _merge_rules(cls, rules: List[Rule]) -> List[Rule]:
-        new_rules = []
-        for rule, stats, artificial in rules:
-            min_vals = {}
-            max_vals = {}
-            flags = defaultdict(int)
-            for name, cmp, val in rule:
-                if cmp:
-                    min_vals[name] = max(min_vals.get(name, val), val)
-                    flags[name] |= 1
-                else:
-                    max_vals[name] = min(max_vals.get(name, val), val)
-                    flags[name] |= 2
-            new_rule = []
-            for key, bits in sorted(flags.items()):
-                if bits & 2:
-                    new_rule.append(RuleAttribute(key, False, max_vals[key]))
-                if bits & 1:
-                    new_rule.append(RuleAttribute(key, True, min_vals[key]))
-            new_rules.append(Rule(attrs=tuple(new_rule), stats=stats, artificial=artificial))
-        return new_rules
+    def _merge_rules(cls, rules: Union[RuleSet, Sequence[Rule]]) -> RuleSet:
+        """
+        Merge the comparisons of the same feature and type within each rule.
+
+        Only the strictest threshold of each (feature, comparison type) pair is kept. The \
+        attributes are ordered by the feature with "x <= v" before "x > v".
+
+        :param rules: Rules to simplify.
+        :return: New RuleSet with merged attributes.
+        """
+        rules = RuleSet.from_rules(rules)
+        rule_indices = numpy.repeat(numpy.arange(len(rules)), rules.lengths)
+        order = numpy.lexsort((rules.thresholds, rules.cmps, rules.features, rule_indices))
+        rule_indices, features = rule_indices[order], rules.features[order]
+        cmps, thresholds = rules.cmps[order], rules.thresholds[order]
+        group_borders = numpy.ones(len(order) + 1, dtype=bool)
+        group_borders[1:-1] = ((rule_indices[1:] != rule_indices[:-1])
+                               | (features[1:] != features[:-1]) | (cmps[1:] != cmps[:-1]))
+        # the thresholds are sorted: the minimum of "x <= v" is the first, the maximum of
+        # "x > v" is the last
+        keep = numpy.where(cmps, group_borders[1:], group_borders[:-1])
+        offsets = numpy.zeros(len(rules) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(rule_indices[keep], minlength=len(rules)), out=offsets[1:])
+        return RuleSet(features=features[keep], cmps=cmps[keep], thresholds=thresholds[keep],
+                       offsets=offsets, cls=rules.cls, conf=rules.conf, support=rules.support,
+                       artificial=rules.artificial)
 
     @classmethod
     def _prune_reduced_error(cls, model: DecisionTreeClassifier, X: numpy.array, y: numpy.array,
@@ -807,9 +1401,9 @@ class TrainableRules(BaseEstimator, ClassifierMixin):
 
     def _prune_branches_top_down_greedy(
             self, base_model: Union[DecisionTreeClassifier, RandomForestClassifier],
-            rules: Sequence[Rule], X: numpy.ndarray, Y: numpy.ndarray,
+            rules: RuleSet, X: numpy.ndarray, Y: numpy.ndarray,
             leaf2rule: Sequence[Mapping[int, int]], budget: Tuple[bool, Union[float, int]],
-            ) -> List[Rule]:
+            ) -> RuleSet:
         """
         Prune branches using a greedy top down algorithm.
 
@@ -835,6 +1429,7 @@ class TrainableRules(BaseEstimator, ClassifierMixin):
         instances_index = self._build_instances_index(base_model, X, leaf2rule)
         confs_index = numpy.full(X.shape[0], -1.)
         clss_index = numpy.full(X.shape[0], -1)
+        confs, clss = rules.conf.tolist(), rules.cls.tolist()
         candidate_rules = set(range(len(rules)))
         selected_rules = set()
         for _ in range(n_budget):
@@ -842,23 +1437,22 @@ class TrainableRules(BaseEstimator, ClassifierMixin):
             for rule_id in candidate_rules:
                 triggered_instances = instances_index[rule_id]
                 matched_delta = 0
-                stats = rules[rule_id].stats
+                conf, cls = confs[rule_id], clss[rule_id]
                 for triggered_instance in triggered_instances:
-                    if (stats.conf > confs_index[triggered_instance]
-                            and stats.cls != clss_index[triggered_instance]):
+                    if (conf > confs_index[triggered_instance]
+                            and cls != clss_index[triggered_instance]):
                         if Y[triggered_instance] == clss_index[triggered_instance]:
                             matched_delta -= 1
-                        elif Y[triggered_instance] == stats.cls:
+                        elif Y[triggered_instance] == cls:
                             matched_delta += 1
                 scores.append((matched_delta, rule_id))
             best_matched_delta, best_rule_id = max(scores)
             for triggered_instance in instances_index[best_rule_id]:
-                stats = rules[best_rule_id].stats
-                confs_index[triggered_instance] = rules[rule_id].stats.conf
-                clss_index[triggered_instance] = stats.cls
+                confs_index[triggered_instance] = confs[rule_id]
+                clss_index[triggered_instance] = clss[best_rule_id]
             candidate_rules.remove(best_rule_id)
             selected_rules.add(best_rule_id)
-        return [rules[rule_id] for rule_id in selected_rules]
+        return rules[numpy.fromiter(selected_rules, dtype=numpy.int64, count=len(selected_rules))]
 
     @classmethod
     def _prune_attributes(cls, rules: Iterable[Rule],
@@ -0,0 +1,197 @@
+"""Generate specialized Python code which evaluates the trained rules."""
+from collections import Counter, OrderedDict
+import hashlib
+import importlib.util
+import logging
+import os
+import tempfile
+from typing import Callable, List, Mapping, Optional, Tuple
+
+import numpy
+
+AttributeKey = Tuple[int, bool, float]
+
+
+class _TrieNode:
+    """Rule attributes which are shared by several rules form a common prefix in the trie."""
+
+    __slots__ = ("children", "rank")
+
+    def __init__(self):
+        self.children = OrderedDict()  # type: Mapping[AttributeKey, _TrieNode]
+        self.rank = None  # type: Optional[int]
+
+
+class RulesCodeGenerator:
+    """
+    Turn the rules into a specialized Python function and cache it on disk.
+
+    The attributes of each rule are ordered by their frequency among all the rules, and the \
+    rules are merged into a trie, so that the rules with the same attributes share the checks. \
+    The generated function walks the trie and narrows down the indices of the samples which \
+    satisfy the checks, level by level. The samples which reach the end of a rule record the \
+    rank of that rule, and the winner is the rule with the lowest rank. The ranks are taken \
+    from `Rules.CompiledRules` which guarantees exactly the same tie-break as in `Rules.apply()`.
+    """
+
+    VERSION = 1
+    """Bump it whenever the generated code changes to invalidate the cache."""
+
+    _log = logging.getLogger("RulesCodeGenerator")
+    _max_guarded_depth = 64  # Python does not allow more than 100 indentation levels
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        Construct a RulesCodeGenerator.
+
+        :param cache_dir: Directory where the generated modules are stored. The code is generated \
+                          again every time if None.
+        """
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def digest(cls, features: numpy.ndarray, cmps: numpy.ndarray, thresholds: numpy.ndarray,
+               offsets: numpy.ndarray, ranks: numpy.ndarray) -> str:
+        """
+        Calculate the hash of the rules which is used as the cache key.
+
+        :param features: Feature indices of the attributes of all the rules.
+        :param cmps: Comparison types of the attributes.
+        :param thresholds: Threshold values of the attributes.
+        :param offsets: Start indices of the attributes of each rule.
+        :param ranks: Positions of the rules ordered by descending confidence.
+        :return: Hex digest.
+        """
+        hasher = hashlib.sha256()
+        hasher.update(str(cls.VERSION).encode())
+        for arr, dtype in ((features, numpy.int32), (cmps, bool), (thresholds, numpy.float32),
+                           (offsets, numpy.int64), (ranks, numpy.int32)):
+            hasher.update(numpy.ascontiguousarray(arr, dtype=dtype).tobytes())
+            hasher.update(b"\0")
+        return hasher.hexdigest()
+
+    def generate(self, features: numpy.ndarray, cmps: numpy.ndarray, thresholds: numpy.ndarray,
+                 offsets: numpy.ndarray, ranks: numpy.ndarray) -> str:
+        """
+        Generate the source code of the module with `apply_rules(columns, best)` function.
+
+        `columns` is the sequence of the dense feature columns which correspond to the sorted \
+        distinct features of the rules. It may be shorter than the number of the distinct \
+        features, then the attributes of the missing features are ignored. `best` is the int32 \
+        array of the best ranks of the triggered rules, one per sample. It must be initialized \
+        by the number of the rules and is updated inplace.
+
+        :param features: Feature indices of the attributes of all the rules.
+        :param cmps: Comparison types of the attributes: True is "x > v", False is "x <= v".
+        :param thresholds: Threshold values of the attributes.
+        :param offsets: Start indices of the attributes of each rule and the total number of \
+                        the attributes at the end.
+        :param ranks: Positions of the rules ordered by descending confidence.
+        :return: Python source code.
+        """
+        digest = self.digest(features, cmps, thresholds, offsets, ranks)
+        thresholds = numpy.asarray(thresholds, dtype=numpy.float32)
+        columns = {feature: i for i, feature in enumerate(numpy.unique(features).tolist())}
+        values = numpy.unique(thresholds).tolist()
+        values_index = {value: i for i, value in enumerate(values)}
+        root = self._build_trie(numpy.asarray(features).tolist(), numpy.asarray(cmps).tolist(),
+                                thresholds.tolist(), numpy.asarray(offsets).tolist(),
+                                numpy.asarray(ranks).tolist())
+        lines = [
+            '"""Rules evaluation generated by lookout.style.format.rules_codegen, do not edit."""',
+            "import numpy",
+            "",
+            "VERSION = %d" % self.VERSION,
+            'DIGEST = "%s"' % digest,
+            "THRESHOLDS = numpy.array([float.fromhex(x) for x in (",
+        ]
+        lines.extend('    "%s",' % value.hex() for value in values)
+        lines.extend([
+            ")], dtype=numpy.float32)",
+            "",
+            "",
+            "def apply_rules(columns, best):",
+            "    n_columns = len(columns)",
+            "    rows0 = numpy.arange(len(best))",
+        ])
+        self._emit(root, 0, lines, columns, values_index)
+        return "\n".join(lines) + "\n"
+
+    def load(self, features: numpy.ndarray, cmps: numpy.ndarray, thresholds: numpy.ndarray,
+             offsets: numpy.ndarray, ranks: numpy.ndarray,
+             ) -> Callable[[numpy.ndarray, numpy.ndarray], None]:
+        """
+        Get the generated `apply_rules()` function, from the cache if possible.
+
+        The parameters are the same as in `generate()`.
+
+        :return: `apply_rules(columns, best)`, see `generate()`.
+        """
+        digest = self.digest(features, cmps, thresholds, offsets, ranks)
+        if self.cache_dir is None:
+            return self._exec(self.generate(features, cmps, thresholds, offsets, ranks),
+                              "<rules %s>" % digest)
+        path = os.path.join(self.cache_dir, "rules_%s.py" % digest[:32])
+        if not os.path.exists(path):
+            self._log.info("generating %s", path)
+            source = self.generate(features, cmps, thresholds, offsets, ranks)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+            with os.fdopen(fd, "w") as fout:
+                fout.write(source)
+            os.replace(tmp_path, path)
+        # importing the module instead of exec() caches the bytecode as well
+        spec = importlib.util.spec_from_file_location(
+            "lookout_style_format_rules_%s" % digest, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if getattr(module, "DIGEST", None) != digest:
+            self._log.warning("%s is corrupted, ignored", path)
+            return self._exec(self.generate(features, cmps, thresholds, offsets, ranks), path)
+        return module.apply_rules
+
+    @staticmethod
+    def _exec(source: str, filename: str) -> Callable[[numpy.ndarray, numpy.ndarray], None]:
+        namespace = {}
+        exec(compile(source, filename, "exec"), namespace)
+        return namespace["apply_rules"]
+
+    @staticmethod
+    def _build_trie(features: List[int], cmps: List[bool], thresholds: List[float],
+                    offsets: List[int], ranks: List[int]) -> _TrieNode:
+        rule_attrs = [set(zip(features[start:finish], cmps[start:finish],
+                              thresholds[start:finish]))
+                      for start, finish in zip(offsets[:-1], offsets[1:])]
+        frequencies = Counter(attr for attrs in rule_attrs for attr in attrs)
+        root = _TrieNode()
+        for attrs, rank in zip(rule_attrs, ranks):
+            node = root
+            for attr in sorted(attrs, key=lambda attr: (-frequencies[attr], attr)):
+                try:
+                    node = node.children[attr]
+                except KeyError:
+                    node.children[attr] = node = _TrieNode()
+            if node.rank is None or rank < node.rank:
+                node.rank = rank
+        return root
+
+    def _emit(self, node: _TrieNode, depth: int, lines: List[str], columns: Mapping[int, int],
+              values_index: Mapping[float, int]) -> None:
+        indent = "    " * (1 + min(depth, self._max_guarded_depth))
+        rows = "rows%d" % depth
+        if node.rank is not None:
+            lines.append("%sbest[%s] = numpy.minimum(best[%s], %d)" % (
+                indent, rows, rows, node.rank))
+        if not node.children:
+            return
+        if depth < self._max_guarded_depth:
+            lines.append("%sif %s.size:" % (indent, rows))
+            indent += "    "
+        for (feature, cmp, threshold), child in node.children.items():
+            column = columns[feature]
+            # the samples are compared with the threshold only if the feature exists
+            lines.append("%srows%d = %s[columns[%d][%s] %s THRESHOLDS[%d]] "
+                         "if n_columns > %d else %s" % (
+                             indent, depth + 1, rows, column, rows, ">" if cmp else "<=",
+                             values_index[threshold], column, rows))
+            self._emit(child, depth + 1, lines, columns, values_index)
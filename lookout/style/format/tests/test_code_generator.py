@@ -94,6 +94,28 @@ class CodeGeneratorTests(unittest.TestCase, metaclass=GeneratorTestsMeta):
         generated_file = code_generator.generate(self.vnodes)
         self.assertEqual(generated_file, self.file.content.decode("utf-8"))
 
+    def test_apply_predicted_y_slots(self):
+        space, newline = (cls.CLASS_INDEX[cls.CLS_SPACE],), (cls.CLASS_INDEX[cls.CLS_NEWLINE],)
+        vnodes = [VirtualNode("a", Position(0, 1, 1), Position(1, 1, 2)),
+                  VirtualNode(" ", Position(1, 1, 2), Position(2, 1, 3), y=space),
+                  VirtualNode("b", Position(2, 1, 3), Position(3, 1, 4)),
+                  VirtualNode("\n", Position(3, 1, 4), Position(4, 2, 1), y=newline)]
+        rules = FakeRules([self.feature_extractor.class_sequences_to_labels[newline]])
+        code_generator = CodeGenerator(self.feature_extractor)
+        pred_vnodes = code_generator.apply_predicted_y(
+            vnodes, [vnodes[1], vnodes[3]], [0, -1], rules)
+        self.assertFalse(hasattr(pred_vnodes[1], "__dict__"))
+        self.assertEqual(pred_vnodes[1].y, newline)
+        self.assertEqual(pred_vnodes[1].y_old, space)
+        self.assertEqual(pred_vnodes[1].applied_rule, rules.rules[0])
+        self.assertFalse(hasattr(vnodes[1], "y_old"))
+        for vnode in pred_vnodes[2:]:
+            self.assertFalse(hasattr(vnode, "y_old"))
+            self.assertFalse(hasattr(vnode, "applied_rule"))
+        self.assertEqual(code_generator.generate(pred_vnodes), "a\nb\n")
+        self.assertEqual(code_generator.generate_one_change(
+            vnodes, 1, self.feature_extractor.class_sequences_to_labels[newline]), "a\nb\n")
+
     def test_generate_new_line(self):
         self.maxDiff = None
         expected_res = {
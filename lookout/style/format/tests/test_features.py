@@ -1,6 +1,6 @@
 from collections import Counter
 from copy import deepcopy
-from itertools import islice
+from itertools import chain, islice
 import lzma
 from pathlib import Path
 from typing import Sequence, Tuple
@@ -9,13 +9,15 @@ import unittest
 import bblfsh
 from lookout.core.api.service_data_pb2 import File
 import numpy
+from scipy.sparse import hstack, vstack
 
 from lookout.style.format.analyzer import FormatAnalyzer
 from lookout.style.format.classes import CLASS_INDEX, CLASSES, CLS_NEWLINE, CLS_NOOP, \
     CLS_SINGLE_QUOTE, CLS_SPACE, CLS_SPACE_DEC, CLS_SPACE_INC
 from lookout.style.format.feature_extractor import FeatureExtractor
+from lookout.style.format.features import COOBuffer, CSRBuffer, FeatureGroup
 from lookout.style.format.tests.test_analyzer import get_config
-from lookout.style.format.virtual_node import Position, VirtualNode
+from lookout.style.format.virtual_node import Position, VirtualNode, VNodeTable
 
 
 class FeaturesTests(unittest.TestCase):
@@ -145,6 +147,22 @@ class FeaturesTests(unittest.TestCase):
         self.assertEqual(self.extractor.labels_to_class_sequences, [(1,)])
         self.assertEqual(self.extractor.class_sequences_to_labels, {(1,): 0})
 
+    def test_from_cache(self):
+        config = deepcopy(self.final_config["feature_extractor"])
+        config["label_composites"] = [(1,), (2,), (1, 2)]
+        config["selected_features"] = numpy.arange(20)
+        fe1 = FeatureExtractor.from_cache(language="javascript", **config)
+        fe2 = FeatureExtractor.from_cache(language="javascript", **deepcopy(config))
+        self.assertIsNot(fe1, fe2)
+        self.assertIs(fe1.features, fe2.features)
+        fe1.labels_to_class_sequences.append((2, 1))
+        fe1.class_sequences_to_labels[(2, 1)] = 3
+        self.assertEqual(fe2.labels_to_class_sequences, [(1,), (2,), (1, 2)])
+        self.assertNotIn((2, 1), fe2.class_sequences_to_labels)
+        config["selected_features"] = numpy.arange(10)
+        fe3 = FeatureExtractor.from_cache(language="javascript", **config)
+        self.assertIsNot(fe3.features, fe1.features)
+
     def test_extract_features(self):
         file = File(content=bytes(self.contents, "utf-8"),
                     uast=self.uast)
@@ -181,6 +199,65 @@ class FeaturesTests(unittest.TestCase):
         self.check_X_y(*self.extractor.extract_features(
             files, [list(range(1, self.contents.count("\n") + 1))] * 2))
 
+    def test_extract_unselected_features(self):
+        files = [File(content=bytes(self.contents, "utf-8"), uast=self.uast)]
+        X, y, _ = self.extractor.extract_features(files)
+        feature_to_indices = self.extractor.feature_to_indices
+        selected = sorted(chain.from_iterable(
+            indices for layout in (feature_to_indices[FeatureGroup.node][0],
+                                   feature_to_indices[FeatureGroup.left][0])
+            for indices in layout.values()))
+        config = deepcopy(self.final_config["feature_extractor"])
+        config["label_composites"] = self.extractor.labels_to_class_sequences
+        config["selected_features"] = numpy.array(selected)
+        extractor = FeatureExtractor(language="javascript", **config)
+        self.assertEqual(extractor._get_neighbour_windows(), {
+            FeatureGroup.node: 1, FeatureGroup.left: 1, FeatureGroup.right: 0,
+            FeatureGroup.parents: 0})
+        self.assertEqual(sum(map(len, extractor.features[FeatureGroup.right])), 0)
+        self.assertEqual(sum(map(len, extractor.features[FeatureGroup.parents])), 0)
+        X_selected, y_selected, _ = extractor.extract_features(files)
+        self.assertEqual((X_selected != X[:, selected]).nnz, 0)
+        self.assertEqual(y_selected.tolist(), y.tolist())
+
+    def test_extract_used_features(self):
+        files = [File(content=bytes(self.contents, "utf-8"), uast=self.uast)]
+        self.extractor.extract_features(files)
+        config = deepcopy(self.final_config["feature_extractor"])
+        config["label_composites"] = self.extractor.labels_to_class_sequences
+        config["selected_features"] = numpy.arange(0, self.extractor.count_features(), 2)
+        X, y, _ = FeatureExtractor(language="javascript", **config).extract_features(files)
+        used = numpy.arange(0, X.shape[1], 5)
+        extractor = FeatureExtractor(language="javascript", used_features=used, **config)
+        self.assertEqual(extractor.count_features(), X.shape[1])
+        X_used, y_used, _ = extractor.extract_features(files)
+        self.assertEqual(X_used.shape, X.shape)
+        self.assertEqual(y_used.tolist(), y.tolist())
+        self.assertEqual(set(X_used.nonzero()[1]) - set(used), set())
+        self.assertEqual((X_used[:, used] != X[:, used]).nnz, 0)
+
+    def test_extract_features_streaming(self):
+        files = [File(content=bytes(self.contents, "utf-8"), uast=self.uast)] * 2
+        lines = [None, list(range(1, self.contents.count("\n") // 2 + 1))]
+        X, y, _ = self.extractor.extract_features(files, lines)
+        config = self.final_config["feature_extractor"]
+        extractor = FeatureExtractor(language="javascript", **config)
+        X_streaming, y_streaming = extractor.extract_features_streaming(files, lines)
+        self.assertEqual(extractor.labels_to_class_sequences,
+                         self.extractor.labels_to_class_sequences)
+        self.assertEqual(X_streaming.shape, X.shape)
+        self.assertEqual((X_streaming != X).nnz, 0)
+        self.assertEqual(y_streaming.tolist(), y.tolist())
+        X_streaming, y_streaming = extractor.extract_features_streaming(files, lines)
+        self.assertEqual((X_streaming != X).nnz, 0)
+        self.assertIsNone(extractor.extract_features_streaming([]))
+        extractor = FeatureExtractor(language="javascript", **config)
+        X_parallel, y_parallel = extractor.extract_features_streaming(files, lines, n_jobs=2)
+        self.assertEqual(extractor.labels_to_class_sequences,
+                         self.extractor.labels_to_class_sequences)
+        self.assertEqual((X_parallel != X).nnz, 0)
+        self.assertEqual(y_parallel.tolist(), y.tolist())
+
     def test_empty_strings(self):
         config = deepcopy(self.final_config["feature_extractor"])
         config["cutoff_label_support"] = 0
@@ -212,6 +289,174 @@ class FeaturesTests(unittest.TestCase):
         self.assertTrue(vn1_y == vn2_y[:len(vn1_y)])
         self.assertLess(len(y1), len(y2))
 
+    def test_extract_features_windowed(self):
+        files = [File(content=bytes(self.contents, "utf-8"), uast=self.uast)]
+        self.extractor.extract_features(files)
+        config = deepcopy(self.final_config["feature_extractor"])
+        config["label_composites"] = self.extractor.labels_to_class_sequences
+        config["return_sibling_indices"] = True
+        extractor = FeatureExtractor(language="javascript", **config)
+        windowed_extractor = FeatureExtractor(language="javascript", windowed=True, **config)
+        n_lines = self.contents.count("\n")
+        for lines in ([1], [2, 3, 4], [n_lines // 2, n_lines // 2 + 40], [n_lines - 1, n_lines]):
+            X, y, (vn_y, vn, vn_parents, n_parents, sibling_indices) = \
+                extractor.extract_features(files, [lines])
+            X_w, y_w, (vn_y_w, vn_w, vn_parents_w, n_parents_w, sibling_indices_w) = \
+                windowed_extractor.extract_features(files, [lines])
+            self.assertGreater(len(y), 0)
+            self.assertEqual(X_w.shape, X.shape)
+            self.assertEqual((X_w != X).nnz, 0)
+            self.assertEqual(y_w.tolist(), y.tolist())
+            self.assertEqual(sibling_indices_w, sibling_indices)
+            self.assertEqual([(v.value, v.start, v.end, v.y) for v in vn_w],
+                             [(v.value, v.start, v.end, v.y) for v in vn])
+            self.assertEqual([(v.start, v.y) for v in vn_y_w], [(v.start, v.y) for v in vn_y])
+            self.assertEqual(len(n_parents_w), len(n_parents))
+            self.assertLess(len(vn_parents_w), len(vn_parents))
+            expected_parents = {}
+            extractor._fill_vnode_parents(n_parents_w, vn_w, files[0].uast, expected_parents)
+            self.assertEqual([id(vn_parents_w[id(vnode)]) for vnode in vn_y_w],
+                             [id(expected_parents[id(vnode)]) for vnode in vn_y_w])
+
+    def test_vnode_compact(self):
+        path = "".join(["test", "_file"])
+        vnode = VirtualNode("foo", Position(10, 2, 3), Position(13, 2, 6), y=(1,), path=path)
+        self.assertFalse(hasattr(vnode, "__dict__"))
+        self.assertEqual(vnode.start, Position(10, 2, 3))
+        self.assertEqual(vnode.end, Position(13, 2, 6))
+        self.assertIsInstance(vnode.start, Position)
+        self.assertEqual(vnode.start.col, 3)
+        self.assertIs(vnode.path, VirtualNode("", vnode.end, vnode.end, path="test_file").path)
+        copy = vnode.copy()
+        self.assertEqual(copy, vnode)
+        copy.end = Position(14, 2, 7)
+        self.assertEqual((copy.start, copy.end), (Position(10, 2, 3), Position(14, 2, 7)))
+        self.assertNotEqual(copy, vnode)
+        self.assertIsNone(VirtualNode("", vnode.end, vnode.end).path)
+        # set by CodeGenerator on the copies of the nodes
+        self.assertFalse(hasattr(copy, "y_old"))
+        self.assertFalse(hasattr(copy, "applied_rule"))
+        copy.y, copy.y_old = (2,), copy.y
+        copy.applied_rule = "rule"
+        self.assertEqual((copy.y, copy.y_old, copy.applied_rule), ((2,), (1,), "rule"))
+        self.assertFalse(hasattr(vnode, "y_old"))
+
+    def test_vnode_table(self):
+        vnodes, parents = self.extractor._parse_file(self.contents, self.uast, "test_file")
+        vnodes = self.extractor._classify_vnodes(vnodes, "test_file")
+        vnodes = self.extractor._merge_classes_to_composite_labels(
+            vnodes, "test_file", index_labels=True)
+        vnodes = self.extractor._add_noops(list(vnodes), "test_file", index_labels=True)
+        self.extractor._compute_labels_mappings(vnodes)
+        self.extractor._compute_feature_info()
+        vnodes_y = [vnode for vnode in vnodes
+                    if vnode.y in self.extractor.class_sequences_to_labels]
+        neighbours, _ = self.extractor._create_neighbours(vnodes, vnodes_y, parents)
+        table = VNodeTable(vnodes, parents,
+                           class_sequences_to_labels=self.extractor.class_sequences_to_labels,
+                           reserved_index=self.extractor.tokens.RESERVED_INDEX,
+                           internal_types_index=self.extractor.roles.INTERNAL_TYPES_INDEX,
+                           roles_by_id=self.extractor.roles.ROLES_BY_ID)
+        self.assertEqual(len(table), len(vnodes))
+        self.assertEqual(table.length.tolist(),
+                         [vnode.end.offset - vnode.start.offset for vnode in vnodes])
+        self.assertEqual(table.rows([vnodes[1], None, vnodes[0]]).tolist(), [1, -1, 0])
+        for i, vnode in enumerate(vnodes):
+            if vnode.node is not None:
+                self.assertIs(table.uast_nodes[table.node[i]], vnode.node)
+                self.assertEqual(table.uast_rows([None, vnode.node]).tolist(), [-1, table.node[i]])
+            if vnode.node is not None and id(vnode.node) in parents:
+                self.assertIs(table.parents[table.parent[i]], parents[id(vnode.node)])
+            else:
+                self.assertEqual(table.parent[i], -1)
+        columnar = 0
+        for group_features in self.extractor.features.values():
+            for node_features in group_features:
+                for feature in node_features.values():
+                    columnar += feature.columnar
+                    self.assertEqual((feature(neighbours) != feature(neighbours, table)).nnz, 0,
+                                     feature.id.name)
+        self.assertGreater(columnar, 0)
+
+    def test_coo_buffer(self):
+        buffer = COOBuffer(2)
+        buffer.append([1, 2], [0, 1], [3, 4])
+        buffer.append([], [], [])
+        buffer.append(numpy.array([3, 4, 5]), numpy.array([2, 0, 2]), numpy.array([0, 3, 0]))
+        self.assertEqual(len(buffer), 5)
+        self.assertEqual(buffer.to_csr((3, 5)).toarray().tolist(),
+                         [[0, 0, 0, 5, 0], [0, 0, 0, 0, 2], [8, 0, 0, 0, 0]])
+
+    def test_csr_buffer(self):
+        matrix = CSRBuffer(5, 1, 1)
+        block = COOBuffer()
+        block.append([1, 2, 3], [1, 0, 1], [3, 4, 3])
+        matrix.append(block, 2)
+        block.clear()
+        matrix.append(block, 1)
+        block.append([4, 5], [0, 0], [2, 0])
+        matrix.append(block, 1)
+        self.assertEqual(len(matrix), 4)
+        self.assertEqual(matrix.shape, (4, 5))
+        X = matrix.to_csr()
+        self.assertEqual(X.dtype, numpy.uint8)
+        self.assertTrue(X.has_sorted_indices)
+        self.assertEqual(X.toarray().tolist(), [[0, 0, 0, 0, 2], [0, 0, 0, 4, 0],
+                                                [0, 0, 0, 0, 0], [5, 0, 4, 0, 0]])
+
+    def test_compute_batch(self):
+        vnodes, parents = self.extractor._parse_file(self.contents, self.uast, "test_file")
+        vnodes = self.extractor._classify_vnodes(vnodes, "test_file")
+        vnodes = self.extractor._merge_classes_to_composite_labels(
+            vnodes, "test_file", index_labels=True)
+        vnodes = self.extractor._add_noops(list(vnodes), "test_file", index_labels=True)
+        X, y, vnodes_y, _, _ = self.extractor._convert_files_to_xy(
+            [(vnodes, parents, None), (vnodes, parents, {1, 2, 3})])
+        xs = []
+        for lines in (None, {1, 2, 3}):
+            neighbours, _ = self.extractor._create_neighbours(
+                vnodes, [vnode for vnode in vnodes if vnode.is_labeled_on_lines(lines) and
+                         vnode.y in self.extractor.class_sequences_to_labels], parents)
+            xs.append(hstack([feature(neighbours)
+                              for group_features in self.extractor.features.values()
+                              for node_features in group_features
+                              for feature in node_features.values()]))
+        expected = vstack(xs)
+        self.assertEqual(X.shape, expected.shape)
+        self.assertEqual(X.shape[0], len(y))
+        self.assertEqual((X != expected).nnz, 0)
+
+    def test_create_neighbours_siblings(self):
+        labels = [None, (CLASS_INDEX[CLS_SINGLE_QUOTE],), None, (CLASS_INDEX[CLS_NOOP],),
+                  (CLASS_INDEX[CLS_SINGLE_QUOTE],), None, (CLASS_INDEX[CLS_NEWLINE],), None]
+        values = ["x", "'", " ", "", "'", "b", "\n", "c"]
+        vnodes = [VirtualNode(value, Position(i, 1, i + 1), Position(i + 1, 1, i + 2), y=y)
+                  for i, (value, y) in enumerate(zip(values, labels))]
+        vnodes_y = [vnodes[1], vnodes[4], vnodes[6]]
+        self.extractor.left_siblings_window = self.extractor.right_siblings_window = 2
+        self.extractor.parents_depth = 0
+        self.extractor.return_sibling_indices = True
+        for no_labels_on_right, expected in ((True, [[5, 7], [2, 5, 7], [5, 4, 7]]),
+                                             (False, [[2, 5], [2, 5, 6], [5, 4, 7]])):
+            self.extractor.no_labels_on_right = no_labels_on_right
+            neighbours, sibling_indices = self.extractor._create_neighbours(
+                vnodes, vnodes_y, {}, return_sibling_indices=True)
+            self.assertEqual([list(indices) for indices in sibling_indices], expected)
+            self.assertEqual(neighbours[FeatureGroup.left][0], [None, vnodes[2], vnodes[5]])
+            self.assertEqual(neighbours[FeatureGroup.left][1], [None, None, vnodes[4]])
+
+    def test_find_parents(self):
+        root, a, a1, a2, b = (bblfsh.Node() for _ in range(5))
+        parents = {id(a): root, id(a1): a, id(a2): a, id(b): root}
+        vnodes = [VirtualNode("x", Position(i, 1, i + 1), Position(i + 1, 1, i + 2), node=node)
+                  for i, node in enumerate([None, a, a1, None, a2, None, b, None])]
+        found = self.extractor._find_parents(vnodes, parents)
+        expected = [None, root, a, a, root, root, None, None]
+        self.assertEqual(len(found), len(expected))
+        for i, (parent, expected_parent) in enumerate(zip(found, expected)):
+            self.assertIs(parent, expected_parent, i)
+        self.assertEqual(self.extractor._find_parents(vnodes[:1], parents), [None])
+
     def test_noop_vnodes(self):
         vnodes, parents = self.extractor._parse_file(self.contents, self.uast, "test_file")
         vnodes = self.extractor._classify_vnodes(vnodes, "test_file")
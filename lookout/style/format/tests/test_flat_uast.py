@@ -0,0 +1,89 @@
+import unittest
+
+import bblfsh
+import numpy
+
+from lookout.style.flat_uast import FlatUAST
+from lookout.style.format.uast_stability_checker import UASTStabilityChecker
+
+
+def make_node(token="", internal_type="", roles=(), children=(), span=(0, 0)):
+    node = bblfsh.Node(token=token, internal_type=internal_type, roles=roles,
+                       children=children)
+    node.start_position.offset, node.end_position.offset = span
+    return node
+
+
+class FlatUASTTests(unittest.TestCase):
+    def setUp(self):
+        # File(Identifier "x", Call(Identifier "y", String "z"), Identifier "x")
+        self.root = make_node(internal_type="File", span=(0, 10), children=[
+            make_node("x", "Identifier", [1], span=(0, 1)),
+            make_node(internal_type="Call", roles=[2], span=(2, 8), children=[
+                make_node("y", "Identifier", [1], span=(2, 3)),
+                make_node("z", "String", [3], span=(4, 7)),
+            ]),
+            make_node("x", "Identifier", [1, 4], span=(9, 10)),
+        ])
+        self.uast = FlatUAST(self.root)
+
+    def test_structure(self):
+        uast = self.uast
+        self.assertEqual(len(uast), 6)
+        self.assertEqual([uast.tokens[t] for t in uast.token], ["", "x", "", "y", "z", "x"])
+        self.assertEqual(uast.tokens[0], "")
+        self.assertEqual([uast.internal_types[t] for t in uast.internal_type],
+                         ["File", "Identifier", "Call", "Identifier", "String", "Identifier"])
+        self.assertEqual(uast.parent.tolist(), [-1, 0, 0, 2, 2, 0])
+        self.assertEqual(uast.depth.tolist(), [0, 1, 1, 2, 2, 1])
+        self.assertEqual(uast.start_offset.tolist(), [0, 0, 2, 2, 4, 9])
+        self.assertEqual(uast.end_offset.tolist(), [10, 1, 8, 3, 7, 10])
+        self.assertEqual(uast.children_count.tolist(), [3, 0, 2, 0, 0, 0])
+        self.assertEqual(uast.children(0).tolist(), [1, 2, 5])
+        self.assertEqual(uast.children(2).tolist(), [3, 4])
+        self.assertEqual(uast.children(4).tolist(), [])
+        self.assertEqual(uast.first_child.tolist(), [1, -1, 3, -1, -1, -1])
+        self.assertEqual(uast.next_sibling.tolist(), [-1, 2, 5, 4, -1, -1])
+        self.assertEqual(uast.postorder().tolist(), [5, 0, 3, 1, 2, 4])
+
+    def test_roles(self):
+        self.assertEqual(self.uast.role_mask(1).tolist(),
+                         [False, True, False, True, False, True])
+        self.assertEqual(self.uast.role_mask(4).tolist(),
+                         [False, False, False, False, False, True])
+        self.assertFalse(self.uast.role_mask(5).any())
+
+    def test_parents_mapping(self):
+        nodes = self.uast.nodes
+        parents = self.uast.parents_mapping()
+        self.assertEqual(len(parents), 5)
+        for child, parent in ((1, 0), (2, 0), (3, 2), (4, 2), (5, 0)):
+            self.assertIs(parents[id(nodes[child])], nodes[parent])
+
+    def test_node_fixtures(self):
+        def fix(node):
+            node.token = "fixed"
+            return node
+
+        uast = FlatUAST(self.root, {"String": fix})
+        self.assertEqual(uast.tokens[uast.token[4]], "fixed")
+
+    def test_remap(self):
+        self.assertEqual(FlatUAST.remap(["", "a", "b"], ["", "b", "c"]).tolist(), [0, 2, -1])
+
+    def test_check_uasts_equivalent(self):
+        self.assertTrue(UASTStabilityChecker.check_uasts_equivalent(self.uast, self.root))
+        other = bblfsh.Node()
+        other.CopyFrom(self.root)
+        other.start_position.offset = 1
+        self.assertTrue(UASTStabilityChecker.check_uasts_equivalent(self.root, other))
+        other.children[1].children[1].token = "w"
+        self.assertFalse(UASTStabilityChecker.check_uasts_equivalent(self.uast, other))
+        other.CopyFrom(self.root)
+        del other.children[2]
+        self.assertFalse(UASTStabilityChecker.check_uasts_equivalent(self.uast, other))
+        self.assertTrue(numpy.array_equal(FlatUAST(other).parent, [-1, 0, 0, 2, 2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
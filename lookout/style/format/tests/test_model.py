@@ -3,7 +3,8 @@ import tempfile
 import unittest
 
 from lookout.style.format.model import FormatModel
-from lookout.style.format.rules import TrainableRules
+from lookout.style.format.rules import Rule, RuleAttribute, Rules, RuleStats, \
+    TrainableRules
 from lookout.style.format.tests.test_rules import load_abalone_data
 
 
@@ -55,6 +56,23 @@ class FormatModelTests(unittest.TestCase):
             fm2 = FormatModel().load(f.name)
             compare_models(self, fm1, fm2)
 
+    def test_save_and_load_compiled_rules(self):
+        fm1 = FormatModel()
+        fm1["javascript"] = self.fm["javascript"]
+        with tempfile.NamedTemporaryFile(prefix="lookout-") as f:
+            fm1.save(f.name)
+            fm2 = FormatModel().load(f.name)
+        expected = Rules._compile(fm2["javascript"].rules)
+        for old, new in ((fm1["javascript"]._compiled, fm2["javascript"]._compiled),
+                         (expected, fm2["javascript"]._compiled)):
+            for field, old_array, new_array in zip(expected._fields, old, new):
+                self.assertEqual(old_array.tolist(), new_array.tolist(), field)
+        tree = FormatModel._disassemble_compiled_rules(self.fm["javascript"])
+        self.assertIsNotNone(FormatModel._assemble_compiled_rules(tree))
+        tree["version"] -= 1
+        self.assertIsNone(FormatModel._assemble_compiled_rules(tree))
+        self.assertIsNone(FormatModel._assemble_compiled_rules(None))
+
     def test_dump(self):
         fm = FormatModel()
         self.assertEqual(fm.dump(), "generic/[1, 0, 0] <unknown url> <unknown commit>")
@@ -63,6 +81,7 @@ class FormatModelTests(unittest.TestCase):
 
 # javascript
 1159 rules, avg.len. 12.7
+compiled: 79696 bytes
 ## train
 PPCR: 0.993413
 ### report
@@ -141,6 +160,42 @@ weighted
         fm["js2"] = self.rules
         self.assertEqual(len(fm), 2)
 
+    def test_filter_rules(self):
+        rules = self.fm.filter_rules("javascript", 0.92, 80)
+        self.assertIs(self.fm.filter_rules("javascript", 0.92, 80), rules)
+        expected = self.fm["javascript"].filter_by_confidence(0.92).filter_by_support(80)
+        self.assertEqual(rules.rules, expected.rules)
+        self.assertLess(len(self.fm.filter_rules("javascript", 0.95, 80)), len(rules))
+        self.fm["javascript"] = self.rules
+        self.assertIsNot(self.fm.filter_rules("javascript", 0.92, 80), rules)
+        fm = FormatModel(rules_thresholds=[(0.92, 80)]).load(
+            os.path.join(os.path.dirname(__file__), "model_jquery.asdf"))
+        self.assertEqual(list(fm._filtered_rules), [("javascript", 0.92, 80, None, False)])
+        self.assertEqual(fm.filter_rules("javascript", 0.92, 80).rules, expected.rules)
+
+    def test_filter_rules_early_exit(self):
+        rules = self.fm.filter_rules("javascript", 0.92, 80)
+        early_exit = self.fm.filter_rules("javascript", 0.92, 80, early_exit=True)
+        self.assertIs(self.fm.filter_rules("javascript", 0.92, 80, early_exit=True), early_exit)
+        self.assertIsNot(early_exit, rules)
+        self.assertIs(early_exit.rules, rules.rules)
+        self.assertTrue(early_exit._early_exit)
+        self.assertFalse(rules._early_exit)
+
+    def test_filter_rules_float32_conf(self):
+        attrs = (RuleAttribute(0, True, 0.5),)
+        fm1 = FormatModel()
+        fm1["js"] = Rules([Rule(attrs, RuleStats(0, 23 / 25, 100), False),
+                           Rule(attrs, RuleStats(1, 0.8, 100), False),
+                           Rule(attrs, RuleStats(0, 0.5, 100), False)], self.config)
+        with tempfile.NamedTemporaryFile(prefix="lookout-") as f:
+            fm1.save(f.name)
+            fm2 = FormatModel().load(f.name)
+        # the confidences are stored in float32 which rounds 23 / 25 and 0.8 up
+        self.assertEqual(len(fm2.filter_rules("js", 0.92, 80)), 1)
+        self.assertEqual(len(fm2.filter_rules("js", 0.8, 80)), 2)
+        self.assertEqual(len(fm2.filter_rules("js", 0.8, 100)), 0)
+
     def test_iter(self):
         langs = set(self.fm.languages)
         for item in self.fm:
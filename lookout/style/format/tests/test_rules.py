@@ -1,4 +1,5 @@
 import os
+import tempfile
 import unittest
 
 import numpy
@@ -9,7 +10,9 @@ from sklearn import ensemble, model_selection, tree
 from sklearn.exceptions import NotFittedError
 from sklearn.tree import _tree
 
-from lookout.style.format.rules import TrainableRules
+from lookout.style.format.benchmarks.rules_apply import apply_rowwise
+from lookout.style.format.rules import LayeredRules, Rule, RuleAttribute, Rules, RuleSet, \
+    RuleStats, TrainableRules
 
 
 def load_abalone_data(filepath=os.path.join(os.path.dirname(__file__), "abalone.data.xz")):
@@ -182,6 +185,187 @@ class RulesTests(unittest.TestCase):
         for ycls, w in zip(pred_y, winners):
             self.assertEqual(ycls, rules.rules.rules[w].stats.cls)
 
+    def test_apply_batch(self):
+        for base_model_name in ("sklearn.tree.DecisionTreeClassifier",
+                                "sklearn.ensemble.RandomForestClassifier"):
+            rules = TrainableRules(base_model_name=base_model_name, prune_branches_algorithms=[],
+                                   prune_attributes=False, min_samples_leaf=5, n_estimators=5,
+                                   random_state=1989, confidence_threshold=0)
+            rules.fit(self.train_x, self.train_y)
+            x = self.test_x.toarray()
+            x[::3, :4] = 0
+            for test_x in (self.test_x, csr_matrix(x), csr_matrix(x[:, :5])):
+                pred_y, winners = rules.rules.apply(test_x, return_winner_indices=True)
+                ref_pred_y, ref_winners = apply_rowwise(
+                    rules.rules, test_x, return_winner_indices=True)
+                self.assertEqual(pred_y.tolist(), ref_pred_y.tolist())
+                self.assertEqual(winners.tolist(), ref_winners.tolist())
+                pred_y, winners = rules.rules.use_early_exit().apply(
+                    test_x, return_winner_indices=True)
+                rules.rules.use_early_exit(False)
+                self.assertEqual(pred_y.tolist(), ref_pred_y.tolist())
+                self.assertEqual(winners.tolist(), ref_winners.tolist())
+
+    def test_layered_rules(self):
+        rules = TrainableRules(base_model_name="sklearn.tree.DecisionTreeClassifier",
+                               prune_branches_algorithms=[], prune_attributes=False,
+                               min_samples_leaf=26, random_state=1989, confidence_threshold=0)
+        rules.fit(self.train_x, self.train_y)
+        base = rules.rules
+        confs = sorted(rule.stats.conf for rule in base.rules)
+        artificial = [Rule(attrs=tuple(), stats=RuleStats(cls=7, conf=confs[len(confs) // 2],
+                                                          support=1), artificial=True),
+                      Rule(attrs=tuple(), stats=RuleStats(cls=8, conf=confs[0], support=1),
+                           artificial=True)]
+        layered = LayeredRules(LayeredRules(base, artificial[:1]), artificial[1:])
+        self.assertIs(layered.base, base)
+        self.assertEqual(len(layered), len(base) + 2)
+        self.assertEqual(layered.rules[-2:], tuple(artificial))
+        expected = Rules(base.rules + tuple(artificial), base.origin_config)
+        pred_y, winners = layered.apply(self.test_x, return_winner_indices=True)
+        for ref_pred_y, ref_winners in (expected.apply(self.test_x, return_winner_indices=True),
+                                        apply_rowwise(layered, self.test_x, True)):
+            self.assertEqual(pred_y.tolist(), ref_pred_y.tolist())
+            self.assertEqual(winners.tolist(), ref_winners.tolist())
+        self.assertIn(7, pred_y)
+        self.assertNotIn(-1, pred_y)
+
+    def test_apply_sharded(self):
+        rules = TrainableRules(base_model_name="sklearn.tree.DecisionTreeClassifier",
+                               prune_branches_algorithms=[], prune_attributes=False,
+                               min_samples_leaf=26, random_state=1989, confidence_threshold=0)
+        rules.fit(self.train_x, self.train_y)
+        expected = rules.rules.apply(self.x, return_winner_indices=True)
+        rules.rules._min_shard_size = 1000
+        for n_jobs in (2, 3, -1):
+            for ref, actual in zip(expected, rules.rules.apply(
+                    self.x, return_winner_indices=True, n_jobs=n_jobs)):
+                self.assertEqual(ref.tolist(), actual.tolist())
+        rules.rules.generate_classification_report(
+            self.x, self.y, "test", [str(i) for i in range(self.y.max() + 1)], n_jobs=2)
+        self.assertAlmostEqual(rules.rules.classification_report["test"]["ppcr"],
+                               numpy.mean(expected[0] != -1))
+
+    def test_prune_dominated(self):
+        rules = TrainableRules(base_model_name="sklearn.ensemble.RandomForestClassifier",
+                               prune_branches_algorithms=[], prune_attributes=False,
+                               min_samples_leaf=5, n_estimators=10, random_state=1989,
+                               confidence_threshold=0)
+        rules.fit(self.train_x, self.train_y)
+        full = rules.rules
+        rules.prune_dominated_rules()
+        pruned = rules.rules
+        self.assertLess(len(pruned), len(full))
+        self.assertEqual(len(pruned.prune_dominated()), len(pruned))
+        x = self.x.toarray()
+        x[::3, :4] = 0
+        for test_x in (self.x, csr_matrix(x), csr_matrix(x[:, :5])):
+            for confidence_threshold, support_threshold in ((0, 0), (0.6, 20), (0.8, 50)):
+                filtered = full.filter_by_confidence(confidence_threshold) \
+                    .filter_by_support(support_threshold)
+                expected = filtered.apply(test_x)
+                actual = pruned.filter_by_confidence(confidence_threshold) \
+                    .filter_by_support(support_threshold).apply(test_x)
+                self.assertEqual(expected.tolist(), actual.tolist())
+                used_x = numpy.zeros(test_x.shape, dtype=test_x.dtype)
+                used = filtered.used_features[filtered.used_features < test_x.shape[1]]
+                used_x[:, used] = test_x[:, used].toarray()
+                self.assertEqual(filtered.apply(csr_matrix(used_x)).tolist(), expected.tolist())
+
+    def test_prune_dominated_apply(self):
+        for base_model_name in ("sklearn.tree.DecisionTreeClassifier",
+                                "sklearn.ensemble.RandomForestClassifier"):
+            rules = TrainableRules(base_model_name=base_model_name, prune_branches_algorithms=[],
+                                   prune_attributes=False, min_samples_leaf=5, n_estimators=10,
+                                   random_state=1989, confidence_threshold=0)
+            rules.fit(self.train_x, self.train_y)
+            expected = rules.rules.apply(self.x)
+            rules.prune_dominated_rules()
+            self.assertEqual(rules.rules.apply(self.x).tolist(), expected.tolist())
+
+    def test_prune_dominated_float32_conf(self):
+        attrs = (RuleAttribute(0, True, 0.5),)
+        # the confidences are the same in float32, so the first rule wins in apply() but the
+        # filter by confidence keeps only the second one
+        rules = Rules([Rule(attrs, RuleStats(0, 0.8, 100), False),
+                       Rule(attrs + (RuleAttribute(1, True, 0.5),),
+                            RuleStats(1, 0.8 + 1e-12, 100), False)], {})
+        pruned = rules.prune_dominated()
+        self.assertEqual(len(pruned), 2)
+        x = csr_matrix(numpy.ones((1, 2), dtype=numpy.float32))
+        self.assertEqual(pruned.filter_by_confidence(0.8).apply(x).tolist(),
+                         rules.filter_by_confidence(0.8).apply(x).tolist())
+
+    def test_generated_code(self):
+        for base_model_name in ("sklearn.tree.DecisionTreeClassifier",
+                                "sklearn.ensemble.RandomForestClassifier"):
+            rules = TrainableRules(base_model_name=base_model_name, prune_branches_algorithms=[],
+                                   prune_attributes=False, min_samples_leaf=5, n_estimators=5,
+                                   random_state=1989, confidence_threshold=0)
+            rules.fit(self.train_x, self.train_y)
+            x = self.test_x.toarray()
+            x[::3, :4] = 0
+            test_xs = (self.test_x, csr_matrix(x), csr_matrix(x[:, :5]))
+            expected = [rules.rules.apply(test_x, return_winner_indices=True)
+                        for test_x in test_xs]
+            with tempfile.TemporaryDirectory(prefix="lookout-") as cache_dir:
+                for _ in range(2):
+                    generated = Rules(rules.rules.rules, rules.rules.origin_config)
+                    self.assertIs(generated.use_generated_code(cache_dir), generated)
+                    self.assertEqual(len([f for f in os.listdir(cache_dir)
+                                          if f.endswith(".py")]), 1)
+                    for test_x, (ref_pred_y, ref_winners) in zip(test_xs, expected):
+                        pred_y, winners = generated.apply(test_x, return_winner_indices=True)
+                        self.assertEqual(pred_y.tolist(), ref_pred_y.tolist())
+                        self.assertEqual(winners.tolist(), ref_winners.tolist())
+        confs = sorted(rule.stats.conf for rule in rules.rules.rules)
+        artificial = [Rule(attrs=tuple(), stats=RuleStats(cls=7, conf=confs[len(confs) // 2],
+                                                          support=1), artificial=True)]
+        layered = LayeredRules(rules.rules, artificial)
+        expected = layered.apply(self.test_x, return_winner_indices=True)
+        self.assertIs(layered.use_generated_code(), layered)
+        for ref, actual in zip(expected, layered.apply(self.test_x, return_winner_indices=True)):
+            self.assertEqual(ref.tolist(), actual.tolist())
+        # the shared base rules and the other layers keep their evaluation mode
+        self.assertIsNone(rules.rules._generated)
+        nested = LayeredRules(layered, artificial).use_early_exit()
+        self.assertIsNotNone(nested._evaluator._generated)
+        self.assertTrue(nested._evaluator._early_exit)
+        self.assertFalse(layered._evaluator._early_exit)
+        self.assertFalse(rules.rules._early_exit)
+
+    def test_rule_set(self):
+        rules = TrainableRules(base_model_name="sklearn.tree.DecisionTreeClassifier",
+                               prune_branches_algorithms=[], prune_attributes=False,
+                               min_samples_leaf=26, random_state=1989, confidence_threshold=0)
+        rules.fit(self.train_x, self.train_y)
+        rule_set = rules.rules.rules
+        self.assertIsInstance(rule_set, RuleSet)
+        rule_list = list(rule_set)
+        self.assertEqual(len(rule_list), len(rule_set))
+        self.assertEqual([rule_set[i] for i in range(len(rule_set))], rule_list)
+        self.assertEqual(rule_set[-1], rule_list[-1])
+        self.assertEqual(RuleSet.from_rules(rule_list), rule_set)
+        self.assertIs(RuleSet.from_rules(rule_set), rule_set)
+        self.assertEqual(rule_set[1:5], rule_list[1:5])
+        self.assertEqual(rule_set[[4, 0, 2]], [rule_list[i] for i in (4, 0, 2)])
+        mask = rule_set.conf > 0.8
+        self.assertEqual(rule_set[mask], [r for r in rule_list if r.stats.conf > 0.8])
+        self.assertEqual(rule_set[:3] + rule_list[3:], rule_list)
+        self.assertEqual(len(RuleSet.from_rules([])), 0)
+        with self.assertRaises(IndexError):
+            rule_set[len(rule_set)]
+        attrs = (RuleAttribute(2, False, 0.5), RuleAttribute(1, True, 0.1),
+                 RuleAttribute(2, False, 0.3), RuleAttribute(1, True, 0.7),
+                 RuleAttribute(2, True, 0.2))
+        stats = RuleStats(cls=1, conf=0.9, support=10)
+        merged = TrainableRules._merge_rules([Rule(attrs, stats, False),
+                                              Rule(tuple(), stats, False)])
+        self.assertEqual(merged, [
+            Rule((RuleAttribute(1, True, 0.7), RuleAttribute(2, False, 0.3),
+                  RuleAttribute(2, True, 0.2)), stats, False),
+            Rule(tuple(), stats, False)])
+
 
 if __name__ == "__main__":
     unittest.main()
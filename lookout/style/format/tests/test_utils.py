@@ -1,6 +1,10 @@
+import multiprocessing
+import os
+import threading
 import unittest
 
 from lookout.style.common import merge_dicts
+from lookout.style.format.utils import get_processes_number, map_forked
 
 
 class RulesMergeDicts(unittest.TestCase):
@@ -34,5 +38,47 @@ class RulesMergeDicts(unittest.TestCase):
         self.assertEqual(merge_dicts(d1, d2, d3), res)
 
 
+def _scale_with_pid(scale, x):
+    return x * scale, os.getpid()
+
+
+def _map_nested(scale, x):
+    return [r for r, _ in map_forked(_scale_with_pid, [x, x + 1], scale + x, 2)]
+
+
+class MapForkedTests(unittest.TestCase):
+    def test_get_processes_number(self):
+        self.assertEqual(get_processes_number(3), 3)
+        self.assertEqual(get_processes_number(0), 1)
+        self.assertEqual(get_processes_number(-1), multiprocessing.cpu_count())
+        self.assertEqual(get_processes_number(-1000), 1)
+
+    def test_map_forked(self):
+        for n_processes in (1, 2, 5):
+            results = map_forked(_scale_with_pid, list(range(4)), 10, n_processes)
+            self.assertEqual([r for r, _ in results], [0, 10, 20, 30])
+            pids = {pid for _, pid in results}
+            if n_processes == 1:
+                self.assertEqual(pids, {os.getpid()})
+            elif "fork" in multiprocessing.get_all_start_methods():
+                self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(map_forked(_scale_with_pid, [], 10, 2), [])
+
+    def test_map_forked_reentrant(self):
+        self.assertEqual(map_forked(_map_nested, [1, 2], 10, 2), [[11, 22], [24, 36]])
+        results = {}
+
+        def run(scale):
+            # forking the multi-threaded process is not safe, so the calls are sequential
+            results[scale] = [r for r, _ in map_forked(_scale_with_pid, list(range(4)), scale, 1)]
+
+        threads = [threading.Thread(target=run, args=(scale,)) for scale in (10, 100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {10: [0, 10, 20, 30], 100: [0, 100, 200, 300]})
+
+
 if __name__ == "__main__":
     unittest.main()
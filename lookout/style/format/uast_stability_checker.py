@@ -9,6 +9,7 @@ from lookout.core.api.service_data_pb2 import File
 from lookout.core.data_requests import parse_uast
 import numpy
 
+from lookout.style.flat_uast import FlatUAST
 from lookout.style.format.code_generator import CodeGenerationBaseError, CodeGenerator
 from lookout.style.format.feature_extractor import FeatureExtractor
 from lookout.style.format.rules import QuotedNodeTripleMapping
@@ -36,13 +37,13 @@ class UASTStabilityChecker:
         """
         self._feature_extractor = feature_extractor
         self._code_generator = CodeGenerator(self._feature_extractor, skip_errors=False)
-        self._parsing_cache = {}  # type: Dict[int, Optional[Tuple[bblfsh.Node, int, int]]]
+        self._parsing_cache = {}  # type: Dict[int, Optional[Tuple[FlatUAST, int, int]]]
         self._debug = debug
 
     def _parse_code(self, parent: bblfsh.Node, content: str,
                     stub: "bblfsh.aliases.ProtocolServiceStub",
                     node_parents: Mapping[int, bblfsh.Node], path: str,
-                    ) -> Optional[Tuple[bblfsh.Node, int, int]]:
+                    ) -> Optional[Tuple[FlatUAST, int, int]]:
         """
         Find a parent node that Babelfish can parse and parse it.
 
@@ -57,8 +58,8 @@ class UASTStabilityChecker:
         :param stub: Babelfish GRPC service stub.
         :param node_parents: Parents mapping of the input UASTs.
         :param path: Path of the file being parsed.
-        :return: tuple of the parsed UAST and the corresponding starting and ending offsets. \
-                 None if Babelfish failed to parse the whole file.
+        :return: tuple of the parsed flattened UAST and the corresponding starting and ending \
+                 offsets. None if Babelfish failed to parse the whole file.
         """
         descendants = []
         current_ancestor = parent
@@ -72,7 +73,8 @@ class UASTStabilityChecker:
             uast, errors = parse_uast(stub, content[start:end], filename="",
                                       language=self._feature_extractor.language)
             if not errors:
-                result = uast, start, end
+                # the parsed parent is compared with many predictions, flatten it only once
+                result = FlatUAST(uast), start, end
                 break
             current_ancestor = node_parents.get(id(current_ancestor), None)
         else:
@@ -184,7 +186,9 @@ class UASTStabilityChecker:
         :param files: File or Sequence of File-s with content, uast and path.
         :param stub: Babelfish GRPC service stub.
         :param vnode_parents: `VirtualNode`-s' parents mapping as the LCA of the closest \
-                               left and right babelfish nodes.
+                               left and right babelfish nodes. Only the labeled vnodes from \
+                               `vnodes_y` are looked up, so the mapping of the windowed \
+                               `FeatureExtractor` is enough.
         :param node_parents: Parents mapping of the input UASTs.
         :param rule_winners: Numpy array with the indexes of the winning rules for each sample.
         :param grouped_quote_predictions: Quotes predictions (handled differenlty from the rest).
@@ -230,27 +234,37 @@ class UASTStabilityChecker:
         return tuple(res)
 
     @staticmethod
-    def check_uasts_equivalent(uast1: bblfsh.Node, uast2: bblfsh.Node) -> bool:
+    def check_uasts_equivalent(uast1: Union[bblfsh.Node, FlatUAST],
+                               uast2: Union[bblfsh.Node, FlatUAST]) -> bool:
         """
         Check if 2 UAST nodes are identical regarding `roles`, `internal_type` and `token` of \
         their subtree members.
 
-        :param uast1: The bblfsh.Node of the first UAST to compare.
-        :param uast2: The bblfsh.Node of the second UAST to compare.
+        The nodes of both trees are paired in the depth-first order and the children of each \
+        pair are compared.
+
+        :param uast1: The bblfsh.Node or FlatUAST of the first UAST to compare.
+        :param uast2: The bblfsh.Node or FlatUAST of the second UAST to compare.
         :return: True if the 2 input UASTs are identical and False otherwise.
         """
-        queue1 = [uast1]
-        queue2 = [uast2]
-        while queue1 or queue2:
-            try:
-                node1 = queue1.pop()
-                node2 = queue2.pop()
-            except IndexError:
+        if not isinstance(uast1, FlatUAST):
+            uast1 = FlatUAST(uast1)
+        if not isinstance(uast2, FlatUAST):
+            uast2 = FlatUAST(uast2)
+        if len(uast1) != len(uast2):
+            return False
+        # the depth-first traversal with a stack visits the nodes in the reverse postorder
+        nodes1 = numpy.argsort(-uast1.postorder())
+        nodes2 = numpy.argsort(-uast2.postorder())
+        counts = numpy.minimum(uast1.children_count[nodes1], uast2.children_count[nodes2])
+        pairs = numpy.repeat(numpy.arange(len(counts)), counts)
+        shifts = numpy.arange(len(pairs)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        children1 = uast1.children_indices[uast1.children_indptr[nodes1[pairs]] + shifts]
+        children2 = uast2.children_indices[uast2.children_indptr[nodes2[pairs]] + shifts]
+        for column, table in (("roles", "role_sets"), ("internal_type", "internal_types"),
+                              ("token", "tokens")):
+            remap = FlatUAST.remap(getattr(uast1, table), getattr(uast2, table))
+            if not numpy.array_equal(getattr(uast1, column)[children1],
+                                     remap[getattr(uast2, column)[children2]]):
                 return False
-            for child1, child2 in zip(node1.children, node2.children):
-                if (child1.roles != child2.roles or child1.internal_type != child2.internal_type
-                        or child1.token != child2.token):
-                    return False
-            queue1.extend(node1.children)
-            queue2.extend(node2.children)
         return True
@@ -1,5 +1,8 @@
 """Commonly used utils."""
-from typing import Any, Dict, Iterable, Sequence
+import functools
+import itertools
+import multiprocessing
+from typing import Any, Callable, Dict, Iterable, List, Sequence
 import warnings
 
 from lookout.core.api.service_analyzer_pb2 import Comment
@@ -11,6 +14,10 @@ import sklearn.metrics
 
 warnings.filterwarnings("ignore", category=UndefinedMetricWarning)
 
+# The states which are inherited by the processes forked in map_forked(), by call
+_forked_states = {}  # type: Dict[int, Any]
+_forked_states_counter = itertools.count()
+
 
 class FakeDataStub:
     """Fake data source."""
@@ -81,3 +88,65 @@ def get_classification_report(y_pred: numpy.ndarray, y_true: numpy.ndarray,
             "report_full": report_full,
             "confusion_matrix": confusion_matrix,
             "target_names": target_names}
+
+
+def get_processes_number(n_jobs: int) -> int:
+    """
+    Convert the number of jobs to the number of processes.
+
+    :param n_jobs: number of processes. Negative values are counted from the number of \
+                   CPUs like in joblib: -1 means all the CPUs.
+    :return: Positive number of processes.
+    """
+    if n_jobs < 0:
+        return max(1, multiprocessing.cpu_count() + 1 + n_jobs)
+    return max(1, n_jobs)
+
+
+def can_fork() -> bool:
+    """
+    Check whether the worker processes can be forked from the current process.
+
+    The daemonic processes, e.g. the workers of another pool, cannot have children.
+
+    :return: True if `map_forked()` can run the function in several processes.
+    """
+    return "fork" in multiprocessing.get_all_start_methods() and \
+        not multiprocessing.current_process().daemon
+
+
+def _call_forked(token: int, func: Callable[[Any, Any], Any], item: Any) -> Any:
+    return func(_forked_states[token], item)
+
+
+def map_forked(func: Callable[[Any, Any], Any], items: Sequence[Any], state: Any,
+               n_processes: int) -> List[Any]:
+    """
+    Call the function on each item in a pool of forked processes.
+
+    The state is inherited by the forked processes copy-on-write, so it is not pickled: \
+    `func` must be a module-level function which takes the state and the item. Only the items \
+    and the results are transferred. The function is called in the current process if there \
+    is at most one process or item or `can_fork()` is False. The concurrent and the nested \
+    calls do not interfere since each of them registers its own state.
+
+    Forking a multi-threaded process, e.g. the analyzer service with its gRPC workers, \
+    can deadlock the children on the locks held by the other threads at the time of the fork, \
+    so several processes should be requested only in standalone runs such as the training.
+
+    :param func: Function to call with the state and each item.
+    :param items: Second arguments of the function.
+    :param state: First argument of the function which is shared by all the calls.
+    :param n_processes: Maximum number of processes.
+    :return: The results of the function in the order of the items.
+    """
+    n_processes = min(n_processes, len(items))
+    if n_processes <= 1 or not can_fork():
+        return [func(state, item) for item in items]
+    token = next(_forked_states_counter)
+    _forked_states[token] = state
+    try:
+        with multiprocessing.get_context("fork").Pool(n_processes) as pool:
+            return pool.map(functools.partial(_call_forked, token, func), items, chunksize=1)
+    finally:
+        del _forked_states[token]
@@ -1,7 +1,11 @@
 """Defines VirtualNode - a class which backs any source code token."""
-from typing import Callable, Iterable, Mapping, NamedTuple, Optional, Set, Tuple, Union
+import struct
+import sys
+from typing import (Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional,  # noqa: F401
+                    Sequence, Set, Tuple, Union)
 
 import bblfsh
+import numpy
 
 from lookout.style.format.classes import CLASS_REPRESENTATIONS, EMPTY_CLS
 
@@ -32,8 +36,20 @@ class VirtualNode:
     Represent either a real UAST node or an imaginary token.
 
     The class instance should be considered as read-only.
+
+    Millions of instances are alive during the training, so they are kept compact: there is \
+    no instance `__dict__`, both positions are packed into a single bytes object and the paths \
+    are interned so that all the nodes of a file share the same string.
     """
 
+    # y_old and applied_rule are assigned by CodeGenerator to the copies of the nodes and stay
+    # unset otherwise, so that hasattr() tells whether the label was changed.
+    __slots__ = ("value", "_positions", "node", "y", "is_accumulated_indentation", "_path",
+                 "y_old", "applied_rule")
+
+    _POSITIONS = struct.Struct("<6i")
+    _POSITION = struct.Struct("<3i")
+
     def __init__(self, value: str, start: Position, end: Position,
                  *, node: bblfsh.Node = None, y: Optional[Tuple[int, ...]] = None,
                  is_accumulated_indentation: bool=False,  path: str = None) -> None:
@@ -57,13 +73,40 @@ class VirtualNode:
         assert y is None or set(y) <= EMPTY_CLS or start.offset < end.offset, "illegal empty node"
         assert not is_accumulated_indentation or y is None, "y can not be set for accumulated " \
                                                             "indentation node."
-        self.start = start
-        self.end = end
+        self._positions = self._POSITIONS.pack(*start, *end)
         self.node = node
         self.y = y
         self.is_accumulated_indentation = is_accumulated_indentation
         self.path = path
 
+    @property
+    def start(self) -> Position:
+        """Return the starting position of the token."""
+        return tuple.__new__(Position, self._POSITION.unpack_from(self._positions))
+
+    @start.setter
+    def start(self, value: Position) -> None:
+        self._positions = self._POSITIONS.pack(*value, *self.end)
+
+    @property
+    def end(self) -> Position:
+        """Return the ending position of the token."""
+        return tuple.__new__(Position, self._POSITION.unpack_from(
+            self._positions, self._POSITION.size))
+
+    @end.setter
+    def end(self, value: Position) -> None:
+        self._positions = self._POSITIONS.pack(*self.start, *value)
+
+    @property
+    def path(self) -> Optional[str]:
+        """Return the path to the related file."""
+        return self._path
+
+    @path.setter
+    def path(self, value: Optional[str]) -> None:
+        self._path = sys.intern(value) if value is not None else None
+
     def __str__(self) -> str:
         return self.value
 
@@ -79,8 +122,7 @@ class VirtualNode:
 
     def __eq__(self, other: "VirtualNode") -> bool:
         return (self.value == other.value
-                and self.start == other.start
-                and self.end == other.end
+                and self._positions == other._positions
                 and self.node == other.node
                 and self.y == other.y
                 and self.path == other.path)
@@ -172,3 +214,162 @@ class VirtualNode:
 
 
 AnyNode = Union[VirtualNode, bblfsh.Node]
+
+
+class VNodeTable:
+    """
+    Columnar representation of the `VirtualNode`-s of a single file.
+
+    Each attribute is a numpy array with one element per `VirtualNode`, so that the features \
+    are computed with whole-array expressions instead of Python loops over the nodes.
+    """
+
+    NO_LABEL = -1
+    """`label` of the nodes with `y` equal to None."""
+    UNKNOWN_LABEL = -2
+    """`label` of the nodes with `y` which is missing in the labels mapping."""
+
+    def __init__(self, vnodes: Sequence[VirtualNode], parents: Mapping[int, bblfsh.Node], *,
+                 class_sequences_to_labels: Mapping[Tuple[int, ...], int],
+                 reserved_index: Mapping[str, int], internal_types_index: Mapping[str, int],
+                 roles_by_id: numpy.ndarray) -> None:
+        """
+        Construct a VNodeTable.
+
+        :param vnodes: `VirtualNode`-s of the file.
+        :param parents: Mapping from the id of a UAST node to its parent UAST node.
+        :param class_sequences_to_labels: Mapping from the class sequences to the labels.
+        :param reserved_index: Mapping from the reserved tokens to their indices.
+        :param internal_types_index: Mapping from the UAST internal types to their indices.
+        :param roles_by_id: Mapping from the bblfsh role ids to the role indices, -1 for the \
+                            unknown roles.
+        """
+        self.vnodes = vnodes
+        positions = numpy.frombuffer(b"".join(vnode._positions for vnode in vnodes),
+                                     dtype="<i4").reshape(-1, 6).astype(numpy.int64)
+        self.start_offset, self.start_line, self.start_col, \
+            self.end_offset, self.end_line, self.end_col = positions.T
+        self.length = self.end_offset - self.start_offset
+        self.label = numpy.array(
+            [self.NO_LABEL if vnode.y is None
+             else class_sequences_to_labels.get(vnode.y, self.UNKNOWN_LABEL)
+             for vnode in vnodes], dtype=numpy.int32)
+        self.reserved = numpy.array([reserved_index.get(vnode.value, -1) for vnode in vnodes],
+                                    dtype=numpy.int32)
+        self.has_node = numpy.array([vnode.node is not None for vnode in vnodes], dtype=bool)
+        # the distinct UAST nodes are interned so that their string attributes are looked up once
+        self.uast_nodes = []  # type: List[bblfsh.Node]
+        self._internal_types_index = internal_types_index
+        self._roles_by_id = roles_by_id
+        self._uast_index = {}  # type: Dict[int, int]
+        self._uast_internal_type = []  # type: List[int]
+        self._uast_roles = []  # type: List[Sequence[int]]
+        self._uast_arrays = None  # type: Optional[Tuple[numpy.ndarray, ...]]
+        self.node = numpy.full(len(vnodes), -1, dtype=numpy.int32)
+        self.parent = numpy.full(len(vnodes), -1, dtype=numpy.int32)
+        self.parents = []  # type: List[bblfsh.Node]
+        parents_index = {}  # type: Dict[int, int]
+        for i in numpy.flatnonzero(self.has_node).tolist():
+            node = vnodes[i].node
+            self.node[i] = self._intern_uast_node(node)
+            parent = parents.get(id(node))
+            if parent is None:
+                continue
+            try:
+                self.parent[i] = parents_index[id(parent)]
+            except KeyError:
+                self.parent[i] = parents_index[id(parent)] = len(self.parents)
+                self.parents.append(parent)
+        self.internal_type = numpy.full(len(vnodes), -1, dtype=numpy.int32)
+        self.internal_type[self.has_node] = self.uast_internal_type[self.node[self.has_node]]
+        self._index = {id(vnode): i for i, vnode in enumerate(vnodes)}
+        self._rows_cache = {}  # type: Dict[int, Tuple[Sequence, numpy.ndarray]]
+        self._uast_rows_cache = {}  # type: Dict[int, Tuple[Sequence, numpy.ndarray]]
+
+    def __len__(self) -> int:
+        """Return the number of the nodes."""
+        return len(self.vnodes)
+
+    def rows(self, nodes: Sequence[Optional[VirtualNode]]) -> numpy.ndarray:
+        """
+        Find the positions of the nodes in the table.
+
+        The result is cached for the same sequence object because several features are usually \
+        computed on the same neighbours.
+
+        :param nodes: `VirtualNode`-s from this table or None-s.
+        :return: int64 array of the row indices, -1 stands for None.
+        """
+        try:
+            cached_nodes, rows = self._rows_cache[id(nodes)]
+            if cached_nodes is nodes:
+                return rows
+        except KeyError:
+            pass
+        index = self._index
+        rows = numpy.fromiter((-1 if node is None else index[id(node)] for node in nodes),
+                              dtype=numpy.int64, count=len(nodes))
+        self._rows_cache[id(nodes)] = nodes, rows
+        return rows
+
+    def uast_rows(self, nodes: Sequence[Optional[bblfsh.Node]]) -> numpy.ndarray:
+        """
+        Find the positions of the UAST nodes in `uast_nodes`. The new nodes are interned.
+
+        The result is cached for the same sequence object like in `rows()`.
+
+        :param nodes: UAST nodes or None-s.
+        :return: int64 array of the positions, -1 stands for None.
+        """
+        try:
+            cached_nodes, rows = self._uast_rows_cache[id(nodes)]
+            if cached_nodes is nodes:
+                return rows
+        except KeyError:
+            pass
+        rows = numpy.fromiter((-1 if node is None else self._intern_uast_node(node)
+                               for node in nodes), dtype=numpy.int64, count=len(nodes))
+        self._uast_rows_cache[id(nodes)] = nodes, rows
+        return rows
+
+    @property
+    def uast_internal_type(self) -> numpy.ndarray:
+        """Return the internal type indices of `uast_nodes`, -1 for the unknown types."""
+        return self._get_uast_arrays()[0]
+
+    @property
+    def uast_roles(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Return the role indices of `uast_nodes` in the CSR format.
+
+        :return: Pointers to the beginning of the roles of each node and the concatenated role \
+                 indices, -1 for the unknown roles.
+        """
+        return self._get_uast_arrays()[1:]
+
+    def _intern_uast_node(self, node: bblfsh.Node) -> int:
+        try:
+            return self._uast_index[id(node)]
+        except KeyError:
+            row = self._uast_index[id(node)] = len(self.uast_nodes)
+            self.uast_nodes.append(node)
+            self._uast_internal_type.append(
+                self._internal_types_index.get(node.internal_type, -1))
+            self._uast_roles.append(node.roles)
+            self._uast_arrays = None
+            return row
+
+    def _get_uast_arrays(self) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        if self._uast_arrays is None:
+            counts = numpy.fromiter(map(len, self._uast_roles), dtype=numpy.int64,
+                                    count=len(self._uast_roles))
+            indptr = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+            numpy.cumsum(counts, out=indptr[1:])
+            role_ids = numpy.fromiter((role_id for roles in self._uast_roles for role_id in roles),
+                                      dtype=numpy.int64, count=int(indptr[-1]))
+            roles = numpy.full(len(role_ids), -1, dtype=numpy.int32)
+            known = role_ids < len(self._roles_by_id)
+            roles[known] = self._roles_by_id[role_ids[known]]
+            self._uast_arrays = (numpy.array(self._uast_internal_type, dtype=numpy.int32),
+                                 indptr, roles)
+        return self._uast_arrays
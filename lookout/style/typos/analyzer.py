@@ -10,10 +10,12 @@ from lookout.core.data_requests import DataService, \
     with_changed_uasts_and_contents, with_uasts_and_contents
 from lookout.core.lib import extract_changed_nodes, files_by_language, filter_files, find_new_lines
 from lookout.sdk.service_data_pb2 import Change, File
+import numpy
 import pandas
-from sourced.ml.algorithms import TokenParser, uast2sequence
+from sourced.ml.algorithms import TokenParser
 
 from lookout.style.common import merge_dicts
+from lookout.style.flat_uast import FlatUAST
 from lookout.style.format.utils import generate_comment
 from lookout.style.typos.corrector_manager import TyposCorrectorManager
 from lookout.style.typos.utils import Candidate, Columns, flatten_df_by_column
@@ -115,11 +117,12 @@ class IdTyposAnalyzer(Analyzer):
                     old_identifiers = set()
                 else:
                     lines = find_new_lines(prev_file, file)
-                    old_identifiers = {
-                        node.token for node in uast2sequence(prev_file.uast)
-                        if bblfsh.role_id("IDENTIFIER") in node.roles
-                        and bblfsh.role_id("IMPORT") not in node.roles and node.token
-                    }
+                    prev_uast = FlatUAST(prev_file.uast)
+                    identifiers = (prev_uast.role_mask(bblfsh.role_id("IDENTIFIER")) &
+                                   ~prev_uast.role_mask(bblfsh.role_id("IMPORT")) &
+                                   (prev_uast.token != 0))
+                    old_identifiers = {prev_uast.tokens[token]
+                                       for token in numpy.unique(prev_uast.token[identifiers])}
                 changed_nodes = extract_changed_nodes(file.uast, lines)
                 new_identifiers = [node for node in changed_nodes
                                    if bblfsh.role_id("IDENTIFIER") in node.roles and